@@ -11,6 +11,7 @@ from jsoneditor.forms import JSONEditor
 from waldur_core.core.admin import ExecutorAdminAction
 
 from . import models, executors
+from .workspace_storage_service import WorkspaceStorageService
 
 
 class ChangePlaybookParameterInline(admin.TabularInline):
@@ -80,7 +81,7 @@ class AddPlaybookAdminForm(forms.ModelForm):
         self.instance.workspace = models.Playbook.generate_workspace_path()
         archive = self.cleaned_data.pop('archive')
         zip_file = ZipFile(archive)
-        zip_file.extractall(self.instance.workspace)
+        self.instance.manifest = WorkspaceStorageService.extract(zip_file, self.instance.workspace)
         zip_file.close()
 
         return super(AddPlaybookAdminForm, self).save(commit)
@@ -0,0 +1,74 @@
+# This file is loaded by Ansible itself, not by Waldur, so it should import only Ansible and stdlib modules.
+from __future__ import absolute_import
+
+import json
+import os
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+EVENTS_FD_ENV_VARIABLE = 'WALDUR_ANSIBLE_EVENTS_FD'
+
+
+class CallbackModule(CallbackBase):
+    """
+    Writes one JSON document per line to the file descriptor passed in WALDUR_ANSIBLE_EVENTS_FD
+    for every started task and for every task result of every host.
+    """
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'waldur_events'
+    CALLBACK_NEEDS_WHITELIST = True
+
+    def __init__(self, *args, **kwargs):
+        super(CallbackModule, self).__init__(*args, **kwargs)
+        self.events_file = None
+        self.tasks_start_time = {}
+        events_fd = os.environ.get(EVENTS_FD_ENV_VARIABLE)
+        if events_fd:
+            self.events_file = os.fdopen(int(events_fd), 'w')
+
+    def emit(self, **event):
+        if not self.events_file:
+            return
+        self.events_file.write(json.dumps(event, default=str) + '\n')
+        self.events_file.flush()
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        now = time.time()
+        self.tasks_start_time[task._uuid] = now
+        self.emit(event='task_start', task=task.get_name(), started=now)
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self.v2_playbook_on_task_start(task, False)
+
+    def emit_task_end(self, result, status):
+        now = time.time()
+        started = self.tasks_start_time.get(result._task._uuid, now)
+        self.emit(
+            event='task_end',
+            task=result._task.get_name(),
+            host=result._host.get_name(),
+            status=status,
+            started=started,
+            finished=now,
+            duration=now - started,
+            payload=result._result,
+        )
+
+    def v2_runner_on_ok(self, result):
+        self.emit_task_end(result, 'changed' if result._result.get('changed') else 'ok')
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self.emit_task_end(result, 'ignored' if ignore_errors else 'failed')
+
+    def v2_runner_on_skipped(self, result):
+        self.emit_task_end(result, 'skipped')
+
+    def v2_runner_on_unreachable(self, result):
+        self.emit_task_end(result, 'unreachable')
+
+    def v2_playbook_on_stats(self, stats):
+        if self.events_file:
+            self.events_file.close()
+            self.events_file = None
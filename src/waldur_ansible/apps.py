@@ -1,5 +1,6 @@
 from django.apps import AppConfig
 from django.db.models import signals
+from django_fsm.signals import post_transition
 
 from . import handlers
 
@@ -22,3 +23,22 @@ class AnsibleConfig(AppConfig):
             sender=Playbook,
             dispatch_uid='waldur_ansible.handlers.resize_playbook_image',
         )
+
+        signals.post_save.connect(
+            handlers.invalidate_check_mode_previews,
+            sender=Playbook,
+            dispatch_uid='waldur_ansible.handlers.invalidate_check_mode_previews',
+        )
+
+        for model_name in ('Job',
+                           'PythonManagementInitializeRequest',
+                           'PythonManagementSynchronizeRequest',
+                           'PythonManagementFindVirtualEnvsRequest',
+                           'PythonManagementFindInstalledLibrariesRequest',
+                           'PythonManagementDeleteVirtualEnvRequest',
+                           'PythonManagementDeleteRequest'):
+            post_transition.connect(
+                handlers.finish_queued_execution,
+                sender=self.get_model(model_name),
+                dispatch_uid='waldur_ansible.handlers.finish_queued_execution_%s' % model_name,
+            )
@@ -1,3 +1,6 @@
+from waldur_ansible.wheelhouse_service import WheelhouseService
+
+
 
 def build_additional_extra_args(python_management_request):
     return dict(
@@ -9,6 +12,28 @@ def build_sync_request_extra_args(synchronization_request):
     extra_vars = dict(
         libraries_to_install=synchronization_request.libraries_to_install,
         libraries_to_remove=synchronization_request.libraries_to_remove,
+        libraries_to_upgrade=synchronization_request.libraries_to_upgrade,
     )
     extra_vars.update(build_additional_extra_args(synchronization_request))
+    extra_vars.update(build_wheelhouse_extra_args(synchronization_request.libraries_to_install))
     return extra_vars
+
+
+def build_batch_initialization_extra_args(initialization_request):
+    synchronization_requests = initialization_request.sychronization_requests.all()
+    extra_vars = dict(
+        virtual_environments=[
+            dict(name=synchronization_request.virtual_env_name,
+                 libraries_to_install=synchronization_request.libraries_to_install)
+            for synchronization_request in synchronization_requests
+        ]
+    )
+    extra_vars.update(build_wheelhouse_extra_args(
+        [library for synchronization_request in synchronization_requests
+         for library in synchronization_request.libraries_to_install]))
+    return extra_vars
+
+
+def build_wheelhouse_extra_args(libraries_to_install):
+    pip_find_links = WheelhouseService.prepare(libraries_to_install)
+    return dict(pip_find_links=pip_find_links) if pip_find_links else {}
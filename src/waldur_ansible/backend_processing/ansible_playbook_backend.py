@@ -6,7 +6,14 @@ import subprocess  # nosec
 
 import six
 from django.conf import settings
-from waldur_ansible.backend_processing.exceptions import AnsibleBackendError
+from waldur_ansible.backend_processing.check_mode_preview_service import CheckModePreviewService
+from waldur_ansible.backend_processing.exceptions import AnsibleBackendError, ProcessTimeoutError
+from waldur_ansible.backend_processing.job_events_recorder import JobEventsRecorder, CHECK_MODE_MARKER
+from waldur_ansible.backend_processing.output_sinks import StoredOutputSink
+from waldur_ansible.backend_processing.process_runner import iterate_process_output
+from waldur_ansible.backend_processing.ssh_multiplexing_service import SshMultiplexingService
+from waldur_ansible.models import JobEvent
+from waldur_ansible.scheduling_service import ExecutionHeartbeat
 from waldur_core.core.views import RefreshTokenMixin
 
 logger = logging.getLogger(__name__)
@@ -36,7 +43,8 @@ class AnsiblePlaybookBackend(object):
         # XXX: Passing arguments in following way is supported in Ansible>=1.2
         command.extend(['--extra-vars', json.dumps(extra_vars)])
 
-        command.extend(['--ssh-common-args', '-o UserKnownHostsFile=/dev/null'])
+        # Instances are created by the job itself, so connections are shared by all jobs and keyed by host only
+        command.extend(['--ssh-common-args', SshMultiplexingService.get_ssh_common_args()])
         result = command + [playbook_path]
         if tags:
             result.extend(['--tags', "\"" + tags + "\""])
@@ -64,23 +72,48 @@ class AnsiblePlaybookBackend(object):
             os.environ,
             ANSIBLE_LIBRARY=settings.WALDUR_ANSIBLE['ANSIBLE_LIBRARY'],
             ANSIBLE_HOST_KEY_CHECKING='False',
+            **SshMultiplexingService.get_environment(os.environ)
         )
+        output_sink = StoredOutputSink(job)
+        output_sink.reset()
+        events_recorder = JobEventsRecorder(job)
+        events_recorder.reset()
         try:
-            output = subprocess.check_output(command, stderr=subprocess.STDOUT, env=env)  # nosec
+            with ExecutionHeartbeat(job):
+                for output_line in iterate_process_output(command, env,
+                                                          events_handler=events_recorder.record,
+                                                          timeout=self.playbook.get_timeout(),
+                                                          idle_timeout=self.playbook.get_idle_timeout()):
+                    output_sink.write(output_line)
+        except ProcessTimeoutError as e:
+            logger.warning('Command "%s" has been terminated: %s', command_str, e)
+            output_sink.write('\nJob has been terminated: %s\n' % e)
+            raise
         except subprocess.CalledProcessError as e:
             logger.info('Failed to execute command "%s".', command_str)
-            job.output = e.output
-            job.save(update_fields=['output'])
             six.reraise(AnsibleBackendError, e)
         else:
             logger.info('Command "%s" was successfully executed.', command_str)
-            job.output = output
-            job.save(update_fields=['output'])
+        finally:
+            output_sink.close()
+            events_recorder.close()
+
+    def preview_job(self, job):
+        """
+        Returns resources which the job is going to create according to the check mode run.
+        Result of the previous run is reused if neither playbook nor job arguments have changed.
+        """
+        items = CheckModePreviewService.get(job)
+        if items is None:
+            self.run_job(job, check_mode=True)
+            items = self.decode_events(job)
+            CheckModePreviewService.store(job, items)
+        return items
 
     def decode_output(self, output):
         items = []
         for line in output.splitlines():
-            if 'WALDUR_CHECK_MODE' not in line:
+            if CHECK_MODE_MARKER not in line:
                 continue
             parts = line.split(' => ')
             if len(parts) != 2:
@@ -89,10 +122,31 @@ class AnsiblePlaybookBackend(object):
                 payload = json.loads(parts[1])
             except TypeError:
                 continue
-            if 'instance' in payload:
-                payload = payload['instance']
-            if 'WALDUR_CHECK_MODE' in payload:
-                del payload['WALDUR_CHECK_MODE']
+            payload = self._decode_check_mode_payload(payload)
             if payload:
                 items.append(payload)
         return items
+
+    def decode_events(self, job):
+        """
+        Same as decode_output, but uses events recorded during the last run of the job.
+        """
+        items = []
+        for payload in job.events.filter(check_mode=True).order_by('index').values_list('payload', flat=True):
+            payload = self._decode_check_mode_payload(payload)
+            if payload:
+                items.append(payload)
+        return items
+
+    def get_failed_events(self, job):
+        return job.events.filter(
+            event=JobEvent.Events.TASK_END,
+            status__in=(JobEvent.Statuses.FAILED, JobEvent.Statuses.UNREACHABLE),
+        ).order_by('index')
+
+    def _decode_check_mode_payload(self, payload):
+        if 'instance' in payload:
+            payload = payload['instance']
+        if CHECK_MODE_MARKER in payload:
+            del payload[CHECK_MODE_MARKER]
+        return payload
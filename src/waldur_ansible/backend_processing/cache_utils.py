@@ -1,19 +1,92 @@
-from django.core.cache import cache
+import logging
+import threading
+import uuid
+
+from django.db import connection
+from waldur_ansible.backend_processing.lock_backends import get_lock_backend
+from waldur_ansible.backend_processing.lock_registry import LockRegistry
+
+logger = logging.getLogger(__name__)
+
 
 def is_syncing(cache_key):
     """
     This function checks if task is already running.
     """
-    return cache.get(cache_key)
+    return cache_key in get_held_locks([cache_key])
+
+
+def get_held_locks(cache_keys):
+    """
+    This function checks many locks with a single request and returns set of keys of held locks.
+    """
+    return get_lock_backend().get_held_locks(cache_keys)
+
+
+def acquire_lock(cache_key, timeout, owner=''):
+    """
+    This function atomically sets lock with timeout if it is not set yet.
+    It returns token identifying the owner of the lock or None if lock is already held.
+    Owner is a description of the holder of the lock, which is reported by LockRegistry.
+    """
+    token = uuid.uuid4().hex
+    acquired = get_lock_backend().acquire(cache_key, token, timeout, owner)
+    LockRegistry.record_acquisition(cache_key, acquired)
+    return token if acquired else None
 
 
-def renew_task_status(cache_key, timeout):
+def extend_lock(cache_key, token, timeout):
     """
-    This function sets lock with timeout. Lock is valid only for 10 minutes.
-    Then it should be renewed. Otherwise, lock is released.
+    This function prolongs lock if it is still held by the owner of the token.
+    It returns False if lock has been released or has expired.
     """
-    cache.set(cache_key, True, timeout)
+    return get_lock_backend().extend(cache_key, token, timeout)
+
+
+def release_lock(cache_key, token):
+    """
+    This function removes lock only if it is held by the owner of the token,
+    so lock which has expired and has been acquired by another process is kept.
+    """
+    if token:
+        get_lock_backend().release(cache_key, token)
+
+
+class LockHeartbeat(object):
+    """
+    Extends locks in a background thread while long running operation holds them,
+    so that lock timeout can be short and locks of crashed worker expire soon.
+    """
+
+    def __init__(self, locks, timeout, interval=None):
+        self.locks = list(locks)
+        self.timeout = timeout
+        self.interval = interval or max(timeout / 3.0, 1)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if not self.locks:
+            return
+        self.thread = threading.Thread(target=self.run, name='lock-heartbeat')
+        self.thread.daemon = True
+        self.thread.start()
 
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
 
-def release_task_status(cache_key):
-    cache.set(cache_key, False)
+    def run(self):
+        try:
+            while self.locks and not self.stopped.wait(self.interval):
+                for cache_key, token in list(self.locks):
+                    try:
+                        if not extend_lock(cache_key, token, self.timeout):
+                            # Lock has been released by the owner or has expired
+                            self.locks.remove((cache_key, token))
+                    except Exception:  # noqa
+                        logger.exception('Unable to extend lock %s.', cache_key)
+        finally:
+            # Database lock backend opens connection for this thread
+            connection.close()
@@ -0,0 +1,107 @@
+import datetime
+import hashlib
+import json
+import os
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from waldur_ansible.models import CheckModePreview
+from waldur_ansible.workspace_storage_service import WorkspaceStorageService
+
+DEFAULT_CHECK_MODE_CACHE_TTL = 60 * 60
+DEFAULT_CHECK_MODE_CACHE_SIZE = 1000
+READ_SIZE = 64 * 1024
+
+
+class CheckModePreviewService(object):
+    """
+    Caches results of check mode runs, so that repeated previews of the same job
+    do not spawn ansible-playbook. Entries expire after CHECK_MODE_CACHE_TTL seconds,
+    least recently used entries are evicted when there are more than CHECK_MODE_CACHE_SIZE of them.
+    """
+
+    @staticmethod
+    def get(job):
+        ttl = CheckModePreviewService.get_ttl()
+        if not ttl:
+            return None
+
+        now = timezone.now()
+        key = CheckModePreviewService.get_key(job)
+        preview = CheckModePreview.objects.filter(
+            key=key, created__gte=now - datetime.timedelta(seconds=ttl)).first()
+        if preview is None:
+            return None
+
+        CheckModePreview.objects.filter(pk=preview.pk).update(last_used=now)
+        return preview.items
+
+    @staticmethod
+    def store(job, items):
+        if not CheckModePreviewService.get_ttl():
+            return
+
+        key = CheckModePreviewService.get_key(job)
+        CheckModePreview.objects.filter(key=key).delete()
+        try:
+            with transaction.atomic():
+                CheckModePreview.objects.create(playbook=job.playbook, key=key, items=items)
+        except IntegrityError:
+            # The same preview has been stored by concurrent run
+            pass
+        CheckModePreviewService.evict()
+
+    @staticmethod
+    def evict():
+        ttl = CheckModePreviewService.get_ttl()
+        CheckModePreview.objects.filter(created__lt=timezone.now() - datetime.timedelta(seconds=ttl)).delete()
+
+        size = settings.WALDUR_ANSIBLE.get('CHECK_MODE_CACHE_SIZE', DEFAULT_CHECK_MODE_CACHE_SIZE)
+        stale_ids = CheckModePreview.objects.order_by('-last_used', '-pk').values_list('pk', flat=True)[size:]
+        stale_ids = list(stale_ids)
+        if stale_ids:
+            CheckModePreview.objects.filter(pk__in=stale_ids).delete()
+
+    @staticmethod
+    def invalidate(playbook):
+        CheckModePreview.objects.filter(playbook=playbook).delete()
+
+    @staticmethod
+    def get_ttl():
+        return settings.WALDUR_ANSIBLE.get('CHECK_MODE_CACHE_TTL', DEFAULT_CHECK_MODE_CACHE_TTL)
+
+    @staticmethod
+    def get_key(job):
+        """
+        Everything that is passed to ansible-playbook and may affect the result of the check mode run,
+        except for credentials which are issued for every run.
+        """
+        parameters = dict(
+            workspace_hash=CheckModePreviewService.get_workspace_hash(job.playbook),
+            entrypoint=job.playbook.entrypoint,
+            arguments=job.arguments,
+            service_project_link=job.service_project_link_id,
+            ssh_public_key=job.ssh_public_key_id,
+            subnet=job.subnet_id,
+        )
+        return hashlib.sha256(json.dumps(parameters, sort_keys=True)).hexdigest()
+
+    @staticmethod
+    def get_workspace_hash(playbook):
+        if playbook.manifest:
+            return WorkspaceStorageService.get_manifest_hash(playbook.manifest)
+
+        # Workspaces extracted before content-addressed storage was introduced do not have manifest
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(playbook.workspace):
+            dirs.sort()
+            for file_name in sorted(files):
+                path = os.path.join(root, file_name)
+                digest.update(os.path.relpath(path, playbook.workspace).encode('utf-8'))
+                digest.update(b'\0')
+                with open(path, 'rb') as workspace_file:
+                    for data in iter(lambda: workspace_file.read(READ_SIZE), b''):
+                        digest.update(data)
+                digest.update(b'\0')
+        return digest.hexdigest()
@@ -1,6 +1,9 @@
+from django.db import transaction
+from django.db.models import Case, CharField, Value, When
 from waldur_ansible.backend_processing.locking_service import PythonManagementBackendLockingService
 from waldur_ansible.executors import PythonManagementRequestExecutor
 from waldur_ansible.models import VirtualEnvironment, PythonManagementFindInstalledLibrariesRequest, InstalledLibrary
+from waldur_ansible.output_storage_service import OutputStorageService
 from waldur_ansible.utils import execute_safely
 
 
@@ -12,40 +15,91 @@ class InstalledLibrariesExtractedInformationHandler(object):
             lines_post_processor.installed_libraries_after_modifications)
 
     def persist_installed_libraries_in_db(self, python_management, virtual_environment_name, existing_packages):
-        virtual_environment = execute_safely(
-            lambda: python_management.virtual_environments.get(name=virtual_environment_name))
-        if virtual_environment and not existing_packages:
-            virtual_environment.delete()
-            return
-
-        if not virtual_environment:
-            virtual_environment = VirtualEnvironment(name=virtual_environment_name, python_management=python_management)
-            virtual_environment.save()
-
-        persisted_packages = virtual_environment.installed_libraries.all()
-
-        self.save_newly_installed_libraries(
-            existing_packages, persisted_packages, virtual_environment)
-
-        self.delete_removed_libs(existing_packages, persisted_packages)
-
-    def delete_removed_libs(self, existing_packages, persisted_packages):
-        for persisted_package in persisted_packages:
-            if not self.isPackagePresent(persisted_package, existing_packages):
-                persisted_package.delete()
-
-    def save_newly_installed_libraries(self, existing_packages, persisted_installed_libraries, virtual_environment):
-        for installed_package in existing_packages:
-            if not self.isPackagePresent(installed_package, persisted_installed_libraries):
-                InstalledLibrary.objects.create(
-                    name=installed_package.name, version=installed_package.version,
-                    virtual_environment=virtual_environment)
-
-    def isPackagePresent(self, package, packages_list):
-        for p in packages_list:
-            if package.name == p.name and package.version == p.version:
-                return True
-        return False
+        with transaction.atomic():
+            virtual_environment = execute_safely(
+                lambda: python_management.virtual_environments.get(name=virtual_environment_name))
+            if virtual_environment and not existing_packages:
+                virtual_environment.delete()
+                return
+
+            if not virtual_environment:
+                virtual_environment = VirtualEnvironment(
+                    name=virtual_environment_name, python_management=python_management)
+                virtual_environment.save()
+
+            self.reconcile_installed_libraries(virtual_environment, existing_packages)
+
+    def reconcile_installed_libraries(self, virtual_environment, existing_packages):
+        """
+        Makes persisted libraries of the virtual environment match existing packages
+        using a constant number of queries regardless of the number of packages.
+        """
+        existing_versions = dict((package.name, package.version) for package in existing_packages)
+
+        persisted_libraries = {}
+        redundant_library_ids = []
+        for library_id, name, version in virtual_environment.installed_libraries.values_list('id', 'name', 'version'):
+            if name not in existing_versions:
+                redundant_library_ids.append(library_id)
+            elif name in persisted_libraries:
+                # Duplicates left by earlier reconciliations, row with matching version is preferred
+                if version == existing_versions[name]:
+                    redundant_library_ids.append(persisted_libraries[name][0])
+                    persisted_libraries[name] = (library_id, version)
+                else:
+                    redundant_library_ids.append(library_id)
+            else:
+                persisted_libraries[name] = (library_id, version)
+
+        if redundant_library_ids:
+            InstalledLibrary.objects.filter(id__in=redundant_library_ids).delete()
+
+        new_versions = dict((library_id, existing_versions[name])
+                            for name, (library_id, version) in persisted_libraries.items()
+                            if version != existing_versions[name])
+        if new_versions:
+            InstalledLibrary.objects.filter(id__in=new_versions.keys()).update(version=Case(
+                *[When(id=library_id, then=Value(version)) for library_id, version in new_versions.items()],
+                output_field=CharField()))
+
+        InstalledLibrary.objects.bulk_create([
+            InstalledLibrary(name=name, version=version, virtual_environment=virtual_environment)
+            for name, version in existing_versions.items() if name not in persisted_libraries
+        ])
+
+class BatchInitializationExtractedInformationHandler(InstalledLibrariesExtractedInformationHandler):
+    """
+    Applies results of virtual environments installed by the initialization request
+    to the corresponding synchronization requests, which are not executed separately.
+    """
+
+    def handle_extracted_information(self, request, lines_post_processor):
+        for synchronization_request in request.sychronization_requests.all():
+            virtual_env_name = synchronization_request.virtual_env_name
+            synchronization_request.begin_creating()
+            installed_libraries = lines_post_processor.installed_libraries_by_virtual_environment.get(virtual_env_name)
+            if installed_libraries is not None:
+                self.persist_installed_libraries_in_db(request.python_management, virtual_env_name, installed_libraries)
+                OutputStorageService.append(
+                    synchronization_request,
+                    'Virtual environment has been installed by initialization request %s.\n' % request.uuid.hex)
+                synchronization_request.set_ok()
+            else:
+                synchronization_request.error_message = lines_post_processor.failed_virtual_environments.get(
+                    virtual_env_name, 'Installation result of the virtual environment has not been reported.')
+                synchronization_request.set_erred()
+            synchronization_request.save()
+
+class CombinedDiscoveryExtractedInformationHandler(InstalledLibrariesExtractedInformationHandler):
+    def handle_extracted_information(self, request, lines_post_processor):
+        installed_libraries_by_virtual_environment = lines_post_processor.installed_libraries_by_virtual_environment
+        with transaction.atomic():
+            for virtual_env_name in lines_post_processor.installed_virtual_environments:
+                installed_libraries = installed_libraries_by_virtual_environment.get(virtual_env_name)
+                # Libraries of the virtual environment have not been listed, so persisted ones are kept
+                if installed_libraries is not None:
+                    self.persist_installed_libraries_in_db(
+                        request.python_management, virtual_env_name, installed_libraries)
 
 class PythonManagementDeletionRequestExtractedInformationHandler(object):
     def handle_extracted_information(self, request, lines_post_processor):
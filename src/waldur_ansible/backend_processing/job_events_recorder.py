@@ -0,0 +1,71 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from waldur_ansible.backend_processing.output_sinks import DEFAULT_OUTPUT_FLUSH_INTERVAL
+from waldur_ansible.models import JobEvent
+
+DEFAULT_JOB_EVENTS_BATCH_SIZE = 100
+CHECK_MODE_MARKER = 'WALDUR_CHECK_MODE'
+
+
+def to_datetime(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def contains_check_mode_marker(payload):
+    if not isinstance(payload, dict):
+        return False
+    instance = payload.get('instance')
+    return CHECK_MODE_MARKER in payload or (isinstance(instance, dict) and CHECK_MODE_MARKER in instance)
+
+
+class JobEventsRecorder(object):
+    """
+    Stores events reported by waldur_events callback plugin as JobEvent rows.
+    Events are inserted in batches, either when batch is full or flush interval has passed.
+    """
+
+    def __init__(self, job, batch_size=None, flush_interval=None):
+        self.job = job
+        self.batch_size = batch_size or settings.WALDUR_ANSIBLE.get(
+            'JOB_EVENTS_BATCH_SIZE', DEFAULT_JOB_EVENTS_BATCH_SIZE)
+        self.flush_interval = flush_interval or settings.WALDUR_ANSIBLE.get(
+            'OUTPUT_FLUSH_INTERVAL', DEFAULT_OUTPUT_FLUSH_INTERVAL)
+        self.pending_events = []
+        self.next_index = 0
+        self.last_flush_time = time.time()
+
+    def reset(self):
+        JobEvent.objects.filter(job=self.job).delete()
+
+    def record(self, event):
+        payload = event.get('payload') or {}
+        self.pending_events.append(JobEvent(
+            job=self.job,
+            index=self.next_index,
+            event=event.get('event', ''),
+            task=(event.get('task') or '')[:1024],
+            host=event.get('host') or '',
+            status=event.get('status') or '',
+            started=to_datetime(event.get('started')),
+            finished=to_datetime(event.get('finished')),
+            duration=event.get('duration'),
+            check_mode=contains_check_mode_marker(payload),
+            payload=payload,
+        ))
+        self.next_index += 1
+        if len(self.pending_events) >= self.batch_size or time.time() - self.last_flush_time >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.pending_events:
+            JobEvent.objects.bulk_create(self.pending_events)
+        self.pending_events = []
+        self.last_flush_time = time.time()
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,120 @@
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+DEFAULT_LOCK_BACKEND = 'waldur_ansible.backend_processing.lock_backends.CacheLockBackend'
+
+
+def get_lock_backend():
+    return import_string(settings.WALDUR_ANSIBLE.get('LOCK_BACKEND', DEFAULT_LOCK_BACKEND))
+
+
+def get_token(value):
+    # Locks set before owners were recorded are stored as plain tokens
+    return value.get('token') if isinstance(value, dict) else value
+
+
+class CacheLockBackend(object):
+    """
+    Stores locks in Django cache. Cache should be shared by all API and worker nodes,
+    otherwise locks are not exclusive. Value of the lock keeps its token together with
+    the owner and acquisition time, which are reported by get_locks. Keys of cache
+    are not enumerable, so held locks can not be listed without knowing their keys.
+    """
+    enumerable = False
+
+    @staticmethod
+    def get_held_locks(keys):
+        return set(key for key, value in cache.get_many(keys).items() if value)
+
+    @staticmethod
+    def get_locks(keys):
+        locks = {}
+        for key, value in cache.get_many(keys).items():
+            if not value:
+                continue
+            if not isinstance(value, dict):
+                value = {'token': value}
+            locks[key] = dict(owner=value.get('owner', ''), acquired=value.get('acquired'), expires=value.get('expires'))
+        return locks
+
+    @staticmethod
+    def acquire(key, token, timeout, owner=''):
+        now = timezone.now()
+        value = dict(token=token, owner=owner, acquired=now, expires=now + datetime.timedelta(seconds=timeout))
+        return cache.add(key, value, timeout)
+
+    @staticmethod
+    def extend(key, token, timeout):
+        value = cache.get(key)
+        if not value or get_token(value) != token:
+            return False
+        if not isinstance(value, dict):
+            value = {'token': value}
+        value['expires'] = timezone.now() + datetime.timedelta(seconds=timeout)
+        cache.set(key, value, timeout)
+        return True
+
+    @staticmethod
+    def release(key, token):
+        # Django cache does not provide compare-and-delete, lock held by the owner does not expire in between
+        if get_token(cache.get(key)) == token:
+            cache.delete(key)
+
+
+class DatabaseLockBackend(object):
+    """
+    Stores locks as rows of Lock table, unique key makes acquisition atomic for all nodes
+    connected to the same database. Lock acquired within transaction becomes visible to others
+    when transaction is committed, concurrent acquisition of the same key waits until then.
+    """
+    enumerable = True
+
+    @staticmethod
+    def get_held_locks(keys):
+        from waldur_ansible.models import Lock
+        return set(Lock.objects.filter(key__in=keys, expires__gt=timezone.now()).values_list('key', flat=True))
+
+    @staticmethod
+    def get_locks(keys):
+        from waldur_ansible.models import Lock
+        return DatabaseLockBackend.get_locks_by_key(Lock.objects.filter(key__in=keys, expires__gt=timezone.now()))
+
+    @staticmethod
+    def list_locks():
+        from waldur_ansible.models import Lock
+        return DatabaseLockBackend.get_locks_by_key(Lock.objects.filter(expires__gt=timezone.now()))
+
+    @staticmethod
+    def get_locks_by_key(locks):
+        return dict((key, dict(owner=owner, acquired=acquired, expires=expires)) for key, owner, acquired, expires in
+                    locks.values_list('key', 'owner', 'acquired', 'expires'))
+
+    @staticmethod
+    def acquire(key, token, timeout, owner=''):
+        from waldur_ansible.models import Lock
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                Lock.objects.filter(key=key, expires__lte=now).delete()
+                Lock.objects.create(key=key, token=token, owner=owner, acquired=now,
+                                    expires=now + datetime.timedelta(seconds=timeout))
+        except IntegrityError:
+            return False
+        return True
+
+    @staticmethod
+    def extend(key, token, timeout):
+        from waldur_ansible.models import Lock
+        now = timezone.now()
+        return bool(Lock.objects.filter(key=key, token=token, expires__gt=now)
+                    .update(expires=now + datetime.timedelta(seconds=timeout)))
+
+    @staticmethod
+    def release(key, token):
+        from waldur_ansible.models import Lock
+        Lock.objects.filter(key=key, token=token).delete()
@@ -0,0 +1,171 @@
+"""
+Observability of python management locks: owners of held locks are reported by lock backends,
+while counters of acquisitions, refusals and time requests have waited for their locks
+are kept in Django cache per lock class. Time requests have waited is measured from their creation,
+so it includes time spent in the queue and in the task broker, not only contention for locks.
+"""
+import logging
+import re
+
+from django.core.cache import cache
+from django.utils import timezone
+from waldur_ansible.backend_processing.lock_backends import get_lock_backend
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY_PREFIX = 'waldur_ansible_lock_metrics_'
+COUNTERS = ('acquired', 'refused', 'waits', 'wait_milliseconds')
+# Refusals of particular locks are counted for a day, so that recently contended python managements stand out
+KEY_REFUSALS_TIMEOUT = 24 * 60 * 60
+
+
+def get_lock_class(key):
+    """
+    Lock class is the part of the key preceding identifier of python management,
+    e.g. waldur_python_management_global for waldur_python_management_global_12.
+    """
+    return re.match(r'\D*', key).group().rstrip('_')
+
+
+def build_counter_key(lock_class, counter):
+    return METRICS_KEY_PREFIX + lock_class + '_' + counter
+
+
+def build_refusals_key(key):
+    return METRICS_KEY_PREFIX + 'refused_' + key
+
+
+def increment(counter_key, delta=1, timeout=None):
+    # Counter usually exists, so it is incremented with a single round trip to cache
+    try:
+        cache.incr(counter_key, delta)
+    except ValueError:
+        if not cache.add(counter_key, delta, timeout):
+            # Counter has been created concurrently
+            cache.incr(counter_key, delta)
+
+
+class LockRegistry(object):
+
+    @staticmethod
+    def record_acquisition(key, acquired):
+        try:
+            increment(build_counter_key(get_lock_class(key), 'acquired' if acquired else 'refused'))
+            if not acquired:
+                increment(build_refusals_key(key), timeout=KEY_REFUSALS_TIMEOUT)
+        except Exception:  # noqa
+            # Metrics should not break locking, e.g. if database lock backend is used while cache is down
+            logger.warning('Unable to record acquisition of lock %s.', key, exc_info=True)
+
+    @staticmethod
+    def record_wait(key, seconds):
+        """
+        Records time from creation of request until it has acquired the lock, which includes
+        time the request has spent in the queue and in the task broker.
+        """
+        lock_class = get_lock_class(key)
+        try:
+            increment(build_counter_key(lock_class, 'waits'))
+            increment(build_counter_key(lock_class, 'wait_milliseconds'), int(max(seconds, 0) * 1000))
+        except Exception:  # noqa
+            logger.warning('Unable to record wait time of lock %s.', key, exc_info=True)
+
+    @staticmethod
+    def can_list_locks():
+        return get_lock_backend().enumerable
+
+    @staticmethod
+    def list_locks():
+        """
+        Returns all held locks, it is supported only by enumerable lock backends.
+        Locks which are refused but not held are reported only by get_locks.
+        """
+        held_locks = get_lock_backend().list_locks()
+        return LockRegistry.build_locks(held_locks.keys(), held_locks)
+
+    @staticmethod
+    def get_locks(keys):
+        """
+        Returns held locks and locks refused within the last day among the given keys.
+        """
+        keys = list(keys)
+        return LockRegistry.build_locks(keys, get_lock_backend().get_locks(keys))
+
+    @staticmethod
+    def build_locks(keys, held_locks):
+        """
+        Longest held locks go first.
+        """
+        refusals = cache.get_many([build_refusals_key(key) for key in keys])
+        now = timezone.now()
+
+        locks = []
+        for key in keys:
+            lock = held_locks.get(key)
+            recent_refusals = refusals.get(build_refusals_key(key), 0)
+            if not lock and not recent_refusals:
+                continue
+            acquired = lock and lock['acquired']
+            expires = lock and lock['expires']
+            locks.append(dict(
+                key=key,
+                lock_class=get_lock_class(key),
+                held=bool(lock),
+                owner=lock['owner'] if lock else '',
+                acquired=acquired,
+                expires=expires,
+                held_for=(now - acquired).total_seconds() if acquired else None,
+                ttl=(expires - now).total_seconds() if expires else None,
+                recent_refusals=recent_refusals,
+            ))
+        return sorted(locks, key=lambda lock: (not lock['held'], -(lock['held_for'] or 0), -lock['recent_refusals']))
+
+    @staticmethod
+    def get_metrics(lock_classes):
+        counter_keys = dict(((lock_class, counter), build_counter_key(lock_class, counter))
+                            for lock_class in lock_classes for counter in COUNTERS)
+        values = cache.get_many(counter_keys.values())
+        metrics = {}
+        for (lock_class, counter), counter_key in counter_keys.items():
+            metrics.setdefault(lock_class, {})[counter] = values.get(counter_key, 0)
+        return metrics
+
+    @staticmethod
+    def format_metrics(metrics, locks=None):
+        """
+        Renders metrics in Prometheus text exposition format.
+        Number of held locks is rendered only if locks are given.
+        """
+
+        lines = [
+            '# HELP waldur_ansible_lock_acquisitions_total Attempts to acquire python management locks.',
+            '# TYPE waldur_ansible_lock_acquisitions_total counter',
+        ]
+        for lock_class in sorted(metrics):
+            for result in ('acquired', 'refused'):
+                lines.append('waldur_ansible_lock_acquisitions_total{lock_class="%s",result="%s"} %s'
+                             % (lock_class, result, metrics[lock_class][result]))
+        lines += [
+            '# HELP waldur_ansible_request_wait_seconds Time from creation of requests until they have acquired '
+            'their locks, including time spent in the queue and in the task broker.',
+            '# TYPE waldur_ansible_request_wait_seconds summary',
+        ]
+        for lock_class in sorted(metrics):
+            lines.append('waldur_ansible_request_wait_seconds_sum{lock_class="%s"} %s'
+                         % (lock_class, metrics[lock_class]['wait_milliseconds'] / 1000.0))
+            lines.append('waldur_ansible_request_wait_seconds_count{lock_class="%s"} %s'
+                         % (lock_class, metrics[lock_class]['waits']))
+        if locks is None:
+            return '\n'.join(lines) + '\n'
+
+        held_locks = dict((lock_class, 0) for lock_class in metrics)
+        for lock in locks:
+            if lock['held']:
+                held_locks[lock['lock_class']] = held_locks.get(lock['lock_class'], 0) + 1
+        lines += [
+            '# HELP waldur_ansible_locks_held Python management locks which are currently held.',
+            '# TYPE waldur_ansible_locks_held gauge',
+        ]
+        for lock_class in sorted(held_locks):
+            lines.append('waldur_ansible_locks_held{lock_class="%s"} %s' % (lock_class, held_locks[lock_class]))
+        return '\n'.join(lines) + '\n'
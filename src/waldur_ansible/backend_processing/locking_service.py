@@ -1,4 +1,7 @@
+from django.conf import settings
+from django.utils import timezone
 from waldur_ansible.backend_processing import cache_utils
+from waldur_ansible.backend_processing.lock_registry import LockRegistry, get_lock_class
 from waldur_ansible.models import PythonManagementInitializeRequest, PythonManagementSynchronizeRequest, \
     PythonManagementFindVirtualEnvsRequest, PythonManagementFindInstalledLibrariesRequest, \
     PythonManagementDeleteVirtualEnvRequest, PythonManagementDeleteRequest
@@ -13,6 +16,19 @@ PYTHON_MANAGEMENT_ENTRY_POINT_LOCK = 'waldur_python_management_entry_point_'
 PYTHON_MANAGEMENT_GLOBAL_LOCK = 'waldur_python_management_global_'
 PYTHON_MANAGEMENT_VIRTUAL_ENV_SYNCING_LOCK = 'waldur_python_management_'
 PYTHON_MANAGEMENT_ENTRY_POINT_LOCK_TIMEOUT = 120
+# Locks of processed requests are extended by heartbeat, so timeout only limits the lifetime of locks of crashed workers
+DEFAULT_PYTHON_MANAGEMENT_LOCK_TIMEOUT = 60
+LOCK_CLASSES = tuple(get_lock_class(lock) for lock in (
+    PYTHON_MANAGEMENT_ENTRY_POINT_LOCK, PYTHON_MANAGEMENT_GLOBAL_LOCK, PYTHON_MANAGEMENT_VIRTUAL_ENV_SYNCING_LOCK,
+    PIP_SYNCING_LOCK))
+
+
+def get_lock_timeout():
+    return settings.WALDUR_ANSIBLE.get('PYTHON_MANAGEMENT_LOCK_TIMEOUT', DEFAULT_PYTHON_MANAGEMENT_LOCK_TIMEOUT)
+
+
+def release_request_lock(request, lock):
+    cache_utils.release_lock(lock, getattr(request, 'processing_lock_tokens', {}).get(lock))
 
 class NullProcessingFinishedLockingHandler(object):
     def handle_on_processing_finished(self, request):
@@ -20,60 +36,110 @@ class NullProcessingFinishedLockingHandler(object):
 
 class RelatedToVirtualEnvRequestProcessingFinishedLockingHandler(object):
     def handle_on_processing_finished(self, request):
-        cache_utils.release_task_status(
+        release_request_lock(
+            request,
             PythonManagementBackendLockBuilder.build_related_to_virt_env_lock(
                 request.python_management, request.virtual_env_name))
 
 class GlobalRequestProcessingFinishedLockingHandler(object):
     def handle_on_processing_finished(self, request):
-        cache_utils.release_task_status(
-            PythonManagementBackendLockBuilder.build_global_lock(request.python_management))
+        release_request_lock(request, PythonManagementBackendLockBuilder.build_global_lock(request.python_management))
+
+
+class PythonManagementLocksState(object):
+    """
+    State of the global lock and locks of the given virtual environments of python management,
+    which is read by a single cache request, so that many requests can be checked at once.
+    """
+
+    def __init__(self, python_management, virtual_env_names=()):
+        self.virtual_env_names = set(virtual_env_names)
+        global_lock = PythonManagementBackendLockBuilder.build_global_lock(python_management)
+        virtual_env_locks = dict(
+            (PythonManagementBackendLockBuilder.build_related_to_virt_env_lock(python_management, name), name)
+            for name in self.virtual_env_names)
+        held_locks = cache_utils.get_held_locks([global_lock] + list(virtual_env_locks))
+        self.is_global_locked = global_lock in held_locks
+        self.locked_virtual_env_names = set(
+            virtual_env_locks[lock] for lock in held_locks if lock in virtual_env_locks)
+
+    def is_virtual_env_locked(self, virtual_env_name):
+        return self.is_global_locked or virtual_env_name in self.locked_virtual_env_names
 
 
 class NullProcessingAllowedDecider(object):
-    def is_processing_allowed(self, request):
+    def is_processing_allowed(self, request, locks_state=None):
         return True
 
 class RelatedToVirtualEnvProcessingAllowedDecider(object):
-    def is_processing_allowed(self, request):
-        virtual_env_lock = PythonManagementBackendLockBuilder.build_related_to_virt_env_lock(
-            request.python_management, request.virtual_env_name)
-        global_lock = PythonManagementBackendLockBuilder.build_global_lock(request.python_management)
-        return not cache_utils.is_syncing(virtual_env_lock) and not cache_utils.is_syncing(global_lock)
+    def is_processing_allowed(self, request, locks_state=None):
+        if locks_state is None or request.virtual_env_name not in locks_state.virtual_env_names:
+            locks_state = PythonManagementLocksState(request.python_management, [request.virtual_env_name])
+        return not locks_state.is_virtual_env_locked(request.virtual_env_name)
 
 class GlobalProcessingAllowedDecider(object):
-    def is_processing_allowed(self, request):
-        global_lock = PythonManagementBackendLockBuilder.build_global_lock(request.python_management)
-        return not cache_utils.is_syncing(global_lock)
+    def is_processing_allowed(self, request, locks_state=None):
+        if locks_state is None:
+            locks_state = PythonManagementLocksState(request.python_management)
+        return not locks_state.is_global_locked
 
 
 class NullSynchronizer(object):
     def lock(self, request):
-        pass
+        return {}
 
 class RelatedToVirtualEnvSynchronizer(object):
     def lock(self, request):
         virtual_env_lock = PythonManagementBackendLockBuilder.build_related_to_virt_env_lock(
             request.python_management, request.virtual_env_name)
-        cache_utils.renew_task_status(virtual_env_lock, PYTHON_MANAGEMENT_TIMEOUT)
+        token = cache_utils.acquire_lock(virtual_env_lock, get_lock_timeout(), owner=request.uuid.hex)
+        if not token:
+            return None
+        # Global lock may have been acquired after processing has been allowed
+        global_lock = PythonManagementBackendLockBuilder.build_global_lock(request.python_management)
+        if cache_utils.is_syncing(global_lock):
+            cache_utils.release_lock(virtual_env_lock, token)
+            LockRegistry.record_acquisition(global_lock, acquired=False)
+            return None
+        return {virtual_env_lock: token}
 
 class GlobalSynchronizer(object):
     def lock(self, request):
         global_lock = PythonManagementBackendLockBuilder.build_global_lock(request.python_management)
-        cache_utils.renew_task_status(global_lock, PYTHON_MANAGEMENT_TIMEOUT)
+        token = cache_utils.acquire_lock(global_lock, get_lock_timeout(), owner=request.uuid.hex)
+        return {global_lock: token} if token else None
 
 
 class PythonManagementBackendLockingService(object):
 
     @staticmethod
     def lock_for_processing(request):
+        """
+        Atomically acquires locks needed to process the request and returns False if they are held by others.
+        Tokens of acquired locks are kept by the request, so that only its processing can release them.
+        """
         synchronizer = PythonManagementBackendLockBuilder.intantiate_synchronizer(type(request))
-        return synchronizer.lock(request)
+        lock_tokens = synchronizer.lock(request)
+        if lock_tokens is None:
+            return False
+        request.processing_lock_tokens = lock_tokens
+        wait_time = (timezone.now() - request.created).total_seconds()
+        for lock in lock_tokens:
+            LockRegistry.record_wait(lock, wait_time)
+        return True
 
     @staticmethod
-    def is_processing_allowed(request):
+    def build_heartbeat(request):
+        return cache_utils.LockHeartbeat(getattr(request, 'processing_lock_tokens', {}).items(), get_lock_timeout())
+
+    @staticmethod
+    def is_processing_allowed(request, locks_state=None):
+        """
+        Locks state read in advance by PythonManagementLocksState may be given in order
+        to avoid cache requests when many requests of the same python management are checked.
+        """
         processing_allowed_decider = PythonManagementBackendLockBuilder.intantiate_processing_allowed_decider(type(request))
-        return processing_allowed_decider.is_processing_allowed(request)
+        return processing_allowed_decider.is_processing_allowed(request, locks_state)
 
     @staticmethod
     def handle_on_processing_finished(request):
@@ -127,6 +193,13 @@ class PythonManagementBackendLockBuilder(object):
             .get(python_management_request_class)
         return locking_handler_class()
 
+    @staticmethod
+    def build_locks(persisted_python_management, virtual_env_names=()):
+        return [PythonManagementBackendLockBuilder.build_entry_point_lock(persisted_python_management),
+                PythonManagementBackendLockBuilder.build_global_lock(persisted_python_management)] \
+            + [PythonManagementBackendLockBuilder.build_related_to_virt_env_lock(persisted_python_management, name)
+               for name in virtual_env_names]
+
     @staticmethod
     def build_related_to_virt_env_lock(persisted_python_management, virtual_env_name):
         return PYTHON_MANAGEMENT_VIRTUAL_ENV_SYNCING_LOCK + str(persisted_python_management.pk) + '_' + virtual_env_name
@@ -1,61 +1,137 @@
 
-import json
-
 class LibraryDs(object):
 
     def __init__(self, name, version):
         self.name = name
         self.version = version
 
-class InstalledLibrariesOutputLinesPostProcessor(object):
+def parse_installed_libraries(pip_freeze_lines):
+    installed_libraries = []
+    for installed_library_with_version in pip_freeze_lines:
+        name_and_version_parts = installed_library_with_version.split("==")
+        if name_and_version_parts[0] != "pkg-resources":
+            installed_libraries.append(LibraryDs(name=name_and_version_parts[0], version=name_and_version_parts[1]))
+    return installed_libraries
+
+
+class TaskResultsOutputLinesPostProcessor(object):
+    """
+    Base of post-processors which consume task results reported by waldur_events callback plugin
+    through a separate file descriptor, instead of parsing human readable output of the playbook.
+    Subclasses subscribe to results of tasks by mapping task names to names of their handler methods,
+    handlers receive result of the task as reported by Ansible. Results of REQUIRED_TASK_RESULTS must be
+    received, otherwise the playbook has not reported its results, e.g. because the callback plugin
+    has not been loaded, and missing results must not be taken for empty ones.
+    """
+
+    TASK_RESULT_HANDLERS = {}
+    REQUIRED_TASK_RESULTS = ()
+
+    def __init__(self):
+        self.received_task_results = set()
+
+    def post_process_line(self, output_line):
+        pass
+
+    def post_process_event(self, event):
+        if event.get('event') != 'task_end':
+            return
+        handler_name = self.TASK_RESULT_HANDLERS.get(event.get('task'))
+        if handler_name:
+            getattr(self, handler_name)(event.get('task'), event.get('payload') or {})
+
+    def get_missing_task_results(self):
+        return [task for task in self.REQUIRED_TASK_RESULTS if task not in self.received_task_results]
+
+
+class InstalledLibrariesOutputLinesPostProcessor(TaskResultsOutputLinesPostProcessor):
 
     INSTALLED_LIBRARIES_AFTER_MODIFICATIONS_TASK = "Final list of all installed libraries in the venv"
 
+    TASK_RESULT_HANDLERS = {
+        INSTALLED_LIBRARIES_AFTER_MODIFICATIONS_TASK: 'handle_installed_libraries',
+    }
+    REQUIRED_TASK_RESULTS = (INSTALLED_LIBRARIES_AFTER_MODIFICATIONS_TASK,)
+
     def __init__(self):
-        self.stop_line_processing = False
-        self.next_line_contains_installed_libraries_after_modifications = False
+        TaskResultsOutputLinesPostProcessor.__init__(self)
         self.installed_libraries_after_modifications = []
         self.installed_libraries_before_modifications = []
 
-    def post_process_line(self, output_line):
-        if not self.stop_line_processing:
-            if not self.next_line_contains_installed_libraries_after_modifications:
-                if InstalledLibrariesOutputLinesPostProcessor.INSTALLED_LIBRARIES_AFTER_MODIFICATIONS_TASK in output_line:
-                    self.next_line_contains_installed_libraries_after_modifications = True
-            else:
-                ip_and_command_info_parts = output_line.split(" => ")
-                command_info = json.loads(ip_and_command_info_parts[1])
-                installed_libraries_with_versions = command_info["stdout_lines"]
-
-                for installed_library_with_version in installed_libraries_with_versions:
-                    name_and_version_parts = installed_library_with_version.split("==")
-                    if name_and_version_parts[0] != "pkg-resources":
-                        self.installed_libraries_after_modifications.append(
-                            LibraryDs(name=name_and_version_parts[0], version=name_and_version_parts[1]))
-                self.stop_line_processing = True
-
-class InstalledVirtualEnvironmentsOutputLinesPostProcessor(object):
+    def handle_installed_libraries(self, task, result):
+        if 'stdout_lines' in result:
+            self.received_task_results.add(task)
+            self.installed_libraries_after_modifications = parse_installed_libraries(result['stdout_lines'])
+
+
+class InstalledVirtualEnvironmentsOutputLinesPostProcessor(TaskResultsOutputLinesPostProcessor):
 
     INSTALLED_VIRTUAL_ENVIRONMENTS_TASK = "list all installed virtual environments"
 
+    TASK_RESULT_HANDLERS = {
+        INSTALLED_VIRTUAL_ENVIRONMENTS_TASK: 'handle_installed_virtual_environments',
+    }
+    REQUIRED_TASK_RESULTS = (INSTALLED_VIRTUAL_ENVIRONMENTS_TASK,)
+
     def __init__(self):
-        self.stop_line_processing = False
-        self.next_line_contains_installed_virtual_environments = False
+        TaskResultsOutputLinesPostProcessor.__init__(self)
         self.installed_virtual_environments = []
 
-    def post_process_line(self, output_line):
-        if not self.stop_line_processing:
-            if not self.next_line_contains_installed_virtual_environments:
-                if InstalledVirtualEnvironmentsOutputLinesPostProcessor.INSTALLED_VIRTUAL_ENVIRONMENTS_TASK in output_line:
-                    self.next_line_contains_installed_virtual_environments = True
-            else:
-                ip_and_command_info_parts = output_line.split(" => ")
-                command_info = json.loads(ip_and_command_info_parts[1])
-                installed_virtual_envs = command_info["stdout_lines"]
-
-                for installed_virtual_env in installed_virtual_envs:
-                    self.installed_virtual_environments.append(installed_virtual_env)
-                self.stop_line_processing = True
+    def handle_installed_virtual_environments(self, task, result):
+        if 'stdout_lines' in result:
+            self.received_task_results.add(task)
+            self.installed_virtual_environments = list(result['stdout_lines'])
+
+
+class BatchInitializationOutputLinesPostProcessor(TaskResultsOutputLinesPostProcessor):
+    """
+    Collects results of the loop over virtual environments.
+    Every item of the final task result contains name of the virtual environment and either
+    list of installed libraries or failure message.
+    """
+
+    TASK_RESULT_HANDLERS = {
+        InstalledLibrariesOutputLinesPostProcessor.INSTALLED_LIBRARIES_AFTER_MODIFICATIONS_TASK:
+            'handle_installed_libraries_by_virtual_environment',
+    }
+    REQUIRED_TASK_RESULTS = (InstalledLibrariesOutputLinesPostProcessor.INSTALLED_LIBRARIES_AFTER_MODIFICATIONS_TASK,)
+
+    def __init__(self):
+        TaskResultsOutputLinesPostProcessor.__init__(self)
+        self.installed_libraries_by_virtual_environment = {}
+        self.failed_virtual_environments = {}
+
+    def handle_installed_libraries_by_virtual_environment(self, task, result):
+        self.received_task_results.add(task)
+        for item_result in result.get('results', []):
+            item = item_result.get('item')
+            virtual_env_name = item.get('name') if isinstance(item, dict) else item
+            if item_result.get('failed') or item_result.get('rc'):
+                self.failed_virtual_environments[virtual_env_name] = \
+                    item_result.get('msg') or item_result.get('stderr', '')
+                continue
+
+            self.installed_libraries_by_virtual_environment[virtual_env_name] = \
+                parse_installed_libraries(item_result.get('stdout_lines', []))
+
+
+class CombinedDiscoveryOutputLinesPostProcessor(InstalledVirtualEnvironmentsOutputLinesPostProcessor,
+                                                BatchInitializationOutputLinesPostProcessor):
+    """
+    Collects installed virtual environments and libraries of each of them, which are listed
+    by the same playbook run as items of the loop over virtual environments.
+    """
+
+    TASK_RESULT_HANDLERS = dict(
+        InstalledVirtualEnvironmentsOutputLinesPostProcessor.TASK_RESULT_HANDLERS,
+        **BatchInitializationOutputLinesPostProcessor.TASK_RESULT_HANDLERS)
+    # Libraries are not listed if there are no virtual environments
+    REQUIRED_TASK_RESULTS = InstalledVirtualEnvironmentsOutputLinesPostProcessor.REQUIRED_TASK_RESULTS
+
+    def __init__(self):
+        InstalledVirtualEnvironmentsOutputLinesPostProcessor.__init__(self)
+        BatchInitializationOutputLinesPostProcessor.__init__(self)
+
 
 class NullOutputLinesPostProcessor(object):
     def post_process_line(self, output_line):
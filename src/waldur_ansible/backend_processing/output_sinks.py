@@ -0,0 +1,62 @@
+import time
+
+from django.conf import settings
+from waldur_ansible.output_storage_service import OutputStorageService
+
+DEFAULT_OUTPUT_FLUSH_SIZE = 64 * 1024
+DEFAULT_OUTPUT_FLUSH_INTERVAL = 5
+
+
+class BufferedOutputSink(object):
+    """
+    Collects output written by a running process and passes it to persist() in batches.
+    Buffer is flushed when either its size or the time since the previous flush exceeds
+    the configured limit, so the amount of output kept in memory stays bounded.
+    """
+
+    def __init__(self, flush_size=None, flush_interval=None):
+        self.flush_size = flush_size or settings.WALDUR_ANSIBLE.get(
+            'OUTPUT_FLUSH_SIZE', DEFAULT_OUTPUT_FLUSH_SIZE)
+        self.flush_interval = flush_interval or settings.WALDUR_ANSIBLE.get(
+            'OUTPUT_FLUSH_INTERVAL', DEFAULT_OUTPUT_FLUSH_INTERVAL)
+        self.buffer = []
+        self.buffered_size = 0
+        self.last_flush_time = time.time()
+
+    def write(self, data):
+        if not data:
+            return
+        self.buffer.append(data)
+        self.buffered_size += len(data)
+        if self.buffered_size >= self.flush_size or time.time() - self.last_flush_time >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.persist(''.join(self.buffer))
+        self.buffer = []
+        self.buffered_size = 0
+        self.last_flush_time = time.time()
+
+    def close(self):
+        self.flush()
+
+    def persist(self, data):
+        raise NotImplementedError()
+
+
+class StoredOutputSink(BufferedOutputSink):
+    """
+    Appends flushed output to the output storage of the job or python management request,
+    so accumulated output is neither kept in memory nor sent back to the database.
+    """
+
+    def __init__(self, scope, **kwargs):
+        super(StoredOutputSink, self).__init__(**kwargs)
+        self.scope = scope
+
+    def reset(self):
+        OutputStorageService.clear(self.scope)
+
+    def persist(self, data):
+        OutputStorageService.append(self.scope, data)
@@ -8,7 +8,7 @@ from waldur_ansible.constants import PythonManagementConstants
 
 
 class PipPackageListBackend(object):
-    def synchronize_pip_package_list(self):
+    def synchronize_pip_package_list(self, lock_token=None):
         try:
             parser = BeautifulSoup(urllib2.urlopen("https://pypi.python.org/simple/").read(), "lxml")
             package_names = parser.findAll('a')
@@ -26,4 +26,4 @@ class PipPackageListBackend(object):
 
                 r.zadd(PythonManagementConstants.PIP_LIBRARIES_HASH_TABLE_NAME, 0, package_name + PythonManagementConstants.PIP_LIBRARY_ENDING_SYMBOL)
         finally:
-            cache_utils.release_task_status(PIP_SYNCING_LOCK)
\ No newline at end of file
+            cache_utils.release_lock(PIP_SYNCING_LOCK, lock_token)
\ No newline at end of file
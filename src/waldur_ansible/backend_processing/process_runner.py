@@ -0,0 +1,265 @@
+import fcntl
+import json
+import logging
+import os
+import select
+import signal
+import subprocess  # nosec
+import time
+
+from django.conf import settings
+from six.moves import configparser
+from waldur_ansible import ansible_plugins
+from waldur_ansible.backend_processing.exceptions import ProcessTimeoutError
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+EVENTS_FD_ENV_VARIABLE = 'WALDUR_ANSIBLE_EVENTS_FD'
+EVENTS_CALLBACK_NAME = 'waldur_events'
+# Time given to the process group to exit after SIGTERM before it is killed with SIGKILL
+TERMINATION_GRACE_PERIOD = 10
+DEFAULT_CALLBACK_PLUGINS_PATH = '~/.ansible/plugins/callback:/usr/share/ansible/plugins/callback'
+try:
+    MAXFD = os.sysconf('SC_OPEN_MAX')
+except (AttributeError, ValueError):
+    MAXFD = 256
+
+
+def get_events_callback_environment(env):
+    """
+    Environment variables enabling callback plugin which reports task events in JSON.
+    Environment variables take precedence over ansible.cfg, so the plugin is added to callback plugins
+    configured by the environment or ansible.cfg instead of replacing them.
+    """
+    callback_plugins_path = os.path.join(os.path.dirname(ansible_plugins.__file__), 'callback')
+    configured_plugins_path = env.get('ANSIBLE_CALLBACK_PLUGINS') \
+        or get_ansible_config_value(env, 'defaults', 'callback_plugins') or DEFAULT_CALLBACK_PLUGINS_PATH
+    plugins_paths = configured_plugins_path.split(os.pathsep)
+    if callback_plugins_path not in plugins_paths:
+        plugins_paths.append(callback_plugins_path)
+
+    configured_callbacks = env.get('ANSIBLE_CALLBACKS_ENABLED') or env.get('ANSIBLE_CALLBACK_WHITELIST') \
+        or get_ansible_config_value(env, 'defaults', 'callbacks_enabled', 'callback_whitelist') or ''
+    callbacks = [callback.strip() for callback in configured_callbacks.split(',') if callback.strip()]
+    if EVENTS_CALLBACK_NAME not in callbacks:
+        callbacks.append(EVENTS_CALLBACK_NAME)
+
+    return dict(
+        ANSIBLE_CALLBACK_PLUGINS=os.pathsep.join(plugins_paths),
+        # Ansible < 2.11 uses the former variable, newer versions the latter one
+        ANSIBLE_CALLBACK_WHITELIST=','.join(callbacks),
+        ANSIBLE_CALLBACKS_ENABLED=','.join(callbacks),
+    )
+
+
+def get_ansible_config_value(env, section, *options):
+    """
+    Returns the first of options found in the section of ansible.cfg, which is looked up
+    in the same order as by Ansible itself, only the first found file is used.
+    """
+    config_paths = [env.get('ANSIBLE_CONFIG'), os.path.join(os.getcwd(), 'ansible.cfg'),
+                    os.path.join(env.get('HOME') or os.path.expanduser('~'), '.ansible.cfg'),
+                    '/etc/ansible/ansible.cfg']
+    for config_path in config_paths:
+        if not config_path or not os.path.isfile(config_path):
+            continue
+        parser = configparser.RawConfigParser()
+        try:
+            parser.read(config_path)
+        except configparser.Error as e:
+            logger.warning('Unable to read Ansible configuration %s: %s', config_path, e)
+            return None
+        for option in options:
+            if parser.has_option(section, option):
+                return parser.get(section, option)
+        return None
+    return None
+
+
+class LineSplitter(object):
+    """
+    Turns arbitrary chunks read from a pipe into complete lines.
+    """
+
+    def __init__(self):
+        self.incomplete_line = ''
+
+    def feed(self, data):
+        lines = (self.incomplete_line + data).splitlines(True)
+        if lines and not lines[-1].endswith('\n'):
+            self.incomplete_line = lines.pop()
+        else:
+            self.incomplete_line = ''
+        return lines
+
+    def finish(self):
+        lines = [self.incomplete_line] if self.incomplete_line else []
+        self.incomplete_line = ''
+        return lines
+
+
+def iterate_process_output(command, env, events_handler=None, timeout=None, idle_timeout=None):
+    """
+    Runs command and yields its combined stdout and stderr line by line as soon as
+    the lines are produced, so that the caller never has to hold the whole output.
+    If events_handler is given, it is called with every event reported by the
+    waldur_events callback plugin through a separate pipe.
+    Command is started in its own process group. If it runs longer than timeout seconds
+    or produces neither output nor events for idle_timeout seconds, the whole group
+    is terminated and ProcessTimeoutError is raised.
+    Raises CalledProcessError if the command exits with non-zero code.
+    Command is passed to the warm runner if WARM_RUNNER_SOCKET is configured and runner accepts it.
+    """
+    warm_runner_socket = settings.WALDUR_ANSIBLE.get('WARM_RUNNER_SOCKET')
+    if warm_runner_socket:
+        from waldur_ansible.backend_processing.warm_runner import open_warm_runner, WarmRunnerUnavailable
+        try:
+            output = open_warm_runner(warm_runner_socket, command, env, events_handler, timeout, idle_timeout)
+        except WarmRunnerUnavailable as e:
+            logger.warning('Command is executed without warm runner: %s', e)
+        else:
+            for line in output:
+                yield line
+            return
+
+    events_read_fd = events_write_fd = None
+    if events_handler:
+        events_read_fd, events_write_fd = os.pipe()
+        env = dict(env, **get_events_callback_environment(env))
+        env[EVENTS_FD_ENV_VARIABLE] = str(events_write_fd)
+
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,  # nosec
+                                   env=env, close_fds=events_write_fd is None,
+                                   preexec_fn=build_preexec_fn(events_write_fd))
+    finally:
+        if events_read_fd is not None:
+            os.close(events_write_fd)
+
+    output_fd = process.stdout.fileno()
+    splitters = {output_fd: LineSplitter()}
+    if events_read_fd is not None:
+        splitters[events_read_fd] = LineSplitter()
+
+    started = last_activity = time.time()
+    output_is_read = False
+    try:
+        while splitters:
+            # Deadlines are checked on every iteration, otherwise command which keeps printing is never stopped
+            check_deadlines(started, last_activity, timeout, idle_timeout)
+            select_timeout = get_select_timeout(started, last_activity, timeout, idle_timeout)
+            ready_fds, _, _ = select.select(list(splitters), [], [], select_timeout)
+            if not ready_fds:
+                continue
+
+            last_activity = time.time()
+            for fd in ready_fds:
+                data = os.read(fd, READ_SIZE)
+                if data:
+                    lines = splitters[fd].feed(data)
+                else:
+                    lines = splitters.pop(fd).finish()
+
+                if fd == output_fd:
+                    for line in lines:
+                        yield line
+                else:
+                    handle_events(lines, events_handler)
+        output_is_read = True
+    finally:
+        process.stdout.close()
+        if events_read_fd is not None:
+            os.close(events_read_fd)
+        # Output is not read till the end if the process has timed out or if the caller has stopped iteration
+        if not output_is_read:
+            terminate_process_group(process)
+
+    return_code = process.wait()
+    if return_code:
+        raise subprocess.CalledProcessError(return_code, command)
+
+
+def build_preexec_fn(inherited_fd=None):
+    """
+    Command is started in its own process group. Descriptors of the worker, such as database
+    and broker connections, are closed as with close_fds, except for the pipe of events.
+    """
+    def preexec_fn():
+        os.setsid()
+        if inherited_fd is not None:
+            close_inherited_fds(keep_fd=inherited_fd)
+            flags = fcntl.fcntl(inherited_fd, fcntl.F_GETFD)
+            fcntl.fcntl(inherited_fd, fcntl.F_SETFD, flags & ~fcntl.FD_CLOEXEC)
+    return preexec_fn
+
+
+def close_inherited_fds(keep_fd):
+    """
+    Descriptors which are closed on exec anyway are kept open, because subprocess reports
+    failure of exec through such a pipe.
+    """
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except OSError:
+        fds = range(3, MAXFD)
+    for fd in fds:
+        if fd < 3 or fd == keep_fd:
+            continue
+        try:
+            if not fcntl.fcntl(fd, fcntl.F_GETFD) & fcntl.FD_CLOEXEC:
+                os.close(fd)
+        except (IOError, OSError):
+            # Descriptor of the listed directory itself is already closed
+            pass
+
+
+def check_deadlines(started, last_activity, timeout, idle_timeout):
+    now = time.time()
+    if timeout and now - started >= timeout:
+        raise ProcessTimeoutError('Command has not finished in %s seconds.' % timeout)
+    if idle_timeout and now - last_activity >= idle_timeout:
+        raise ProcessTimeoutError('Command has not produced any output in %s seconds.' % idle_timeout)
+
+
+def get_select_timeout(started, last_activity, timeout, idle_timeout):
+    deadlines = []
+    if timeout:
+        deadlines.append(started + timeout)
+    if idle_timeout:
+        deadlines.append(last_activity + idle_timeout)
+    if not deadlines:
+        return None
+    return max(min(deadlines) - time.time(), 0)
+
+
+def terminate_process_group(process):
+    """
+    Terminates the process together with its children, e.g. SSH connections opened by Ansible.
+    """
+    kill_process_group(process, signal.SIGTERM)
+    deadline = time.time() + TERMINATION_GRACE_PERIOD
+    while process.poll() is None and time.time() < deadline:
+        time.sleep(0.1)
+    # Children may outlive the group leader, so the group is killed even if the leader has exited
+    kill_process_group(process, signal.SIGKILL)
+    process.wait()
+    logger.info('Process group %s has been terminated.', process.pid)
+
+
+def kill_process_group(process, sig):
+    try:
+        os.killpg(process.pid, sig)
+    except OSError:
+        # Process group does not exist anymore
+        pass
+
+
+def handle_events(lines, events_handler):
+    for line in lines:
+        try:
+            event = json.loads(line)
+        except ValueError:
+            logger.warning('Unable to decode Ansible event "%s".', line)
+            continue
+        events_handler(event)
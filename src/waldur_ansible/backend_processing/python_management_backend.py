@@ -1,25 +1,34 @@
 
 import json
 import os
+import re
 import subprocess  # nosec
 
 import logging
 import six
 from django.conf import settings
 from waldur_ansible.backend_processing.additional_extra_args_builders import build_sync_request_extra_args, \
-    build_additional_extra_args
-from waldur_ansible.backend_processing.exceptions import AnsibleBackendError
+    build_additional_extra_args, build_batch_initialization_extra_args
+from waldur_ansible.backend_processing.exceptions import AnsibleBackendError, ProcessTimeoutError
 from waldur_ansible.backend_processing.extracted_information_handler import NullExtractedInformationHandler, \
     InstalledLibrariesExtractedInformationHandler, PythonManagementFindVirtualEnvsRequestExtractedInformationHandler, \
-    PythonManagementDeletionRequestExtractedInformationHandler
+    PythonManagementDeletionRequestExtractedInformationHandler, BatchInitializationExtractedInformationHandler, \
+    CombinedDiscoveryExtractedInformationHandler
 from waldur_ansible.backend_processing.locking_service import PythonManagementBackendLockingService
 from waldur_ansible.backend_processing.output_lines_post_processors import NullOutputLinesPostProcessor, \
-    InstalledLibrariesOutputLinesPostProcessor, InstalledVirtualEnvironmentsOutputLinesPostProcessor
+    InstalledLibrariesOutputLinesPostProcessor, InstalledVirtualEnvironmentsOutputLinesPostProcessor, \
+    BatchInitializationOutputLinesPostProcessor, CombinedDiscoveryOutputLinesPostProcessor
+from waldur_ansible.backend_processing.output_sinks import StoredOutputSink
+from waldur_ansible.backend_processing.process_runner import iterate_process_output
+from waldur_ansible.backend_processing.ssh_multiplexing_service import SshMultiplexingService
 from waldur_ansible.constants import PythonManagementConstants
 from waldur_ansible.executors import PythonManagementRequestExecutor
 from waldur_ansible.models import PythonManagementInitializeRequest, PythonManagementSynchronizeRequest, \
     PythonManagementFindVirtualEnvsRequest, PythonManagementFindInstalledLibrariesRequest, \
     PythonManagementDeleteVirtualEnvRequest, PythonManagementDeleteRequest
+from waldur_ansible.output_storage_service import OutputStorageService
+from waldur_ansible.python_management_service import PythonManagementService
+from waldur_ansible.scheduling_service import ExecutionHeartbeat
 from waldur_core.core.views import RefreshTokenMixin
 
 logger = logging.getLogger(__name__)
@@ -27,17 +36,50 @@ logger = logging.getLogger(__name__)
 class PythonManagementBackend(object):
 
     def process_python_management_request(self, python_management_request):
-        PythonManagementBackendHelper.process_request(python_management_request)
+        with ExecutionHeartbeat(python_management_request):
+            PythonManagementBackendHelper.process_request(python_management_request)
 
 
 class PythonManagementInitializationBackend(PythonManagementBackend):
 
     def process_python_management_request(self, python_management_initialization_request):
+        if PythonManagementBackendHelper.is_batch_initialization(python_management_initialization_request):
+            try:
+                super(PythonManagementInitializationBackend, self).process_python_management_request(
+                    python_management_initialization_request)
+            except Exception as e:
+                self.set_synchronization_requests_erred(python_management_initialization_request, e)
+                raise
+            return
+
         super(PythonManagementInitializationBackend, self).process_python_management_request(python_management_initialization_request)
 
         for synchronization_request in python_management_initialization_request.sychronization_requests.all():
             PythonManagementRequestExecutor.execute(synchronization_request, async=True)
 
+    def set_synchronization_requests_erred(self, python_management_initialization_request, error):
+        for synchronization_request in python_management_initialization_request.sychronization_requests.filter(
+                state=PythonManagementSynchronizeRequest.States.CREATION_SCHEDULED):
+            synchronization_request.error_message = six.text_type(error)
+            synchronization_request.set_erred()
+            synchronization_request.save()
+
+
+class CombinedDiscovery(object):
+    """
+    Key of the request processing correspondences used when the request finding virtual environments
+    also lists libraries of every found virtual environment, instead of creating a separate request for each of them.
+    """
+
+
+class BatchInitialization(object):
+    """
+    Key of the request processing correspondences used when the initialization request installs
+    all virtual environments in a single playbook run. The playbook is expected to build virtual
+    environments concurrently and to report installed libraries of every virtual environment
+    as an item of the loop in the task which lists final libraries.
+    """
+
 class PythonManagementBackendHelper(object):
     REQUEST_TYPES_PLAYBOOKS_CORRESPONDENCE = {
         PythonManagementInitializeRequest: PythonManagementConstants.INSTALL_PYTHON_ENVIRONMENT,
@@ -46,6 +88,8 @@ class PythonManagementBackendHelper(object):
         PythonManagementFindInstalledLibrariesRequest: PythonManagementConstants.FIND_INSTALLED_LIBRARIES_FOR_VIRTUAL_ENVIRONMENT,
         PythonManagementDeleteVirtualEnvRequest: PythonManagementConstants.DELETE_VIRTUAL_ENVIRONMENT,
         PythonManagementDeleteRequest: PythonManagementConstants.DELETE_PYTHON_ENVIRONMENT,
+        BatchInitialization: PythonManagementConstants.INSTALL_PYTHON_ENVIRONMENT_WITH_VIRTUAL_ENVIRONMENTS,
+        CombinedDiscovery: PythonManagementConstants.FIND_INSTALLED_VIRTUAL_ENVIRONMENTS_WITH_LIBRARIES,
     }
 
     REQUEST_TYPES_EXTRA_ARGS_CORRESPONDENCE = {
@@ -55,6 +99,8 @@ class PythonManagementBackendHelper(object):
         PythonManagementFindInstalledLibrariesRequest: build_additional_extra_args,
         PythonManagementDeleteVirtualEnvRequest: build_additional_extra_args,
         PythonManagementDeleteRequest: None,
+        BatchInitialization: build_batch_initialization_extra_args,
+        CombinedDiscovery: None,
     }
 
     REQUEST_TYPES_POST_PROCESSOR_CORRESPONDENCE = {
@@ -64,6 +110,8 @@ class PythonManagementBackendHelper(object):
         PythonManagementFindInstalledLibrariesRequest: InstalledLibrariesOutputLinesPostProcessor,
         PythonManagementDeleteVirtualEnvRequest: NullOutputLinesPostProcessor,
         PythonManagementDeleteRequest: NullOutputLinesPostProcessor,
+        BatchInitialization: BatchInitializationOutputLinesPostProcessor,
+        CombinedDiscovery: CombinedDiscoveryOutputLinesPostProcessor,
     }
 
     REQUEST_TYPES_HANDLERS_CORRESPONDENCE = {
@@ -73,17 +121,25 @@ class PythonManagementBackendHelper(object):
         PythonManagementFindInstalledLibrariesRequest: InstalledLibrariesExtractedInformationHandler,
         PythonManagementDeleteVirtualEnvRequest: NullExtractedInformationHandler,
         PythonManagementDeleteRequest: PythonManagementDeletionRequestExtractedInformationHandler,
+        BatchInitialization: BatchInitializationExtractedInformationHandler,
+        CombinedDiscovery: CombinedDiscoveryExtractedInformationHandler,
     }
 
     @staticmethod
     def process_request(python_management_request):
-        if not PythonManagementBackendLockingService.is_processing_allowed(python_management_request):
-            python_management_request.output = \
-                'Whole environment or the particular virutal environnment is now being processed, request cannot be executed!'
-            python_management_request.save(update_fields=['output'])
+        if not PythonManagementBackendLockingService.is_processing_allowed(python_management_request) \
+                or not PythonManagementBackendLockingService.lock_for_processing(python_management_request):
+            OutputStorageService.append(
+                python_management_request,
+                'Whole environment or the particular virtual environment is now being processed, request cannot be executed!\n')
             return
+        lock_heartbeat = PythonManagementBackendLockingService.build_heartbeat(python_management_request)
+        lock_heartbeat.start()
         try:
-            PythonManagementBackendLockingService.lock_for_processing(python_management_request)
+            if not PythonManagementBackendHelper.refresh_libraries_delta(python_management_request):
+                OutputStorageService.append(
+                    python_management_request, 'Virtual environment already contains desired libraries.\n')
+                return
 
             command = PythonManagementBackendHelper.build_command(python_management_request)
             command_str = ' '.join(command)
@@ -93,26 +149,78 @@ class PythonManagementBackendHelper(object):
                 os.environ,
                 ANSIBLE_LIBRARY=settings.WALDUR_ANSIBLE['ANSIBLE_LIBRARY'],
                 ANSIBLE_HOST_KEY_CHECKING='False',
+                **SshMultiplexingService.get_environment(os.environ)
             )
-            request_class = type(python_management_request)
+            request_class = PythonManagementBackendHelper.get_request_class(python_management_request)
             lines_post_processor_instance = PythonManagementBackendHelper.intantiate_line_post_processor_class(
                 request_class)
             extracted_information_handler = PythonManagementBackendHelper.intantiate_extracted_information_handler_class(
                 request_class)
+            timeout, idle_timeout = PythonManagementBackendHelper.get_timeouts(request_class)
+            output_sink = StoredOutputSink(python_management_request)
             try:
-                for output_line in PythonManagementBackendHelper.process_output_iterator(command, env):
-                    python_management_request.output += output_line
-                    python_management_request.save(update_fields=['output'])
+                events_handler = getattr(lines_post_processor_instance, 'post_process_event', None)
+                for output_line in PythonManagementBackendHelper.process_output_iterator(
+                        command, env, events_handler=events_handler, timeout=timeout, idle_timeout=idle_timeout):
+                    output_sink.write(output_line)
                     lines_post_processor_instance.post_process_line(output_line)
+            except ProcessTimeoutError as e:
+                logger.warning('Command "%s" has been terminated: %s', command_str, e)
+                output_sink.write('\nRequest has been terminated: %s\n' % e)
+                raise
             except subprocess.CalledProcessError as e:
                 logger.info('Failed to execute command "%s".', command_str)
                 six.reraise(AnsibleBackendError, e)
-            else:
-                logger.info('Command "%s" was successfully executed.', command_str)
-                extracted_information_handler.handle_extracted_information(
-                    python_management_request, lines_post_processor_instance)
+            finally:
+                # Output is persisted before results are handled, because deletion of python management
+                # removes the request together with its output
+                output_sink.close()
+
+            logger.info('Command "%s" was successfully executed.', command_str)
+            PythonManagementBackendHelper.ensure_task_results_received(
+                python_management_request, lines_post_processor_instance)
+            extracted_information_handler.handle_extracted_information(
+                python_management_request, lines_post_processor_instance)
+            if isinstance(python_management_request, PythonManagementDeleteRequest):
+                SshMultiplexingService.close_connections(
+                    PythonManagementBackendHelper.get_ssh_key(python_management_request))
         finally:
+            lock_heartbeat.stop()
             PythonManagementBackendLockingService.handle_on_processing_finished(python_management_request)
+            python_management = python_management_request.python_management
+            # Python management is deleted together with the whole environment
+            if python_management.pk:
+                try:
+                    PythonManagementService.dispatch_deferred_requests(
+                        PythonManagementRequestExecutor, python_management)
+                except Exception:  # noqa
+                    # Error of the request should not be replaced, deferred requests are dispatched periodically anyway
+                    logger.exception('Unable to dispatch deferred requests of %s.', python_management)
+
+    @staticmethod
+    def ensure_task_results_received(python_management_request, lines_post_processor_instance):
+        """
+        Persisted state is not replaced by empty results if the playbook has not reported them.
+        """
+        get_missing_task_results = getattr(lines_post_processor_instance, 'get_missing_task_results', None)
+        missing_task_results = get_missing_task_results() if get_missing_task_results else []
+        if missing_task_results:
+            message = 'Results of tasks %s have not been reported by the playbook, ' \
+                      'make sure that waldur_events callback plugin is enabled.' \
+                      % ', '.join('"%s"' % task for task in missing_task_results)
+            OutputStorageService.append(python_management_request, message + '\n')
+            raise AnsibleBackendError(message)
+
+    @staticmethod
+    def refresh_libraries_delta(python_management_request):
+        """
+        Virtual environment is locked now, so libraries of deferred synchronization are computed
+        against the state which is not changed until the request is processed.
+        """
+        if not isinstance(python_management_request, PythonManagementSynchronizeRequest) \
+                or not python_management_request.recompute_libraries:
+            return True
+        return PythonManagementService.refresh_libraries_delta(python_management_request)
 
     @staticmethod
     def intantiate_line_post_processor_class(python_management_request_class):
@@ -129,34 +237,73 @@ class PythonManagementBackendHelper(object):
         return extracted_information_handler_instance
 
     @staticmethod
-    def process_output_iterator(command, env):
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, bufsize=1, env=env)
-        for stdout_line in iter(process.stdout.readline, ""):
-            yield stdout_line
-        process.stdout.close()
-        return_code = process.wait()
-        if return_code:
-            raise subprocess.CalledProcessError(return_code, command)
+    def get_timeouts(python_management_request_class):
+        playbook_name = PythonManagementBackendHelper.REQUEST_TYPES_PLAYBOOKS_CORRESPONDENCE \
+            .get(python_management_request_class)
+        timeouts = settings.WALDUR_ANSIBLE.get('PYTHON_MANAGEMENT_REQUEST_TIMEOUTS', {}).get(playbook_name, {})
+        timeout = timeouts.get('timeout', settings.WALDUR_ANSIBLE.get('PYTHON_MANAGEMENT_REQUEST_TIMEOUT'))
+        idle_timeout = timeouts.get('idle_timeout', settings.WALDUR_ANSIBLE.get('PYTHON_MANAGEMENT_REQUEST_IDLE_TIMEOUT'))
+        return timeout, idle_timeout
+
+    @staticmethod
+    def process_output_iterator(command, env, events_handler=None, timeout=None, idle_timeout=None):
+        return iterate_process_output(
+            command, env, events_handler=events_handler, timeout=timeout, idle_timeout=idle_timeout)
+
+    @staticmethod
+    def is_batch_initialization(python_management_request):
+        return isinstance(python_management_request, PythonManagementInitializeRequest) \
+            and settings.WALDUR_ANSIBLE.get('PYTHON_MANAGEMENT_BATCH_INITIALIZATION', False) \
+            and python_management_request.sychronization_requests.exists()
+
+    @staticmethod
+    def is_combined_discovery(python_management_request):
+        return isinstance(python_management_request, PythonManagementFindVirtualEnvsRequest) \
+            and settings.WALDUR_ANSIBLE.get('PYTHON_MANAGEMENT_COMBINED_DISCOVERY', False)
+
+    @staticmethod
+    def get_request_class(python_management_request):
+        if PythonManagementBackendHelper.is_batch_initialization(python_management_request):
+            return BatchInitialization
+        if PythonManagementBackendHelper.is_combined_discovery(python_management_request):
+            return CombinedDiscovery
+        return type(python_management_request)
+
+    @staticmethod
+    def get_playbook_arguments():
+        """
+        Unless PYTHON_MANAGEMENT_PLAYBOOK_ARGUMENTS is configured, arguments of jobs are used without verbosity flags.
+        """
+        playbook_arguments = settings.WALDUR_ANSIBLE.get('PYTHON_MANAGEMENT_PLAYBOOK_ARGUMENTS')
+        if playbook_arguments is not None:
+            return list(playbook_arguments)
+        return [argument for argument in settings.WALDUR_ANSIBLE.get('PLAYBOOK_ARGUMENTS') or []
+                if argument != '--verbose' and not re.match(r'^-v+$', argument)]
 
     @staticmethod
     def build_command(python_management_request):
         playbook_path = settings.WALDUR_ANSIBLE.get('PYTHON_MANAGEMENT_PLAYBOOKS_DIRECTORY') \
-            + PythonManagementBackendHelper.REQUEST_TYPES_PLAYBOOKS_CORRESPONDENCE.get(type(python_management_request)) \
+            + PythonManagementBackendHelper.REQUEST_TYPES_PLAYBOOKS_CORRESPONDENCE.get(
+                PythonManagementBackendHelper.get_request_class(python_management_request)) \
             + '.yml'
         PythonManagementBackendHelper.ensure_playbook_exists_or_raise(playbook_path)
 
         command = [settings.WALDUR_ANSIBLE.get('PLAYBOOK_EXECUTION_COMMAND', 'ansible-playbook')]
 
-        if settings.WALDUR_ANSIBLE.get('PLAYBOOK_ARGUMENTS'):
-            command.extend(settings.WALDUR_ANSIBLE.get('PLAYBOOK_ARGUMENTS'))
+        command.extend(PythonManagementBackendHelper.get_playbook_arguments())
 
         extraVars = PythonManagementBackendHelper.build_extra_vars(python_management_request)
         command.extend(['--extra-vars', extraVars])
 
-        command.extend(['--ssh-common-args', '-o UserKnownHostsFile=/dev/null'])
+        command.extend(['--ssh-common-args', SshMultiplexingService.get_ssh_common_args(
+            PythonManagementBackendHelper.get_ssh_key(python_management_request))])
 
         return command + [playbook_path]
 
+    @staticmethod
+    def get_ssh_key(python_management_request):
+        return python_management_request.python_management.instance.uuid.hex
+
     @staticmethod
     def ensure_playbook_exists_or_raise(playbook_path):
         if not os.path.exists(playbook_path):
@@ -166,7 +313,8 @@ class PythonManagementBackendHelper(object):
     def build_extra_vars(python_management_request):
         extraVars = PythonManagementBackendHelper.build_common_extra_vars(python_management_request)
 
-        additional_extra_args_building_function = PythonManagementBackendHelper.REQUEST_TYPES_EXTRA_ARGS_CORRESPONDENCE.get(type(python_management_request))
+        additional_extra_args_building_function = PythonManagementBackendHelper.REQUEST_TYPES_EXTRA_ARGS_CORRESPONDENCE.get(
+            PythonManagementBackendHelper.get_request_class(python_management_request))
 
         if additional_extra_args_building_function:
             extraVars.update(additional_extra_args_building_function(python_management_request))
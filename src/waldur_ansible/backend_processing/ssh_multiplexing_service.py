@@ -0,0 +1,119 @@
+import errno
+import hashlib
+import logging
+import os
+import re
+import subprocess  # nosec
+
+from django.conf import settings
+from waldur_ansible.backend_processing.process_runner import get_ansible_config_value
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SSH_CONTROL_PATH_DIR = '/tmp/waldur-ansible-ssh'  # nosec
+DEFAULT_SSH_CONTROL_PERSIST = 300
+SHARED_CONTROL_PATH_PREFIX = 'shared'
+
+
+class SshMultiplexingService(object):
+    """
+    Makes consecutive playbook runs against the same instance reuse a single
+    authenticated SSH connection. Master connection is kept open for SSH_CONTROL_PERSIST
+    seconds after the last run finishes. Control sockets are grouped by the key of the
+    target instance, %C is expanded by SSH to the hash of host, port and user.
+    """
+
+    @staticmethod
+    def is_enabled():
+        return settings.WALDUR_ANSIBLE.get('SSH_MULTIPLEXING_ENABLED', True)
+
+    @staticmethod
+    def get_environment(env):
+        """
+        Ansible passes its ssh_args before --ssh-common-args and SSH uses the first value of every option,
+        so ControlPersist is configured via ssh_args. It is the same for all runs, which keeps warm runner usable.
+        Options are added to ssh_args configured by the environment or ansible.cfg, options which are
+        configured there already are kept.
+        """
+        if not SshMultiplexingService.is_enabled():
+            return {}
+        control_persist = settings.WALDUR_ANSIBLE.get('SSH_CONTROL_PERSIST', DEFAULT_SSH_CONTROL_PERSIST)
+        configured_ssh_args = env.get('ANSIBLE_SSH_ARGS')
+        if configured_ssh_args is None:
+            configured_ssh_args = get_ansible_config_value(env, 'ssh_connection', 'ssh_args')
+        if configured_ssh_args is None:
+            # Default ssh_args of Ansible, with the configured ControlPersist
+            return dict(ANSIBLE_SSH_ARGS='-C -o ControlMaster=auto -o ControlPersist=%ss' % control_persist)
+
+        ssh_args = [configured_ssh_args] if configured_ssh_args.strip() else []
+        for option, value in (('ControlMaster', 'auto'), ('ControlPersist', '%ss' % control_persist)):
+            if not re.search(r'\b%s\b' % option, configured_ssh_args, re.IGNORECASE):
+                ssh_args.append('-o %s=%s' % (option, value))
+        return dict(ANSIBLE_SSH_ARGS=' '.join(ssh_args))
+
+    @staticmethod
+    def get_ssh_common_args(key=None):
+        args = '-o UserKnownHostsFile=/dev/null'
+        if SshMultiplexingService.is_enabled():
+            args += ' -o ControlPath=%s' % SshMultiplexingService.get_control_path(key)
+        return args
+
+    @staticmethod
+    def get_control_path(key=None):
+        control_path_dir = SshMultiplexingService.get_control_path_dir()
+        try:
+            os.makedirs(control_path_dir, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Length of unix socket path is limited, so key is hashed
+        return os.path.join(control_path_dir, '%s-%%C' % SshMultiplexingService.get_prefix(key))
+
+    @staticmethod
+    def close_connections(key):
+        """
+        Stops master connections opened for the given key, e.g. when environment on the instance is deleted.
+        """
+        prefix = SshMultiplexingService.get_prefix(key) + '-'
+        for control_path in SshMultiplexingService.list_control_paths():
+            if os.path.basename(control_path).startswith(prefix):
+                SshMultiplexingService.run_control_command(control_path, 'exit')
+
+    @staticmethod
+    def cleanup():
+        """
+        Removes control sockets left by master connections which are not alive anymore.
+        """
+        for control_path in SshMultiplexingService.list_control_paths():
+            if not SshMultiplexingService.run_control_command(control_path, 'check'):
+                try:
+                    os.remove(control_path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                else:
+                    logger.info('Stale SSH control socket %s has been removed.', control_path)
+
+    @staticmethod
+    def run_control_command(control_path, control_command):
+        # Destination is required by SSH syntax, but it is not used when control socket is given
+        command = ['ssh', '-O', control_command, '-o', 'ControlPath=%s' % control_path, 'waldur-ansible']
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(command, stdout=devnull, stderr=devnull) == 0  # nosec
+
+    @staticmethod
+    def list_control_paths():
+        control_path_dir = SshMultiplexingService.get_control_path_dir()
+        if not os.path.isdir(control_path_dir):
+            return []
+        return [os.path.join(control_path_dir, name) for name in os.listdir(control_path_dir)]
+
+    @staticmethod
+    def get_prefix(key):
+        if key is None:
+            return SHARED_CONTROL_PATH_PREFIX
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]  # nosec
+
+    @staticmethod
+    def get_control_path_dir():
+        return settings.WALDUR_ANSIBLE.get('SSH_CONTROL_PATH_DIR', DEFAULT_SSH_CONTROL_PATH_DIR)
@@ -0,0 +1,322 @@
+"""
+Warm runner executes ansible-playbook in processes forked from a long-lived server
+which has already imported Ansible, so that interpreter startup and module loading
+are not paid by every job and python management request.
+
+Protocol is line based, every line is a JSON document.
+Client sends request with command and environment, server replies with either
+accepted or unsupported message. Accepted request is followed by output and events
+messages which contain lines produced by the playbook, and exit message with return code.
+Client closes connection in order to terminate the playbook.
+"""
+import errno
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess  # nosec
+import sys
+import time
+
+from waldur_ansible.backend_processing.exceptions import AnsibleBackendError
+from waldur_ansible.backend_processing.process_runner import READ_SIZE, EVENTS_FD_ENV_VARIABLE, \
+    LineSplitter, check_deadlines, get_select_timeout, handle_events, terminate_process_group
+
+logger = logging.getLogger(__name__)
+
+PLAYBOOK_COMMAND_NAME = 'ansible-playbook'
+CONNECT_TIMEOUT = 5
+
+
+class WarmRunnerUnavailable(Exception):
+    pass
+
+
+def send_message(connection, **message):
+    connection.sendall(json.dumps(message) + '\n')
+
+
+class MessageReader(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.splitter = LineSplitter()
+        self.pending_messages = []
+        self.closed = False
+
+    def read(self):
+        messages, self.pending_messages = self.pending_messages, []
+        if self.closed:
+            return messages
+
+        data = self.connection.recv(READ_SIZE)
+        if not data:
+            self.closed = True
+            lines = self.splitter.finish()
+        else:
+            lines = self.splitter.feed(data)
+        return messages + [json.loads(line) for line in lines]
+
+    def read_one(self):
+        while self.pending_messages or not self.closed:
+            messages = self.read()
+            if messages:
+                self.pending_messages = messages[1:]
+                return messages[0]
+
+
+def open_warm_runner(socket_path, command, env, events_handler=None, timeout=None, idle_timeout=None):
+    """
+    Submits command to the warm runner and returns iterator over its output lines
+    with the same semantics as iterate_process_output.
+    Raises WarmRunnerUnavailable if command should be executed in a regular way.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(CONNECT_TIMEOUT)
+    try:
+        connection.connect(socket_path)
+        send_message(connection, command=command, env=env, events=bool(events_handler))
+        reader = MessageReader(connection)
+        reply = reader.read_one()
+    except (socket.error, ValueError) as e:
+        connection.close()
+        raise WarmRunnerUnavailable('Warm runner is not available: %s' % e)
+
+    if not reply or not reply.get('accepted'):
+        connection.close()
+        raise WarmRunnerUnavailable(reply and reply.get('unsupported') or 'Warm runner has closed connection.')
+
+    connection.settimeout(None)
+    return iterate_warm_runner_output(connection, reader, command, events_handler, timeout, idle_timeout)
+
+
+def iterate_warm_runner_output(connection, reader, command, events_handler, timeout, idle_timeout):
+    started = last_activity = time.time()
+    return_code = None
+    try:
+        while return_code is None:
+            check_deadlines(started, last_activity, timeout, idle_timeout)
+            # Messages received together with reply to the request are already buffered by reader
+            ready = reader.pending_messages
+            if not ready:
+                select_timeout = get_select_timeout(started, last_activity, timeout, idle_timeout)
+                ready, _, _ = select.select([connection], [], [], select_timeout)
+            if not ready:
+                continue
+
+            last_activity = time.time()
+            for message in reader.read():
+                for line in message.get('output', []):
+                    yield line.encode('utf-8')
+                if events_handler and message.get('events'):
+                    handle_events(message['events'], events_handler)
+                if 'exit' in message:
+                    return_code = message['exit']
+
+            if reader.closed and return_code is None:
+                raise AnsibleBackendError('Warm runner has closed connection unexpectedly.')
+    finally:
+        # Server terminates the playbook as soon as connection is closed
+        connection.close()
+
+    if return_code:
+        raise subprocess.CalledProcessError(return_code, command)
+
+
+class WarmRunnerServer(object):
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+
+    def serve_forever(self):
+        self.preload_ansible()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        server.listen(128)
+        signal.signal(signal.SIGCHLD, reap_children)
+        logger.info('Warm Ansible runner is listening on %s.', self.socket_path)
+
+        while True:
+            try:
+                connection, _ = server.accept()
+            except socket.error as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                exit_code = 0
+                try:
+                    RequestHandler(connection).handle()
+                except Exception:  # noqa
+                    logger.exception('Warm runner has failed to handle request.')
+                    exit_code = 1
+                finally:
+                    os._exit(exit_code)
+            connection.close()
+
+    def preload_ansible(self):
+        from ansible.cli.playbook import PlaybookCLI  # noqa
+        from ansible.executor.playbook_executor import PlaybookExecutor  # noqa
+        from ansible.plugins import loader  # noqa
+
+
+def reap_children(signum, frame):
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except OSError:
+            return
+        if pid == 0:
+            return
+
+
+def get_unsupported_reason(command, env):
+    if os.path.basename(command[0]) != PLAYBOOK_COMMAND_NAME:
+        return 'Only %s command is supported.' % PLAYBOOK_COMMAND_NAME
+    # Ansible reads its configuration from environment once, when it is imported by the server
+    for key, value in env.items():
+        if key.startswith('ANSIBLE_') and os.environ.get(key) != value:
+            return 'Environment variable %s differs from environment of warm runner.' % key
+    return None
+
+
+class RequestHandler(object):
+    """
+    Runs in the process forked for a single connection. Playbook is executed in one more
+    forked process, so that it can be terminated together with its children.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.reader = MessageReader(connection)
+
+    def handle(self):
+        request = self.reader.read_one()
+        if not request:
+            return
+
+        command, env = request['command'], request['env']
+        reason = get_unsupported_reason(command, env)
+        if reason:
+            send_message(self.connection, unsupported=reason)
+            return
+        send_message(self.connection, accepted=True)
+
+        output_read_fd, output_write_fd = os.pipe()
+        events_read_fd, events_write_fd = os.pipe() if request.get('events') else (None, None)
+        pid = os.fork()
+        if pid == 0:
+            self.connection.close()
+            os.close(output_read_fd)
+            if events_read_fd is not None:
+                os.close(events_read_fd)
+            os.setsid()
+            os.dup2(output_write_fd, 1)
+            os.dup2(output_write_fd, 2)
+            os.environ.clear()
+            os.environ.update(env)
+            if events_write_fd is not None:
+                os.environ[EVENTS_FD_ENV_VARIABLE] = str(events_write_fd)
+            os._exit(run_playbook(command))
+
+        os.close(output_write_fd)
+        if events_write_fd is not None:
+            os.close(events_write_fd)
+        self.relay(pid, output_read_fd, events_read_fd)
+
+    def relay(self, pid, output_read_fd, events_read_fd):
+        process = PlaybookProcess(pid)
+        splitters = {output_read_fd: LineSplitter()}
+        if events_read_fd is not None:
+            splitters[events_read_fd] = LineSplitter()
+
+        try:
+            while splitters:
+                ready_fds, _, _ = select.select(list(splitters) + [self.connection], [], [])
+                if self.connection in ready_fds:
+                    # Client does not send anything after request, so readable connection means it is closed
+                    terminate_process_group(process)
+                    return
+
+                for fd in ready_fds:
+                    data = os.read(fd, READ_SIZE)
+                    lines = splitters[fd].feed(data) if data else splitters.pop(fd).finish()
+                    if not lines:
+                        continue
+                    lines = [line.decode('utf-8', 'replace') for line in lines]
+                    if fd == output_read_fd:
+                        send_message(self.connection, output=lines)
+                    else:
+                        send_message(self.connection, events=lines)
+
+            send_message(self.connection, exit=process.wait())
+        except socket.error:
+            terminate_process_group(process)
+        finally:
+            os.close(output_read_fd)
+            if events_read_fd is not None:
+                os.close(events_read_fd)
+
+
+class PlaybookProcess(object):
+    """
+    Minimal subset of Popen interface used by terminate_process_group.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                self.returncode = decode_wait_status(status)
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            _, status = os.waitpid(self.pid, 0)
+            self.returncode = decode_wait_status(status)
+        return self.returncode
+
+
+def decode_wait_status(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run_playbook(command):
+    """
+    Does the same as ansible-playbook script, but uses modules which are already imported.
+    """
+    try:
+        from ansible import release
+        from ansible.cli.playbook import PlaybookCLI
+        from distutils.version import LooseVersion
+
+        cli = PlaybookCLI(list(command))
+        # Since Ansible 2.8 arguments are parsed by run method
+        if LooseVersion(release.__version__) < LooseVersion('2.8'):
+            cli.parse()
+        return cli.run() or 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 1
+    except Exception as e:  # noqa
+        sys.stderr.write('ERROR! %s\n' % e)
+        return 250
+    finally:
+        # Process exits with os._exit, which does not flush buffers
+        sys.stdout.flush()
+        sys.stderr.flush()
@@ -13,6 +13,9 @@ class PythonManagementConstants(object):
     def INSTALL_PYTHON_ENVIRONMENT():
         return 'install_python_environment'
     @constant
+    def INSTALL_PYTHON_ENVIRONMENT_WITH_VIRTUAL_ENVIRONMENTS():
+        return 'install_python_environment_with_virtual_environments'
+    @constant
     def SYNCHRONIZE_PACKAGES():
         return 'synchronize_packages'
     @constant
@@ -22,6 +25,9 @@ class PythonManagementConstants(object):
     def FIND_INSTALLED_VIRTUAL_ENVIRONMENTS():
         return 'find_installed_virtual_environments'
     @constant
+    def FIND_INSTALLED_VIRTUAL_ENVIRONMENTS_WITH_LIBRARIES():
+        return 'find_installed_virtual_environments_with_libraries'
+    @constant
     def DELETE_VIRTUAL_ENVIRONMENT():
         return 'delete_virtual_environment'
     @constant
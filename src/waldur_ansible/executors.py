@@ -1,5 +1,7 @@
 from celery import chain
+from django.conf import settings
 
+from waldur_ansible import models
 from waldur_core.core import executors as core_executors
 from waldur_core.core import tasks as core_tasks
 from waldur_core.core import utils as core_utils
@@ -7,13 +9,64 @@ from waldur_openstack.openstack_tenant import models as openstack_models
 from waldur_openstack.openstack_tenant import executors as openstack_executors
 
 
-class RunJobExecutor(core_executors.CreateExecutor):
+class ScheduledExecutorMixin(object):
+    """
+    Asynchronous execution is admitted by SchedulingService, which calls dispatch()
+    with the same keyword arguments as soon as concurrency limits allow it.
+    """
+
+    @classmethod
+    def execute(cls, instance, async=True, **kwargs):
+        if not async:
+            return super(ScheduledExecutorMixin, cls).execute(instance, async=async, **kwargs)
+        from waldur_ansible.scheduling_service import SchedulingService
+        SchedulingService.submit(cls, instance, **kwargs)
+
+    @classmethod
+    def dispatch(cls, instance, **kwargs):
+        return super(ScheduledExecutorMixin, cls).execute(instance, async=True, **kwargs)
+
+
+class RoutedExecutorMixin(object):
+    """
+    Asynchronous task is sent to the Celery queue and with the priority configured
+    in WALDUR_ANSIBLE settings, so that long running executions do not delay short ones.
+    """
+
+    @classmethod
+    def get_routing_setting_name(cls, instance):
+        raise NotImplementedError()
+
+    @classmethod
+    def get_routing_options(cls, instance):
+        routing = settings.WALDUR_ANSIBLE.get(cls.get_routing_setting_name(instance)) or {}
+        return dict((key, routing[key]) for key in ('queue', 'priority') if routing.get(key) is not None)
+
+    @classmethod
+    def apply_signature(cls, instance, async=True, countdown=None, is_heavy_task=False, **kwargs):
+        routing_options = cls.get_routing_options(instance)
+        if not async or not routing_options:
+            return super(RoutedExecutorMixin, cls).apply_signature(
+                instance, async=async, countdown=countdown, is_heavy_task=is_heavy_task, **kwargs)
+
+        serialized_instance = core_utils.serialize_instance(instance)
+        signature = cls.get_task_signature(instance, serialized_instance, **kwargs)
+        link = cls.get_success_signature(instance, serialized_instance, **kwargs)
+        link_error = cls.get_failure_signature(instance, serialized_instance, **kwargs)
+        return signature.apply_async(link=link, link_error=link_error, countdown=countdown, **routing_options)
+
+
+class RunJobExecutor(ScheduledExecutorMixin, RoutedExecutorMixin, core_executors.CreateExecutor):
 
     @classmethod
     def get_task_signature(cls, job, serialized_job, **kwargs):
         return core_tasks.BackendMethodTask().si(
             serialized_job, 'run_job', state_transition='begin_creating')
 
+    @classmethod
+    def get_routing_setting_name(cls, job):
+        return 'JOB_TASK_ROUTING'
+
 class DeleteJobExecutor(core_executors.DeleteExecutor):
     @classmethod
     def get_task_signature(cls, job, serialized_job, **kwargs):
@@ -32,7 +85,18 @@ class DeleteJobExecutor(core_executors.DeleteExecutor):
             ))
         return chain(*deletion_tasks)
 
-class PythonManagementRequestExecutor(core_executors.CreateExecutor):
+class PythonManagementRequestExecutor(ScheduledExecutorMixin, RoutedExecutorMixin, core_executors.CreateExecutor):
+    READ_ONLY_REQUEST_MODELS = (
+        models.PythonManagementFindVirtualEnvsRequest,
+        models.PythonManagementFindInstalledLibrariesRequest,
+    )
+
+    @classmethod
+    def get_routing_setting_name(cls, python_management_request):
+        if isinstance(python_management_request, cls.READ_ONLY_REQUEST_MODELS):
+            return 'PYTHON_MANAGEMENT_DISCOVERY_TASK_ROUTING'
+        return 'PYTHON_MANAGEMENT_MODIFICATION_TASK_ROUTING'
+
     @classmethod
     def get_task_signature(cls, python_management, serialized_python_management_request, **kwargs):
         return core_tasks.BackendMethodTask().si(
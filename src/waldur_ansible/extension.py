@@ -8,13 +8,89 @@ class AnsibleExtension(WaldurExtension):
             'PLAYBOOKS_DIR_NAME': 'ansible_playbooks',
             'PLAYBOOK_EXECUTION_COMMAND': 'ansible-playbook',
             'PLAYBOOK_ARGUMENTS': ['--verbose'],
+            # Default wall-clock and idle output timeouts of jobs in seconds, None means no timeout.
+            # Wall-clock timeout is disabled by default, so that long running jobs are not terminated after upgrade
+            'PLAYBOOK_TIMEOUT': None,
+            'PLAYBOOK_IDLE_TIMEOUT': 900,
+            # Path to the unix socket of warm runner started by run_ansible_runner command, None disables it
+            'WARM_RUNNER_SOCKET': None,
+            # SSH connections to the same instance are reused for SSH_CONTROL_PERSIST seconds. ControlMaster and
+            # ControlPersist are added to ssh_args configured by ANSIBLE_SSH_ARGS or ansible.cfg, unless set there
+            'SSH_MULTIPLEXING_ENABLED': True,
+            'SSH_CONTROL_PERSIST': 300,
+            'SSH_CONTROL_PATH_DIR': '/tmp/waldur-ansible-ssh',
+            # Lifetime in seconds and maximum number of cached check mode previews, 0 TTL disables the cache
+            'CHECK_MODE_CACHE_TTL': 60 * 60,
+            'CHECK_MODE_CACHE_SIZE': 1000,
             'ANSIBLE_LIBRARY': '/usr/share/ansible-waldur/',
             'PLAYBOOK_ICON_SIZE': (64, 64),
             'API_URL': 'http://localhost:8000/api/',
             'PRIVATE_KEY_PATH': '/etc/waldur/id_rsa',
             'PUBLIC_KEY_UUID': 'PUBLIC_KEY_UUID',
             'PYTHON_MANAGEMENT_PLAYBOOKS_DIRECTORY': '/etc/waldur/ansible-waldur-module/waldur-apps/python_management/',
+            # Results of python management playbooks are read from callback events, so verbose output is not needed.
+            # None means PLAYBOOK_ARGUMENTS without --verbose and -v flags, so that other arguments are still applied
+            'PYTHON_MANAGEMENT_PLAYBOOK_ARGUMENTS': None,
+            # Timeouts of python management requests in seconds, they should be less than the lifetime of processing locks.
+            # PYTHON_MANAGEMENT_REQUEST_TIMEOUTS overrides defaults per playbook name, e.g.
+            # {'synchronize_packages': {'timeout': 3000, 'idle_timeout': 1200}}
+            'PYTHON_MANAGEMENT_REQUEST_TIMEOUT': 3000,
+            'PYTHON_MANAGEMENT_REQUEST_IDLE_TIMEOUT': 900,
+            'PYTHON_MANAGEMENT_REQUEST_TIMEOUTS': {},
+            # Storage of python management locks, it should be shared by all API and worker nodes. Database backend
+            # 'waldur_ansible.backend_processing.lock_backends.DatabaseLockBackend' does not depend on cache configuration
+            'LOCK_BACKEND': 'waldur_ansible.backend_processing.lock_backends.CacheLockBackend',
+            # Locks of virtual environments are extended while request is processed, so that lock of crashed worker
+            # blocks virtual environment only for this number of seconds
+            'PYTHON_MANAGEMENT_LOCK_TIMEOUT': 60,
+            # Requests conflicting with requests being processed wait in the queue of python management instead of
+            # being refused: requests of the same virtual environment are executed one by one in submission order,
+            # requests of different virtual environments run in parallel and global requests run exclusively
+            'PYTHON_MANAGEMENT_REQUEST_QUEUE_ENABLED': True,
+            # Repeated discovery of virtual environments or installed libraries within this number of seconds
+            # returns result of the last completed request, unless it is forced with ?refresh=true, 0 disables it.
+            # Such response has status 200, uuid of the completed request, null queue position and the request itself
+            'PYTHON_MANAGEMENT_DISCOVERY_RESULT_TTL': 60,
+            # Install all virtual environments of new python management in a single playbook run
+            'PYTHON_MANAGEMENT_BATCH_INITIALIZATION': False,
+            # Find virtual environments and their libraries in a single playbook run
+            'PYTHON_MANAGEMENT_COMBINED_DISCOVERY': False,
+            # Celery queue and priority of jobs, read-only python management requests (finding virtual environments
+            # and installed libraries) and modifying ones (initialization, synchronization and deletion), e.g.
+            # {'queue': 'ansible_discovery', 'priority': 9}. Empty routing keeps the default queue.
+            'JOB_TASK_ROUTING': {},
+            'PYTHON_MANAGEMENT_DISCOVERY_TASK_ROUTING': {},
+            'PYTHON_MANAGEMENT_MODIFICATION_TASK_ROUTING': {},
+            # Wheels of libraries installed to virtual environments are cached in WHEELHOUSE_DIRECTORY, which
+            # should be served over HTTP as WHEELHOUSE_URL and is passed to playbooks as pip_find_links variable.
+            # Wheels are downloaded from WHEELHOUSE_PACKAGE_SOURCE, which is either index URL or local directory,
+            # for the given python version and platform of instances. None disables the wheelhouse.
+            # Libraries without binary wheels are built by WHEELHOUSE_BUILD_PYTHON interpreter, which should be
+            # of the same python version as instances, None skips them. All downloads of a request share
+            # WHEELHOUSE_PREPARE_TIMEOUT seconds, because they are done while virtual environment is locked.
+            'WHEELHOUSE_DIRECTORY': None,
+            'WHEELHOUSE_URL': None,
+            'WHEELHOUSE_PACKAGE_SOURCE': None,
+            'WHEELHOUSE_PYTHON_VERSION': '3.5',
+            'WHEELHOUSE_PLATFORM': 'manylinux1_x86_64',
+            'WHEELHOUSE_MAX_SIZE': 10 * 1024 * 1024 * 1024,
+            'WHEELHOUSE_DOWNLOAD_TIMEOUT': 30 * 60,
+            'WHEELHOUSE_BUILD_PYTHON': None,
+            'WHEELHOUSE_PREPARE_TIMEOUT': 5 * 60,
             'SYNC_PIP_PACKAGES_TASK_ENABLED': False,
+            # Running process output is saved to the database when either limit is reached
+            'OUTPUT_FLUSH_SIZE': 64 * 1024,
+            'OUTPUT_FLUSH_INTERVAL': 5,
+            'JOB_EVENTS_BATCH_SIZE': 100,
+            # Maximal number of output bytes returned by a single output tail request
+            'OUTPUT_TAIL_MAX_SIZE': 1024 * 1024,
+            # Limits of concurrently running jobs and python management requests, None means unlimited
+            'MAX_CONCURRENT_EXECUTIONS': None,
+            'MAX_CONCURRENT_EXECUTIONS_PER_PROJECT': 10,
+            'MAX_CONCURRENT_EXECUTIONS_PER_SERVICE_PROJECT_LINK': 10,
+            # Running execution which has not been reported alive by its worker for this number of seconds is considered
+            # lost and is marked as erred. It should exceed the time tasks wait in Celery queues before they are started
+            'EXECUTION_HEARTBEAT_TIMEOUT': 30 * 60,
         }
 
     @staticmethod
@@ -35,4 +111,24 @@ class AnsibleExtension(WaldurExtension):
                 'schedule': timedelta(hours=168),
                 'args': (),
             },
+            'waldur-ansible-collect-workspace-blobs': {
+                'task': 'waldur_ansible.collect_workspace_blobs',
+                'schedule': timedelta(hours=24),
+                'args': (),
+            },
+            'waldur-ansible-cleanup-ssh-control-sockets': {
+                'task': 'waldur_ansible.cleanup_ssh_control_sockets',
+                'schedule': timedelta(hours=1),
+                'args': (),
+            },
+            'waldur-ansible-dispatch-deferred-python-management-requests': {
+                'task': 'waldur_ansible.dispatch_deferred_python_management_requests',
+                'schedule': timedelta(minutes=5),
+                'args': (),
+            },
+            'waldur-ansible-release-queued-executions': {
+                'task': 'waldur_ansible.release_queued_executions',
+                'schedule': timedelta(minutes=1),
+                'args': (),
+            },
         }
\ No newline at end of file
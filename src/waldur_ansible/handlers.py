@@ -7,7 +7,7 @@ from . import tasks
 
 def delete_playbook_workspace(sender, instance, **kwargs):
     if not settings.WALDUR_ANSIBLE.get('PRESERVE_PLAYBOOK_WORKSPACE_AFTER_DELETION', False):
-        tasks.delete_playbook_workspace.delay(instance.workspace)
+        tasks.delete_playbook_workspace.delay(instance.workspace, list(set(instance.manifest.values())))
 
 
 def resize_playbook_image(sender, instance, **kwargs):
@@ -22,3 +22,15 @@ def resize_playbook_image(sender, instance, **kwargs):
     image_file = StringIO()
     image.save(image_file, 'png')
     field.file = image_file
+
+
+def invalidate_check_mode_previews(sender, instance, created=False, **kwargs):
+    if not created:
+        from waldur_ansible.backend_processing.check_mode_preview_service import CheckModePreviewService
+        CheckModePreviewService.invalidate(instance)
+
+
+def finish_queued_execution(sender, instance, name, source, target, **kwargs):
+    if target in (instance.States.OK, instance.States.ERRED):
+        from waldur_ansible.scheduling_service import SchedulingService
+        SchedulingService.finish(instance)
@@ -0,0 +1,30 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from waldur_ansible.backend_processing.process_runner import get_events_callback_environment
+from waldur_ansible.backend_processing.ssh_multiplexing_service import SshMultiplexingService
+from waldur_ansible.backend_processing.warm_runner import WarmRunnerServer
+
+
+class Command(BaseCommand):
+    help = "Start warm runner which executes ansible-playbook in processes forked from preloaded interpreter."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', dest='socket', default=None,
+                            help='Path to the unix socket, WARM_RUNNER_SOCKET setting is used by default.')
+
+    def handle(self, *args, **options):
+        socket_path = options['socket'] or settings.WALDUR_ANSIBLE.get('WARM_RUNNER_SOCKET')
+        if not socket_path:
+            raise CommandError('Socket path is not specified.')
+
+        # Ansible reads its configuration when it is imported, so environment
+        # has to be the same as the one used by backends before the server starts.
+        os.environ.update(get_events_callback_environment(os.environ))
+        os.environ['ANSIBLE_LIBRARY'] = settings.WALDUR_ANSIBLE['ANSIBLE_LIBRARY']
+        os.environ['ANSIBLE_HOST_KEY_CHECKING'] = 'False'
+        os.environ.update(SshMultiplexingService.get_environment(os.environ))
+
+        WarmRunnerServer(socket_path).serve_forever()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import waldur_core.core.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_ansible', '0006_python_management_requests_virtualenvs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField(help_text='Sequence number of the event within the job run.')),
+                ('event', models.CharField(choices=[('task_start', 'Task start'), ('task_end', 'Task end')], max_length=30)),
+                ('task', models.CharField(blank=True, max_length=1024)),
+                ('host', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(blank=True, choices=[('ok', 'OK'), ('changed', 'Changed'), ('failed', 'Failed'), ('ignored', 'Ignored'), ('skipped', 'Skipped'), ('unreachable', 'Unreachable')], max_length=30)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, help_text='Task duration in seconds.', null=True)),
+                ('check_mode', models.BooleanField(default=False, help_text='Result payload contains WALDUR_CHECK_MODE marker.')),
+                ('payload', waldur_core.core.fields.JSONField(blank=True, default={})),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='waldur_ansible.Job')),
+            ],
+            options={
+                'ordering': ['job', 'index'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='jobevent',
+            unique_together=set([('job', 'index')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='jobevent',
+            index_together=set([('job', 'event', 'status'), ('job', 'check_mode')]),
+        ),
+    ]
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import zlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+OUTPUT_STORING_MODELS = (
+    'job',
+    'pythonmanagementinitializerequest',
+    'pythonmanagementsynchronizerequest',
+    'pythonmanagementdeleterequest',
+    'pythonmanagementdeletevirtualenvrequest',
+    'pythonmanagementfindvirtualenvsrequest',
+    'pythonmanagementfindinstalledlibrariesrequest',
+)
+
+CHUNK_SIZE = 256 * 1024
+
+
+def move_output_to_chunks(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    OutputChunk = apps.get_model('waldur_ansible', 'OutputChunk')
+
+    for model_name in OUTPUT_STORING_MODELS:
+        model = apps.get_model('waldur_ansible', model_name)
+        content_type = None
+        for pk, output in model.objects.exclude(output='').values_list('pk', 'output').iterator():
+            if content_type is None:
+                content_type, _ = ContentType.objects.get_or_create(app_label='waldur_ansible', model=model_name)
+            data = output.encode('utf-8')
+            for index, offset in enumerate(range(0, len(data), CHUNK_SIZE)):
+                chunk = data[offset:offset + CHUNK_SIZE]
+                OutputChunk.objects.create(
+                    content_type=content_type,
+                    object_id=pk,
+                    index=index,
+                    offset=offset,
+                    length=len(chunk),
+                    line_count=chunk.count(b'\n'),
+                    data=zlib.compress(chunk),
+                )
+            model.objects.filter(pk=pk).update(output_length=len(data), output_lines=data.count(b'\n'))
+
+
+def move_output_from_chunks(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    OutputChunk = apps.get_model('waldur_ansible', 'OutputChunk')
+
+    for model_name in OUTPUT_STORING_MODELS:
+        model = apps.get_model('waldur_ansible', model_name)
+        try:
+            content_type = ContentType.objects.get(app_label='waldur_ansible', model=model_name)
+        except ContentType.DoesNotExist:
+            continue
+        for pk in model.objects.exclude(output_length=0).values_list('pk', flat=True).iterator():
+            chunks = OutputChunk.objects.filter(content_type=content_type, object_id=pk).order_by('index')
+            data = b''.join(zlib.decompress(bytes(chunk)) for chunk in chunks.values_list('data', flat=True))
+            model.objects.filter(pk=pk).update(output=data.decode('utf-8', 'replace'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('waldur_ansible', '0007_jobevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutputChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('index', models.PositiveIntegerField()),
+                ('offset', models.BigIntegerField(help_text='Position of the first byte of the chunk in the whole output.')),
+                ('length', models.PositiveIntegerField(help_text='Length of the uncompressed chunk in bytes.')),
+                ('line_count', models.PositiveIntegerField(default=0)),
+                ('data', models.BinaryField(help_text='Chunk compressed with zlib.')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+            ],
+            options={
+                'ordering': ['content_type', 'object_id', 'index'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='outputchunk',
+            unique_together=set([('content_type', 'object_id', 'index')]),
+        ),
+    ] + [
+        operation
+        for model_name in OUTPUT_STORING_MODELS
+        for operation in (
+            migrations.AddField(
+                model_name=model_name,
+                name='output_length',
+                field=models.BigIntegerField(default=0, help_text='Length of the output in bytes.'),
+            ),
+            migrations.AddField(
+                model_name=model_name,
+                name='output_lines',
+                field=models.PositiveIntegerField(default=0, help_text='Number of lines in the output.'),
+            ),
+        )
+    ] + [
+        migrations.RunPython(move_output_to_chunks, move_output_from_chunks),
+    ] + [
+        migrations.RemoveField(
+            model_name=model_name,
+            name='output',
+        )
+        for model_name in OUTPUT_STORING_MODELS
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('openstack_tenant', '0030_add_volume_image_name'),
+        ('waldur_ansible', '0008_output_chunks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedExecution',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('object_id', models.PositiveIntegerField()),
+                ('executor', models.CharField(help_text='Serialized executor class.', max_length=255)),
+                ('state', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running')], db_index=True, default='queued', max_length=30)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+                ('service_project_link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='openstack_tenant.OpenStackTenantServiceProjectLink')),
+            ],
+            options={
+                'ordering': ['created', 'pk'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='queuedexecution',
+            unique_together=set([('content_type', 'object_id')]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_ansible', '0009_queuedexecution'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playbook',
+            name='timeout',
+            field=models.PositiveIntegerField(blank=True, help_text='Maximum duration of the job in seconds. Default is used if empty.', null=True),
+        ),
+        migrations.AddField(
+            model_name='playbook',
+            name='idle_timeout',
+            field=models.PositiveIntegerField(blank=True, help_text='Maximum time in seconds the job may run without producing any output. Default is used if empty.', null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+import waldur_core.core.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_ansible', '0010_playbook_timeouts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckModePreview',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('items', waldur_core.core.fields.JSONField(blank=True, default=[])),
+                ('last_used', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('playbook', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='check_mode_previews', to='waldur_ansible.Playbook')),
+            ],
+            options={
+                'ordering': ['-last_used'],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import waldur_core.core.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_ansible', '0011_checkmodepreview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playbook',
+            name='manifest',
+            field=waldur_core.core.fields.JSONField(blank=True, default={}, help_text='Hashes of workspace files content by their paths.'),
+        ),
+    ]
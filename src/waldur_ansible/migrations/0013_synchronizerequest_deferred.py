@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import waldur_core.core.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_ansible', '0012_playbook_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pythonmanagementsynchronizerequest',
+            name='deferred',
+            field=models.BooleanField(default=False, help_text='Request waits until virtual environment is unlocked. Libraries to install and remove are computed when it is dispatched.'),
+        ),
+        migrations.AddField(
+            model_name='pythonmanagementsynchronizerequest',
+            name='desired_libraries',
+            field=waldur_core.core.fields.JSONField(blank=True, default=[], help_text='Libraries the virtual environment should contain'),
+        ),
+    ]
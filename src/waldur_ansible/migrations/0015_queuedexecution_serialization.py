@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_ansible', '0014_lock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedexecution',
+            name='serialization_group',
+            field=models.CharField(blank=True, db_index=True, help_text='Executions of the same group which have conflicting keys are executed one by one in FIFO order.', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='queuedexecution',
+            name='serialization_key',
+            field=models.CharField(blank=True, help_text='Empty key conflicts with any other key of the group, other keys conflict only with themselves.', max_length=255),
+        ),
+    ]
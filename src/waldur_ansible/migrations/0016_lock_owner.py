@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_ansible', '0015_queuedexecution_serialization'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lock',
+            name='owner',
+            field=models.CharField(blank=True, help_text='UUID of the request or user holding the lock.', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='lock',
+            name='acquired',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
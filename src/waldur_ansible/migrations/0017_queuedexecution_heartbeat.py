@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_ansible', '0016_lock_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedexecution',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, help_text='Time when running execution has been dispatched or reported alive by the worker for the last time.', null=True),
+        ),
+    ]
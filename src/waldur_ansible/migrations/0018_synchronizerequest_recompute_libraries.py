@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_ansible', '0017_queuedexecution_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pythonmanagementsynchronizerequest',
+            name='recompute_libraries',
+            field=models.BooleanField(default=False, help_text='Libraries to install and remove are computed from desired libraries when processing of the request begins.'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import waldur_core.core.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_ansible', '0018_synchronizerequest_recompute_libraries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pythonmanagementsynchronizerequest',
+            name='libraries_to_upgrade',
+            field=waldur_core.core.fields.JSONField(blank=True, default=[], help_text='List of installed libraries whose version changes'),
+        ),
+    ]
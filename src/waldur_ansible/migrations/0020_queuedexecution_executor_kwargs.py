@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import waldur_core.core.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_ansible', '0019_synchronizerequest_libraries_to_upgrade'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedexecution',
+            name='executor_kwargs',
+            field=waldur_core.core.fields.JSONField(blank=True, default={}, help_text='Keyword arguments of the executor.'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waldur_ansible', '0020_queuedexecution_executor_kwargs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pythonmanagementsynchronizerequest',
+            name='deferred',
+            field=models.BooleanField(default=False, help_text='Request waits until virtual environment is unlocked.'),
+        ),
+    ]
@@ -6,8 +6,11 @@ import uuid
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.contrib.contenttypes.models import ContentType
 from django.core import validators
 from django.db import models
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 from model_utils import FieldTracker
@@ -33,6 +36,12 @@ class Playbook(core_models.UuidMixin,
     workspace = models.CharField(max_length=255, unique=True, help_text=_('Absolute path to the playbook workspace.'))
     entrypoint = models.CharField(max_length=255, help_text=_('Relative path to the file in the workspace to execute.'))
     image = models.ImageField(upload_to=get_upload_path, null=True, blank=True)
+    timeout = models.PositiveIntegerField(
+        null=True, blank=True, help_text=_('Maximum duration of the job in seconds. Default is used if empty.'))
+    idle_timeout = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text=_('Maximum time in seconds the job may run without producing any output. Default is used if empty.'))
+    manifest = JSONField(default={}, blank=True, help_text=_('Hashes of workspace files content by their paths.'))
     tracker = FieldTracker()
 
     @staticmethod
@@ -44,16 +53,20 @@ class Playbook(core_models.UuidMixin,
 
     @staticmethod
     def generate_workspace_path():
-        base_path = os.path.join(
-            settings.MEDIA_ROOT,
-            settings.WALDUR_ANSIBLE.get('PLAYBOOKS_DIR_NAME', 'ansible_playbooks'),
-        )
+        from waldur_ansible.workspace_storage_service import get_workspaces_base_path
+        base_path = get_workspaces_base_path()
         path = os.path.join(base_path, uuid.uuid4().hex)
         while os.path.exists(path):
             path = os.path.join(base_path, uuid.uuid4().hex)
 
         return path
 
+    def get_timeout(self):
+        return self.timeout or settings.WALDUR_ANSIBLE.get('PLAYBOOK_TIMEOUT')
+
+    def get_idle_timeout(self):
+        return self.idle_timeout or settings.WALDUR_ANSIBLE.get('PLAYBOOK_IDLE_TIMEOUT')
+
     def get_backend(self):
         from waldur_ansible.backend_processing.ansible_playbook_backend import AnsiblePlaybookBackend
         return AnsiblePlaybookBackend(self)
@@ -62,6 +75,25 @@ class Playbook(core_models.UuidMixin,
         return self.name
 
 
+@python_2_unicode_compatible
+class CheckModePreview(TimeStampedModel):
+    """
+    Resources which a job is going to create according to the check mode run of its playbook.
+    Key is computed from the content of the playbook workspace and the job arguments.
+    """
+
+    class Meta(object):
+        ordering = ['-last_used']
+
+    playbook = models.ForeignKey(Playbook, on_delete=models.CASCADE, related_name='check_mode_previews')
+    key = models.CharField(max_length=64, unique=True)
+    items = JSONField(default=[], blank=True)
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return '%s %s' % (self.playbook, self.key)
+
+
 @python_2_unicode_compatible
 class PlaybookParameter(core_models.DescribableMixin, models.Model):
     class Meta(object):
@@ -81,11 +113,53 @@ class PlaybookParameter(core_models.DescribableMixin, models.Model):
     def __str__(self):
         return self.name
 
+@python_2_unicode_compatible
+class OutputChunk(models.Model):
+    """
+    Compressed piece of the output produced by a job or a python management request.
+    Output is append-only, chunks are ordered by index and do not overlap.
+    """
+
+    class Meta(object):
+        ordering = ['content_type', 'object_id', 'index']
+        unique_together = ('content_type', 'object_id', 'index')
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, related_name='+')
+    object_id = models.PositiveIntegerField()
+    scope = GenericForeignKey('content_type', 'object_id')
+    index = models.PositiveIntegerField()
+    offset = models.BigIntegerField(help_text=_('Position of the first byte of the chunk in the whole output.'))
+    length = models.PositiveIntegerField(help_text=_('Length of the uncompressed chunk in bytes.'))
+    line_count = models.PositiveIntegerField(default=0)
+    data = models.BinaryField(help_text=_('Chunk compressed with zlib.'))
+
+    def __str__(self):
+        return '%s %s [%s]' % (self.content_type, self.object_id, self.index)
+
+
+class OutputStoring(models.Model):
+    """
+    Output itself is kept in OutputChunk table, so that the row stays small.
+    """
+    output_length = models.BigIntegerField(default=0, help_text=_('Length of the output in bytes.'))
+    output_lines = models.PositiveIntegerField(default=0, help_text=_('Number of lines in the output.'))
+    output_chunks = GenericRelation(OutputChunk)
+
+    class Meta(object):
+        abstract = True
+
+    @property
+    def output(self):
+        from waldur_ansible.output_storage_service import OutputStorageService
+        return OutputStorageService.read_all(self)
+
+
 @python_2_unicode_compatible
 class Job(core_models.UuidMixin,
           core_models.StateMixin,
           core_models.NameMixin,
           core_models.DescribableMixin,
+          OutputStoring,
           TimeStampedModel,
           models.Model):
 
@@ -102,7 +176,6 @@ class Job(core_models.UuidMixin,
     subnet = models.ForeignKey(openstack_models.SubNet, related_name='+')
     playbook = models.ForeignKey(Playbook, related_name='jobs')
     arguments = JSONField(default={}, blank=True, null=True)
-    output = models.TextField(blank=True)
 
     @staticmethod
     def get_url_name():
@@ -124,6 +197,99 @@ class Job(core_models.UuidMixin,
     def get_related_resources(self):
         return openstack_models.Instance.objects.filter(tags__name=self.get_tag())
 
+@python_2_unicode_compatible
+class JobEvent(models.Model):
+
+    class Meta(object):
+        ordering = ['job', 'index']
+        unique_together = ('job', 'index')
+        index_together = (('job', 'event', 'status'), ('job', 'check_mode'))
+
+    class Events(object):
+        TASK_START = 'task_start'
+        TASK_END = 'task_end'
+
+        CHOICES = ((TASK_START, 'Task start'), (TASK_END, 'Task end'))
+
+    class Statuses(object):
+        OK = 'ok'
+        CHANGED = 'changed'
+        FAILED = 'failed'
+        IGNORED = 'ignored'
+        SKIPPED = 'skipped'
+        UNREACHABLE = 'unreachable'
+
+        CHOICES = ((OK, 'OK'), (CHANGED, 'Changed'), (FAILED, 'Failed'), (IGNORED, 'Ignored'),
+                   (SKIPPED, 'Skipped'), (UNREACHABLE, 'Unreachable'))
+
+    job = models.ForeignKey(Job, on_delete=models.CASCADE, related_name='events')
+    index = models.PositiveIntegerField(help_text=_('Sequence number of the event within the job run.'))
+    event = models.CharField(max_length=30, choices=Events.CHOICES)
+    task = models.CharField(max_length=1024, blank=True)
+    host = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=30, choices=Statuses.CHOICES, blank=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True, help_text=_('Task duration in seconds.'))
+    check_mode = models.BooleanField(default=False, help_text=_('Result payload contains WALDUR_CHECK_MODE marker.'))
+    payload = JSONField(default={}, blank=True)
+
+    def __str__(self):
+        return '%s %s %s' % (self.event, self.task, self.host)
+
+@python_2_unicode_compatible
+class Lock(models.Model):
+    """
+    Lock held by a process until it expires, used by database lock backend.
+    Uniqueness of the key makes acquisition atomic across all nodes.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    token = models.CharField(max_length=32)
+    owner = models.CharField(max_length=255, blank=True, help_text=_('UUID of the request or user holding the lock.'))
+    acquired = models.DateTimeField(default=timezone.now)
+    expires = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return '%s (%s)' % (self.key, self.expires)
+
+@python_2_unicode_compatible
+class QueuedExecution(TimeStampedModel):
+    """
+    Job or python management request admitted to or waiting for execution.
+    Row is deleted as soon as execution is finished.
+    """
+
+    class Meta(object):
+        ordering = ['created', 'pk']
+        unique_together = ('content_type', 'object_id')
+
+    class States(object):
+        QUEUED = 'queued'
+        RUNNING = 'running'
+
+        CHOICES = ((QUEUED, 'Queued'), (RUNNING, 'Running'))
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, related_name='+')
+    object_id = models.PositiveIntegerField()
+    scope = GenericForeignKey('content_type', 'object_id')
+    executor = models.CharField(max_length=255, help_text=_('Serialized executor class.'))
+    executor_kwargs = JSONField(default={}, blank=True, help_text=_('Keyword arguments of the executor.'))
+    service_project_link = models.ForeignKey(
+        openstack_models.OpenStackTenantServiceProjectLink, on_delete=models.CASCADE, related_name='+')
+    state = models.CharField(max_length=30, choices=States.CHOICES, default=States.QUEUED, db_index=True)
+    serialization_group = models.CharField(
+        max_length=255, blank=True, db_index=True,
+        help_text=_('Executions of the same group which have conflicting keys are executed one by one in FIFO order.'))
+    serialization_key = models.CharField(
+        max_length=255, blank=True,
+        help_text=_('Empty key conflicts with any other key of the group, other keys conflict only with themselves.'))
+    heartbeat = models.DateTimeField(
+        null=True, blank=True,
+        help_text=_('Time when running execution has been dispatched or reported alive by the worker for the last time.'))
+
+    def __str__(self):
+        return '%s %s (%s)' % (self.content_type, self.object_id, self.state)
+
 @python_2_unicode_compatible
 class PythonManagement(core_models.UuidMixin, TimeStampedModel, models.Model):
     user = models.ForeignKey(User, related_name='+')
@@ -164,12 +330,6 @@ class RelatedToVirtualEnv(models.Model):
     class Meta(object):
         abstract = True
 
-class OutputStoring(models.Model):
-    output = models.TextField(blank=True)
-
-    class Meta(object):
-        abstract = True
-
 class BackendProcessablePythonManagementRequest(object):
     def get_backend(self):
         from waldur_ansible.backend_processing.python_management_backend import PythonManagementBackend
@@ -191,7 +351,15 @@ class PythonManagementInitializeRequest(BackendProcessablePythonManagementReques
 class PythonManagementSynchronizeRequest(BackendProcessablePythonManagementRequest, RelatedToVirtualEnv, OutputStoring, PythonManagementRequest):
     libraries_to_install = JSONField(default=[], help_text=_('List of libraries to install'), blank=True)
     libraries_to_remove = JSONField(default=[], help_text=_('List of libraries to remove'), blank=True)
+    libraries_to_upgrade = JSONField(
+        default=[], help_text=_('List of installed libraries whose version changes'), blank=True)
     initialization_request = models.ForeignKey(PythonManagementInitializeRequest, related_name="sychronization_requests", null=True)
+    deferred = models.BooleanField(
+        default=False, help_text=_('Request waits until virtual environment is unlocked.'))
+    desired_libraries = JSONField(default=[], help_text=_('Libraries the virtual environment should contain'), blank=True)
+    recompute_libraries = models.BooleanField(
+        default=False, help_text=_('Libraries to install and remove are computed from desired libraries '
+                                   'when processing of the request begins.'))
 
     def __str__(self):
         return self.__class__.__name__ + str(self.uuid)
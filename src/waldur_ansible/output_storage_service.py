@@ -0,0 +1,112 @@
+import zlib
+
+import six
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils.encoding import force_text
+
+from waldur_ansible.models import OutputChunk
+
+COMPRESSION_LEVEL = 6
+
+
+class OutputStorageService(object):
+    """
+    Append-only storage of the output of jobs and python management requests.
+    Offsets and lengths are measured in bytes of UTF-8 encoded output.
+    """
+
+    @staticmethod
+    def append(scope, data):
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        if not data:
+            return
+
+        scope_model = type(scope)
+        content_type = ContentType.objects.get_for_model(scope_model)
+        line_count = data.count(b'\n')
+        with transaction.atomic():
+            output_length = scope_model.objects.select_for_update().filter(pk=scope.pk) \
+                .values_list('output_length', flat=True).get()
+            last_index = OutputChunk.objects.filter(content_type=content_type, object_id=scope.pk) \
+                .aggregate(Max('index'))['index__max']
+            OutputChunk.objects.create(
+                content_type=content_type,
+                object_id=scope.pk,
+                index=0 if last_index is None else last_index + 1,
+                offset=output_length,
+                length=len(data),
+                line_count=line_count,
+                data=zlib.compress(data, COMPRESSION_LEVEL),
+            )
+            scope_model.objects.filter(pk=scope.pk).update(
+                output_length=F('output_length') + len(data),
+                output_lines=F('output_lines') + line_count,
+            )
+        scope.output_length = output_length + len(data)
+        scope.output_lines = (scope.output_lines or 0) + line_count
+
+    @staticmethod
+    def read(scope, offset=0, limit=None):
+        """
+        Returns raw bytes of the output starting from offset, at most limit bytes if limit is given.
+        """
+        end = offset + limit if limit is not None else None
+        chunks = OutputStorageService.get_chunks(scope) \
+            .annotate(end=F('offset') + F('length')) \
+            .filter(end__gt=offset)
+        if end is not None:
+            chunks = chunks.filter(offset__lt=end)
+
+        parts = []
+        for chunk_offset, chunk_data in chunks.order_by('index').values_list('offset', 'data'):
+            data = zlib.decompress(bytes(chunk_data))
+            start = max(offset - chunk_offset, 0)
+            stop = end - chunk_offset if end is not None else None
+            parts.append(data[start:stop])
+        return b''.join(parts)
+
+    @staticmethod
+    def iterate(scope):
+        for chunk_data in OutputStorageService.get_chunks(scope).order_by('index') \
+                .values_list('data', flat=True).iterator():
+            yield zlib.decompress(bytes(chunk_data))
+
+    @staticmethod
+    def find_last_lines_offset(scope, lines):
+        """
+        Returns offset of the first of the last lines of the output.
+        Line counts of chunks are used to avoid reading the whole output.
+        """
+        start = 0
+        counted_lines = 0
+        for chunk_offset, line_count in OutputStorageService.get_chunks(scope).order_by('-index') \
+                .values_list('offset', 'line_count').iterator():
+            counted_lines += line_count
+            start = chunk_offset
+            if counted_lines > lines:
+                break
+
+        data = OutputStorageService.read(scope, offset=start)
+        last_lines = data.splitlines(True)[-lines:] if lines else []
+        return start + len(data) - sum(len(line) for line in last_lines)
+
+    @staticmethod
+    def read_all(scope):
+        if not scope.pk:
+            return ''
+        return force_text(OutputStorageService.read(scope), errors='replace')
+
+    @staticmethod
+    def clear(scope):
+        OutputStorageService.get_chunks(scope).delete()
+        type(scope).objects.filter(pk=scope.pk).update(output_length=0, output_lines=0)
+        scope.output_length = 0
+        scope.output_lines = 0
+
+    @staticmethod
+    def get_chunks(scope):
+        content_type = ContentType.objects.get_for_model(type(scope))
+        return OutputChunk.objects.filter(content_type=content_type, object_id=scope.pk)
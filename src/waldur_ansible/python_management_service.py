@@ -1,99 +1,186 @@
-from waldur_ansible.backend_processing.locking_service import PythonManagementBackendLockingService
-from waldur_ansible.models import PythonManagementSynchronizeRequest, \
-    PythonManagementDeleteVirtualEnvRequest
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from waldur_ansible.backend_processing.locking_service import PythonManagementBackendLockingService, \
+    PythonManagementLocksState, PythonManagementBackendLockBuilder
+from waldur_ansible.models import PythonManagement, PythonManagementSynchronizeRequest, \
+    PythonManagementDeleteVirtualEnvRequest, PythonManagementInitializeRequest, PythonManagementDeleteRequest, \
+    PythonManagementFindInstalledLibrariesRequest, VirtualEnvironment
 from waldur_core.core.models import StateMixin
 
+DEFAULT_DISCOVERY_RESULT_TTL = 60
+
 
 class PythonManagementService(object):
     
     @staticmethod
     def identify_changed_created_removed_envs(all_transient_virtual_environments, persisted_virtual_environments):
+        """
+        Libraries of all persisted virtual environments are fetched by a single query and both sides
+        are indexed by name, so the diff is linear in the number of virtual environments and libraries.
+        Library which is present on both sides with different versions is reported as upgraded,
+        it is installed with the desired version instead of being removed and installed again.
+        """
+        if hasattr(persisted_virtual_environments, 'prefetch_related'):
+            persisted_virtual_environments = persisted_virtual_environments.prefetch_related('installed_libraries')
+
+        transient_virtual_environments_by_name = dict(
+            (transient_virtual_environment['name'], transient_virtual_environment)
+            for transient_virtual_environment in all_transient_virtual_environments)
+        persisted_virtual_environment_names = set()
 
         removed_virtual_environments = []
         virtual_environments_to_create = []
         virtual_environments_to_change = []
 
         for virtual_environment in persisted_virtual_environments:
-            libraries_to_remove = []
-            libraries_to_install = []
             virtual_environment_name = virtual_environment.name
-            corresponding_transient_virtual_environment = PythonManagementService.find_corresponding_transient_virtual_environment(
-                virtual_environment_name, all_transient_virtual_environments)
+            persisted_virtual_environment_names.add(virtual_environment_name)
+            corresponding_transient_virtual_environment = transient_virtual_environments_by_name.get(
+                virtual_environment_name)
             if not corresponding_transient_virtual_environment:
                 removed_virtual_environments.append(virtual_environment)
-            else:
-                transient_libraries = corresponding_transient_virtual_environment['installed_libraries']
-                persisted_libraries = virtual_environment.installed_libraries.all()
-
-                for installed_library in persisted_libraries:
-                    transient_library = PythonManagementService.find_corresponding_transient_library(
-                        installed_library, transient_libraries)
-                    if not transient_library:
-                        libraries_to_remove.append(
-                            {'name': installed_library.name, 'version': installed_library.version})
-
-                for transient_library in transient_libraries:
-                    persisted_library = PythonManagementService.find_corresponding_persisted_library(
-                        transient_library, persisted_libraries)
-
-                    if not persisted_library:
-                        libraries_to_install.append(transient_library)
-
-                if libraries_to_remove or libraries_to_install:
-                    virtual_environments_to_change.append({
-                        'name': virtual_environment_name,
-                        'libraries_to_install': libraries_to_install,
-                        'libraries_to_remove': libraries_to_remove})
+                continue
+
+            transient_libraries = corresponding_transient_virtual_environment['installed_libraries']
+            libraries_to_install, libraries_to_remove, libraries_to_upgrade = PythonManagementService.diff_libraries(
+                transient_libraries, virtual_environment.installed_libraries.all())
+
+            if libraries_to_remove or libraries_to_install:
+                virtual_environments_to_change.append({
+                    'name': virtual_environment_name,
+                    'libraries_to_install': libraries_to_install,
+                    'libraries_to_remove': libraries_to_remove,
+                    'libraries_to_upgrade': libraries_to_upgrade,
+                    'desired_libraries': transient_libraries})
 
         for transient_virtual_environment in all_transient_virtual_environments:
-            persisted_virtual_environment = PythonManagementService.find_corresponding_persisted_virtual_environment(
-                transient_virtual_environment['name'], persisted_virtual_environments)
-            if not persisted_virtual_environment:
+            if transient_virtual_environment['name'] not in persisted_virtual_environment_names:
                 virtual_environments_to_create.append(transient_virtual_environment)
 
         return virtual_environments_to_create, virtual_environments_to_change, removed_virtual_environments
 
     @staticmethod
-    def is_global_request(request):
-        return not request.virtual_env_name
+    def diff_libraries(transient_libraries, persisted_libraries):
+        """
+        Returns libraries to install, which include upgraded ones, libraries to remove and upgraded libraries.
+        """
+        persisted_versions = {}
+        for persisted_library in persisted_libraries:
+            persisted_versions.setdefault(persisted_library.name, set()).add(persisted_library.version)
+        transient_library_names = set(transient_library['name'] for transient_library in transient_libraries)
+
+        libraries_to_install = []
+        libraries_to_upgrade = []
+        for transient_library in transient_libraries:
+            versions = persisted_versions.get(transient_library['name'])
+            if versions and transient_library['version'] in versions:
+                continue
+            libraries_to_install.append(transient_library)
+            if versions:
+                libraries_to_upgrade.append({
+                    'name': transient_library['name'],
+                    'version': transient_library['version'],
+                    'previous_version': sorted(versions)[0]})
+
+        libraries_to_remove = [
+            {'name': persisted_library.name, 'version': persisted_library.version}
+            for persisted_library in persisted_libraries
+            if persisted_library.name not in transient_library_names]
+
+        return libraries_to_install, libraries_to_remove, libraries_to_upgrade
 
     @staticmethod
-    def is_request_executing(request):
-        return request.state != StateMixin.States.OK and request.state != StateMixin.States.ERRED
+    def find_fresh_discovery_request(discovery_request):
+        """
+        Returns the last successfully completed request of the same type and scope, if it has completed
+        within PYTHON_MANAGEMENT_DISCOVERY_RESULT_TTL seconds and no request which modifies the scope
+        has been submitted or processed since the discovery has started.
+        """
+        ttl = settings.WALDUR_ANSIBLE.get('PYTHON_MANAGEMENT_DISCOVERY_RESULT_TTL', DEFAULT_DISCOVERY_RESULT_TTL)
+        if not ttl:
+            return None
+
+        python_management = discovery_request.python_management
+        virtual_env_name = discovery_request.virtual_env_name
+        last_request = type(discovery_request).objects.filter(
+            python_management=python_management,
+            virtual_env_name=virtual_env_name,
+            state=StateMixin.States.OK,
+            modified__gte=timezone.now() - datetime.timedelta(seconds=ttl),
+        ).order_by('-modified').first()
+        if not last_request:
+            return None
+
+        intervening_requests = Q(modified__gte=last_request.created) | \
+            ~Q(state__in=[StateMixin.States.OK, StateMixin.States.ERRED])
+        if PythonManagementInitializeRequest.objects.filter(intervening_requests, python_management=python_management).exists():
+            return None
+        for request_model in (PythonManagementSynchronizeRequest, PythonManagementDeleteVirtualEnvRequest,
+                              PythonManagementDeleteRequest):
+            requests = request_model.objects.filter(intervening_requests, python_management=python_management)
+            if virtual_env_name:
+                requests = requests.filter(virtual_env_name__in=[virtual_env_name, ''])
+            if requests.exists():
+                return None
+
+        return last_request
 
     @staticmethod
-    def find_corresponding_persisted_library(transient_library, persisted_libraries):
-        for persisted_library in persisted_libraries:
-            if persisted_library.name == transient_library['name'] and persisted_library.version == transient_library['version']:
-                return persisted_library
-        return None
+    def is_request_queue_enabled():
+        return settings.WALDUR_ANSIBLE.get('PYTHON_MANAGEMENT_REQUEST_QUEUE_ENABLED', True)
 
     @staticmethod
-    def find_corresponding_transient_library(persisted_library, transient_libraries):
-        for transient_library in transient_libraries:
-            if transient_library['name'] == persisted_library.name and transient_library['version'] == persisted_library.version:
-                return transient_library
-        return None
+    def is_global_request(request):
+        return not request.virtual_env_name
+
+    @staticmethod
+    def is_request_executing(request):
+        return request.state != StateMixin.States.OK and request.state != StateMixin.States.ERRED
 
     @staticmethod
-    def find_corresponding_persisted_virtual_environment(virtual_environment_name, persisted_virtual_environments):
-        for persisted_virtual_environment in persisted_virtual_environments:
-            if persisted_virtual_environment.name == virtual_environment_name:
-                return persisted_virtual_environment
-        return None
+    def read_locks_state(persisted_python_management, removed_virtual_environments,
+                         virtual_environments_to_change, virtual_environments_to_create):
+        virtual_env_names = [virtual_environment.name for virtual_environment in removed_virtual_environments] \
+            + [virtual_environment['name'] for virtual_environment in virtual_environments_to_change] \
+            + [virtual_environment['name'] for virtual_environment in virtual_environments_to_create]
+        return PythonManagementLocksState(persisted_python_management, virtual_env_names)
 
     @staticmethod
-    def find_corresponding_transient_virtual_environment(virtual_environment_name,
-                                                         transient_virtual_environments):
-        for transient_virtual_environment in transient_virtual_environments:
-            if transient_virtual_environment['name'] == virtual_environment_name:
-                return transient_virtual_environment
-        return None
+    def find_lock_keys(python_managements):
+        """
+        Locks are not enumerable in cache, so keys of all locks which may be held by python managements are built
+        from their persisted virtual environments and virtual environments of requests which are not finished yet.
+        """
+        python_managements_by_pk = dict((python_management.pk, python_management)
+                                        for python_management in python_managements)
+        virtual_env_names = dict((pk, set()) for pk in python_managements_by_pk)
+        related_virtual_envs = list(VirtualEnvironment.objects.filter(python_management__in=python_managements_by_pk)
+                                    .values_list('python_management_id', 'name'))
+        for request_class in (PythonManagementSynchronizeRequest, PythonManagementFindInstalledLibrariesRequest,
+                              PythonManagementDeleteVirtualEnvRequest):
+            related_virtual_envs += request_class.objects \
+                .filter(python_management__in=python_managements_by_pk) \
+                .exclude(state__in=(StateMixin.States.OK, StateMixin.States.ERRED)) \
+                .values_list('python_management_id', 'virtual_env_name')
+        for python_management_pk, virtual_env_name in related_virtual_envs:
+            virtual_env_names[python_management_pk].add(virtual_env_name)
 
+        lock_keys = []
+        for pk, python_management in python_managements_by_pk.items():
+            lock_keys += PythonManagementBackendLockBuilder.build_locks(python_management, sorted(virtual_env_names[pk]))
+        return lock_keys
 
     @staticmethod
     def create_or_refuse_requests(python_management_request_executor, persisted_python_management, removed_virtual_environments,
-        virtual_environments_to_change, virtual_environments_to_create):
+        virtual_environments_to_change, virtual_environments_to_create, locks_state=None):
+        if locks_state is None:
+            locks_state = PythonManagementService.read_locks_state(
+                persisted_python_management, removed_virtual_environments,
+                virtual_environments_to_change, virtual_environments_to_create)
         locked_virtual_envs = []
         for virtual_environment_to_create in virtual_environments_to_create:
             sync_request = PythonManagementSynchronizeRequest(
@@ -101,30 +188,129 @@ class PythonManagementService(object):
                 libraries_to_install=virtual_environment_to_create['installed_libraries'],
                 virtual_env_name=virtual_environment_to_create['name'])
 
-            PythonManagementService.create_or_refuse_request(python_management_request_executor, locked_virtual_envs, sync_request)
+            PythonManagementService.create_or_refuse_request(
+                python_management_request_executor, locked_virtual_envs, sync_request,
+                desired_libraries=virtual_environment_to_create['installed_libraries'], locks_state=locks_state)
 
         for removed_virtual_environment in removed_virtual_environments:
             delete_virt_env_request = PythonManagementDeleteVirtualEnvRequest(
                 python_management=persisted_python_management,
                 virtual_env_name=removed_virtual_environment.name)
 
-            PythonManagementService.create_or_refuse_request(python_management_request_executor, locked_virtual_envs, delete_virt_env_request)
+            PythonManagementService.create_or_refuse_request(
+                python_management_request_executor, locked_virtual_envs, delete_virt_env_request, locks_state=locks_state)
 
         for virtual_environment_to_change in virtual_environments_to_change:
             sync_request = PythonManagementSynchronizeRequest(
                 python_management=persisted_python_management,
                 libraries_to_install=virtual_environment_to_change['libraries_to_install'],
                 libraries_to_remove=virtual_environment_to_change['libraries_to_remove'],
+                libraries_to_upgrade=virtual_environment_to_change['libraries_to_upgrade'],
                 virtual_env_name=virtual_environment_to_change['name'])
 
-            PythonManagementService.create_or_refuse_request(python_management_request_executor, locked_virtual_envs, sync_request)
+            PythonManagementService.create_or_refuse_request(
+                python_management_request_executor, locked_virtual_envs, sync_request,
+                desired_libraries=virtual_environment_to_change['desired_libraries'], locks_state=locks_state)
 
         return locked_virtual_envs
 
     @staticmethod
-    def create_or_refuse_request(python_management_request_executor, locked_virtual_envs, sync_request):
-        if PythonManagementBackendLockingService.is_processing_allowed(sync_request):
+    def create_or_refuse_request(python_management_request_executor, locked_virtual_envs, sync_request,
+                                 desired_libraries=None, locks_state=None):
+        if PythonManagementBackendLockingService.is_processing_allowed(sync_request, locks_state):
+            sync_request.save()
+            python_management_request_executor.execute(sync_request, async=True)
+        elif desired_libraries is not None:
+            persisted_python_management = sync_request.python_management
+            PythonManagementService.defer_synchronization(
+                persisted_python_management, sync_request.virtual_env_name, desired_libraries)
+            # Lock may have been released after it was checked
+            transaction.on_commit(lambda: PythonManagementService.dispatch_deferred_requests(
+                python_management_request_executor, persisted_python_management))
+        elif PythonManagementService.is_request_queue_enabled():
+            # Request waits in the queue until requests of the virtual environment submitted earlier are finished
             sync_request.save()
             python_management_request_executor.execute(sync_request, async=True)
         else:
             locked_virtual_envs.append(sync_request.virtual_env_name)
+
+    @staticmethod
+    def defer_synchronization(persisted_python_management, virtual_env_name, desired_libraries):
+        """
+        Virtual environment is being processed, so synchronization is postponed until it is unlocked.
+        There is at most one deferred request per virtual environment. It keeps the latest desired
+        state rather than the delta, because all deltas computed meanwhile are relative to the same
+        persisted state, which is changed by the request holding the lock.
+        """
+        # Row of python management is locked, so that concurrent updates do not create two deferred requests
+        PythonManagement.objects.select_for_update().filter(pk=persisted_python_management.pk).first()
+        deferred_request = PythonManagementSynchronizeRequest.objects.filter(
+            python_management=persisted_python_management, virtual_env_name=virtual_env_name, deferred=True).first()
+        if deferred_request:
+            deferred_request.desired_libraries = desired_libraries
+            deferred_request.save(update_fields=['desired_libraries', 'modified'])
+        else:
+            deferred_request = PythonManagementSynchronizeRequest.objects.create(
+                python_management=persisted_python_management,
+                virtual_env_name=virtual_env_name,
+                desired_libraries=desired_libraries,
+                deferred=True,
+                recompute_libraries=True)
+        return deferred_request
+
+    @staticmethod
+    def dispatch_deferred_requests(python_management_request_executor, persisted_python_management):
+        """
+        Dispatches deferred synchronization requests of virtual environments which are not locked anymore.
+        Libraries to install and remove are computed against the current persisted state.
+        """
+        with transaction.atomic():
+            PythonManagement.objects.select_for_update().filter(pk=persisted_python_management.pk).first()
+            deferred_requests = list(PythonManagementSynchronizeRequest.objects.filter(
+                python_management=persisted_python_management, deferred=True))
+            if not deferred_requests:
+                return
+            locks_state = PythonManagementLocksState(
+                persisted_python_management, [deferred_request.virtual_env_name for deferred_request in deferred_requests])
+            for deferred_request in deferred_requests:
+                if not PythonManagementBackendLockingService.is_processing_allowed(deferred_request, locks_state):
+                    continue
+
+                if not PythonManagementService.refresh_libraries_delta(deferred_request):
+                    # Desired state has been reached by the request which held the lock
+                    deferred_request.delete()
+                    continue
+
+                deferred_request.deferred = False
+                deferred_request.recompute_libraries = True
+                deferred_request.save()
+                python_management_request_executor.execute(deferred_request, async=True)
+
+    @staticmethod
+    def refresh_libraries_delta(sync_request):
+        """
+        Computes libraries to install, remove and upgrade from desired libraries of the request against the current
+        persisted state. Request may wait in the queue after it is dispatched, so it is computed once again
+        when its processing begins. Returns False if virtual environment already contains desired libraries.
+        """
+        transient_virtual_environments = [
+            {'name': sync_request.virtual_env_name, 'installed_libraries': sync_request.desired_libraries}]
+        persisted_virtual_environments = sync_request.python_management.virtual_environments.filter(
+            name=sync_request.virtual_env_name)
+        virtual_environments_to_create, virtual_environments_to_change, _ = \
+            PythonManagementService.identify_changed_created_removed_envs(
+                transient_virtual_environments, persisted_virtual_environments)
+
+        if virtual_environments_to_create:
+            sync_request.libraries_to_install = sync_request.desired_libraries
+            sync_request.libraries_to_remove = []
+            sync_request.libraries_to_upgrade = []
+        elif virtual_environments_to_change:
+            sync_request.libraries_to_install = virtual_environments_to_change[0]['libraries_to_install']
+            sync_request.libraries_to_remove = virtual_environments_to_change[0]['libraries_to_remove']
+            sync_request.libraries_to_upgrade = virtual_environments_to_change[0]['libraries_to_upgrade']
+        else:
+            return False
+        if sync_request.pk:
+            sync_request.save(update_fields=['libraries_to_install', 'libraries_to_remove', 'libraries_to_upgrade'])
+        return True
@@ -0,0 +1,295 @@
+import datetime
+import logging
+import threading
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from waldur_ansible.models import QueuedExecution
+from waldur_ansible.output_storage_service import OutputStorageService
+from waldur_core.core import utils as core_utils
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT_EXECUTIONS_PER_PROJECT = 10
+DEFAULT_MAX_CONCURRENT_EXECUTIONS_PER_SERVICE_PROJECT_LINK = 10
+DEFAULT_EXECUTION_HEARTBEAT_TIMEOUT = 30 * 60
+# Arbitrary identifier of PostgreSQL advisory lock which serializes releases of queued executions
+QUEUE_ADVISORY_LOCK_ID = 0x57414e53
+
+
+def get_heartbeat_timeout():
+    return settings.WALDUR_ANSIBLE.get('EXECUTION_HEARTBEAT_TIMEOUT', DEFAULT_EXECUTION_HEARTBEAT_TIMEOUT)
+
+
+def get_service_project_link(scope):
+    if hasattr(scope, 'service_project_link'):
+        return scope.service_project_link
+    return scope.python_management.service_project_link
+
+
+def get_serialization_scope(scope):
+    """
+    Requests of the same python management are serialized: requests related to the same virtual environment
+    are executed one by one, while requests related to the whole python management are executed exclusively.
+    If the queue of python management is disabled, conflicting requests are refused by locks instead.
+    """
+    if not hasattr(scope, 'python_management') \
+            or not settings.WALDUR_ANSIBLE.get('PYTHON_MANAGEMENT_REQUEST_QUEUE_ENABLED', True):
+        return '', ''
+    return 'python_management_%s' % scope.python_management_id, getattr(scope, 'virtual_env_name', '')
+
+
+def executions_conflict(execution, other_execution):
+    if not execution.serialization_group or execution.serialization_group != other_execution.serialization_group:
+        return False
+    return not execution.serialization_key or not other_execution.serialization_key \
+        or execution.serialization_key == other_execution.serialization_key
+
+
+class ExecutionLimits(object):
+
+    def __init__(self):
+        self.total = settings.WALDUR_ANSIBLE.get('MAX_CONCURRENT_EXECUTIONS')
+        self.per_project = settings.WALDUR_ANSIBLE.get(
+            'MAX_CONCURRENT_EXECUTIONS_PER_PROJECT', DEFAULT_MAX_CONCURRENT_EXECUTIONS_PER_PROJECT)
+        self.per_service_project_link = settings.WALDUR_ANSIBLE.get(
+            'MAX_CONCURRENT_EXECUTIONS_PER_SERVICE_PROJECT_LINK',
+            DEFAULT_MAX_CONCURRENT_EXECUTIONS_PER_SERVICE_PROJECT_LINK)
+
+    @staticmethod
+    def is_reached(limit, count):
+        return limit is not None and count >= limit
+
+
+class SchedulingService(object):
+    """
+    Admission control for jobs and python management requests.
+    Every execution is queued first and is dispatched only if global, per project and
+    per service project link limits of concurrently running executions allow it.
+    Queued executions are released project by project in round-robin manner,
+    so a project which submitted a burst of executions does not starve other projects.
+    """
+
+    @staticmethod
+    def submit(executor, scope, **executor_kwargs):
+        """
+        Keyword arguments of the executor, e.g. countdown, are stored and passed to it on dispatch,
+        so they should be serializable to JSON.
+        """
+        serialization_group, serialization_key = get_serialization_scope(scope)
+        QueuedExecution.objects.create(
+            scope=scope,
+            executor=core_utils.serialize_class(executor),
+            executor_kwargs=executor_kwargs,
+            service_project_link=get_service_project_link(scope),
+            serialization_group=serialization_group,
+            serialization_key=serialization_key,
+        )
+        SchedulingService.release()
+
+    @staticmethod
+    def get_queue_position(scope):
+        """
+        Returns 0 if execution is running, number of its place in the queue of its serialization group
+        or the whole queue if it is waiting, or None if execution is not queued.
+        """
+        content_type = ContentType.objects.get_for_model(type(scope))
+        execution = QueuedExecution.objects.filter(content_type=content_type, object_id=scope.pk).first()
+        if execution is None:
+            return None
+        if execution.state == QueuedExecution.States.RUNNING:
+            return 0
+        executions_ahead = QueuedExecution.objects.filter(state=QueuedExecution.States.QUEUED).filter(
+            Q(created__lt=execution.created) | Q(created=execution.created, pk__lt=execution.pk))
+        if execution.serialization_group:
+            executions_ahead = executions_ahead.filter(serialization_group=execution.serialization_group)
+        return executions_ahead.count() + 1
+
+    @staticmethod
+    def finish(scope):
+        content_type = ContentType.objects.get_for_model(type(scope))
+        deleted, _ = QueuedExecution.objects.filter(content_type=content_type, object_id=scope.pk).delete()
+        if deleted:
+            SchedulingService.release()
+
+    @staticmethod
+    def release():
+        limits = ExecutionLimits()
+        with transaction.atomic():
+            SchedulingService.lock_queue()
+            executions = list(QueuedExecution.objects
+                              .filter(state__in=(QueuedExecution.States.QUEUED, QueuedExecution.States.RUNNING))
+                              .select_related('service_project_link').order_by('created', 'pk'))
+            released_executions = SchedulingService.select_executions_to_release(executions, limits)
+            QueuedExecution.objects.filter(pk__in=[e.pk for e in released_executions]) \
+                .update(state=QueuedExecution.States.RUNNING, heartbeat=timezone.now())
+            transaction.on_commit(lambda: SchedulingService.dispatch(released_executions))
+        return released_executions
+
+    @staticmethod
+    def lock_queue():
+        """
+        Serializes releases of executions till the end of transaction. Single advisory lock is used
+        on PostgreSQL, so that rows of the queue and their service project links are not locked and
+        submission, heartbeat and finishing of executions do not wait for release. Other databases
+        lock rows of the queue without joined tables.
+        """
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [QUEUE_ADVISORY_LOCK_ID])
+        else:
+            list(QueuedExecution.objects.select_for_update()
+                 .filter(state__in=(QueuedExecution.States.QUEUED, QueuedExecution.States.RUNNING))
+                 .values_list('pk', flat=True))
+
+    @staticmethod
+    def select_executions_to_release(executions, limits):
+        running_total = 0
+        running_per_project = Counter()
+        running_per_service_project_link = Counter()
+        queues = OrderedDict()
+        blocked_executions = SchedulingService.find_blocked_executions(executions)
+
+        for execution in executions:
+            project_id = execution.service_project_link.project_id
+            if execution.state == QueuedExecution.States.RUNNING:
+                running_total += 1
+                running_per_project[project_id] += 1
+                running_per_service_project_link[execution.service_project_link_id] += 1
+            elif execution.pk not in blocked_executions:
+                queues.setdefault(project_id, []).append(execution)
+
+        # Projects with fewer running executions go first, ties are broken by the age of the oldest queued item
+        project_ids = sorted(queues, key=lambda p: (running_per_project[p], queues[p][0].created))
+
+        released_executions = []
+        while project_ids and not ExecutionLimits.is_reached(limits.total, running_total):
+            for project_id in list(project_ids):
+                if ExecutionLimits.is_reached(limits.total, running_total):
+                    break
+
+                queue = queues[project_id]
+                execution = None
+                if not ExecutionLimits.is_reached(limits.per_project, running_per_project[project_id]):
+                    execution = next((e for e in queue if not ExecutionLimits.is_reached(
+                        limits.per_service_project_link,
+                        running_per_service_project_link[e.service_project_link_id])), None)
+
+                if execution is None:
+                    project_ids.remove(project_id)
+                    continue
+
+                queue.remove(execution)
+                if not queue:
+                    project_ids.remove(project_id)
+                released_executions.append(execution)
+                running_total += 1
+                running_per_project[project_id] += 1
+                running_per_service_project_link[execution.service_project_link_id] += 1
+
+        return released_executions
+
+    @staticmethod
+    def find_blocked_executions(executions):
+        """
+        Returns primary keys of queued executions which conflict with a running execution or with
+        a queued execution submitted earlier, executions are expected to be ordered by submission time.
+        Executions which are not blocked do not conflict with each other, so they can run concurrently.
+        """
+        preceding_executions_by_group = {}
+        for execution in executions:
+            if execution.serialization_group and execution.state == QueuedExecution.States.RUNNING:
+                preceding_executions_by_group.setdefault(execution.serialization_group, []).append(execution)
+
+        blocked_executions = set()
+        for execution in executions:
+            if not execution.serialization_group or execution.state != QueuedExecution.States.QUEUED:
+                continue
+            preceding_executions = preceding_executions_by_group.setdefault(execution.serialization_group, [])
+            if any(executions_conflict(execution, preceding) for preceding in preceding_executions):
+                blocked_executions.add(execution.pk)
+            preceding_executions.append(execution)
+        return blocked_executions
+
+    @staticmethod
+    def dispatch(executions):
+        for execution in executions:
+            scope = execution.scope
+            if scope is None:
+                logger.info('Queued execution %s refers to removed object, skipping it.', execution.pk)
+                execution.delete()
+                continue
+            executor = core_utils.deserialize_class(execution.executor)
+            executor.dispatch(scope, **(execution.executor_kwargs or {}))
+
+    @staticmethod
+    def beat(scope):
+        content_type = ContentType.objects.get_for_model(type(scope))
+        QueuedExecution.objects.filter(
+            content_type=content_type, object_id=scope.pk, state=QueuedExecution.States.RUNNING) \
+            .update(heartbeat=timezone.now())
+
+    @staticmethod
+    def cleanup():
+        """
+        Forgets executions which are finished, but were not reported as such, and fails executions
+        which have not been reported alive for EXECUTION_HEARTBEAT_TIMEOUT seconds, e.g. because of worker crash,
+        so that they do not occupy slots and block following requests of python management forever.
+        """
+        expiration_time = timezone.now() - datetime.timedelta(seconds=get_heartbeat_timeout())
+        for execution in QueuedExecution.objects.filter(state=QueuedExecution.States.RUNNING):
+            scope = execution.scope
+            if scope is None or scope.state in (scope.States.OK, scope.States.ERRED):
+                execution.delete()
+            elif (execution.heartbeat or execution.modified) < expiration_time:
+                SchedulingService.fail_lost_execution(scope)
+        SchedulingService.release()
+
+    @staticmethod
+    def fail_lost_execution(scope):
+        logger.warning('Execution of %s has not been reported alive in time, marking it as erred.', scope)
+        message = 'Execution has been lost, worker has not reported it for %s seconds.' % get_heartbeat_timeout()
+        with transaction.atomic():
+            OutputStorageService.append(scope, '\n%s\n' % message)
+            scope.error_message = message
+            # Execution is finished by post transition handler. Task which has not started yet
+            # is not able to start after that, because erred scope cannot begin creating.
+            scope.set_erred()
+            scope.save()
+
+
+class ExecutionHeartbeat(object):
+    """
+    Reports execution as alive in a background thread while worker runs it, so that execution
+    of crashed worker is detected by SchedulingService.cleanup.
+    """
+
+    def __init__(self, scope, interval=None):
+        self.scope = scope
+        self.interval = interval or max(get_heartbeat_timeout() / 6.0, 1)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.run, name='execution-heartbeat')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    SchedulingService.beat(self.scope)
+                except Exception:  # noqa
+                    logger.exception('Unable to report execution of %s alive.', self.scope)
+        finally:
+            connection.close()
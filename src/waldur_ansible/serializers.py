@@ -10,7 +10,9 @@ from rest_framework import serializers, exceptions
 from waldur_ansible.models import PythonManagement, Job, PythonManagementInitializeRequest, \
     PythonManagementSynchronizeRequest, PythonManagementFindVirtualEnvsRequest, \
     PythonManagementFindInstalledLibrariesRequest, PythonManagementDeleteRequest, PythonManagementDeleteVirtualEnvRequest
+from waldur_ansible.scheduling_service import SchedulingService
 from waldur_ansible.utils import execute_safely
+from waldur_ansible.workspace_storage_service import WorkspaceStorageService
 from waldur_core.core import models as core_models
 from waldur_core.core.models import StateMixin
 from waldur_core.core.serializers import AugmentedSerializerMixin, JSONField, BaseSummarySerializer
@@ -48,7 +50,8 @@ class PlaybookSerializer(AugmentedSerializerMixin, serializers.HyperlinkedModelS
 
     class Meta(object):
         model = models.Playbook
-        fields = ('url', 'uuid', 'name', 'description', 'archive', 'entrypoint', 'parameters', 'image')
+        fields = ('url', 'uuid', 'name', 'description', 'archive', 'entrypoint', 'parameters', 'image',
+                  'timeout', 'idle_timeout')
         protected_fields = ('entrypoint', 'parameters', 'archive')
         extra_kwargs = {
             'url': {'lookup_field': 'uuid'},
@@ -89,7 +92,7 @@ class PlaybookSerializer(AugmentedSerializerMixin, serializers.HyperlinkedModelS
         validated_data['workspace'] = models.Playbook.generate_workspace_path()
 
         zip_file = ZipFile(archive)
-        zip_file.extractall(validated_data['workspace'])
+        validated_data['manifest'] = WorkspaceStorageService.extract(zip_file, validated_data['workspace'])
         zip_file.close()
 
         playbook = models.Playbook.objects.create(**validated_data)
@@ -143,6 +146,7 @@ class JobSerializer(AugmentedSerializerMixin,
     arguments = JSONField(default={})
     state = serializers.SerializerMethodField()
     tag = serializers.SerializerMethodField()
+    output = serializers.SerializerMethodField()
 
     class Meta(object):
         model = models.Job
@@ -152,8 +156,8 @@ class JobSerializer(AugmentedSerializerMixin,
                   'project', 'project_name', 'project_uuid',
                   'playbook', 'playbook_name', 'playbook_uuid',
                   'playbook_image', 'playbook_description',
-                  'arguments', 'state', 'output', 'created', 'modified', 'tag')
-        read_only_fields = ('output', 'created', 'modified')
+                  'arguments', 'state', 'output', 'output_length', 'output_lines', 'created', 'modified', 'tag')
+        read_only_fields = ('output', 'output_length', 'output_lines', 'created', 'modified')
         protected_fields = ('service_project_link', 'ssh_public_key', 'playbook', 'arguments')
         extra_kwargs = {
             'url': {'lookup_field': 'uuid'},
@@ -168,6 +172,13 @@ class JobSerializer(AugmentedSerializerMixin,
     def get_tag(self, obj):
         return obj.get_tag()
 
+    def get_output(self, obj):
+        # Output is fetched from output storage for a single job only, lists expose its length instead
+        view = self.context.get('view')
+        if view and view.action == 'retrieve':
+            return obj.output
+        return None
+
     def check_project(self, attrs):
         if self.instance:
             project = self.instance.service_project_link.project
@@ -210,6 +221,13 @@ class JobSerializer(AugmentedSerializerMixin,
         return attrs
 
 
+class JobEventSerializer(serializers.ModelSerializer):
+    class Meta(object):
+        model = models.JobEvent
+        fields = ('index', 'event', 'task', 'host', 'status', 'started', 'finished', 'duration', 'payload')
+        read_only_fields = fields
+
+
 class InstalledPackageSerializer(AugmentedSerializerMixin, serializers.HyperlinkedModelSerializer):
     class Meta(object):
         model = models.InstalledLibrary
@@ -233,11 +251,14 @@ class PythonManagementRequestMixin(AugmentedSerializerMixin, serializers.Hyperli
     request_type = serializers.SerializerMethodField()
     state = serializers.SerializerMethodField()
     output = serializers.SerializerMethodField()
+    queue_position = serializers.SerializerMethodField()
 
     class Meta(object):
         model = NotImplemented
-        fields = ('uuid', 'output', 'state','created', 'modified','request_type',)
-        read_only_fields = ('uuid', 'output', 'state','created', 'modified','request_type',)
+        fields = ('uuid', 'output', 'output_length', 'output_lines', 'state','created', 'modified','request_type',
+                  'queue_position',)
+        read_only_fields = ('uuid', 'output', 'output_length', 'output_lines', 'state','created', 'modified','request_type',
+                            'queue_position',)
         extra_kwargs = {
             'url': {'lookup_field': 'uuid'},
         }
@@ -251,6 +272,11 @@ class PythonManagementRequestMixin(AugmentedSerializerMixin, serializers.Hyperli
     def get_request_type(self, obj):
         return REQUEST_TYPES_PLAIN_NAMES.get(type(obj))
 
+    def get_queue_position(self, obj):
+        if obj.state != StateMixin.States.CREATION_SCHEDULED:
+            return None
+        return SchedulingService.get_queue_position(obj)
+
     def get_state(self, obj):
         return StateUtils.to_human_readable_state(obj.state)
 
@@ -281,11 +307,12 @@ class PythonManagementSynchronizeRequestSerializer(#PermissionFieldFilteringMixi
                                                    PythonManagementRequestMixin):
     libraries_to_install = JSONField(default={})
     libraries_to_remove = JSONField(default={})
+    libraries_to_upgrade = JSONField(read_only=True)
 
     class Meta(PythonManagementRequestMixin.Meta):
         model = models.PythonManagementSynchronizeRequest
         fields = PythonManagementRequestMixin.Meta.fields \
-            + ('libraries_to_install', 'libraries_to_remove', 'virtual_env_name')
+            + ('libraries_to_install', 'libraries_to_remove', 'libraries_to_upgrade', 'virtual_env_name', 'deferred')
 
 class PythonManagementSerializer(AugmentedSerializerMixin,
                     PermissionFieldFilteringMixin,
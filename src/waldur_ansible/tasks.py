@@ -9,7 +9,7 @@ logger = logging.getLogger(__name__)
 
 
 @shared_task(name='waldur_ansible.tasks.delete_playbook_workspace')
-def delete_playbook_workspace(workspace_path):
+def delete_playbook_workspace(workspace_path, content_hashes=None):
     logger.debug('Deleting playbook workspace %s.', workspace_path)
     try:
         rmtree(workspace_path)
@@ -22,6 +22,56 @@ def delete_playbook_workspace(workspace_path):
     else:
         logger.info('Playbook workspace %s has been deleted.', workspace_path)
 
+    if content_hashes:
+        from waldur_ansible.workspace_storage_service import WorkspaceStorageService
+        WorkspaceStorageService.collect_garbage(content_hashes)
+
+
+@shared_task(name='waldur_ansible.collect_workspace_blobs')
+def collect_workspace_blobs():
+    """
+    This task is used by Celery beat in order to delete blobs of playbook workspaces
+    which have not been deleted together with the workspace.
+    """
+    from waldur_ansible.workspace_storage_service import WorkspaceStorageService
+    WorkspaceStorageService.collect_garbage()
+
+
+@shared_task(name='waldur_ansible.cleanup_ssh_control_sockets')
+def cleanup_ssh_control_sockets():
+    """
+    This task is used by Celery beat in order to remove control sockets of SSH master connections
+    which have been terminated without cleanup.
+    """
+    from waldur_ansible.backend_processing.ssh_multiplexing_service import SshMultiplexingService
+    SshMultiplexingService.cleanup()
+
+
+@shared_task(name='waldur_ansible.dispatch_deferred_python_management_requests')
+def dispatch_deferred_python_management_requests():
+    """
+    This task is used by Celery beat in order to dispatch deferred synchronization requests
+    if virtual environment lock has expired instead of being released.
+    """
+    from waldur_ansible.executors import PythonManagementRequestExecutor
+    from waldur_ansible.models import PythonManagement, PythonManagementSynchronizeRequest
+    from waldur_ansible.python_management_service import PythonManagementService
+
+    python_managements = PythonManagement.objects.filter(
+        pk__in=PythonManagementSynchronizeRequest.objects.filter(deferred=True).values('python_management'))
+    for python_management in python_managements:
+        PythonManagementService.dispatch_deferred_requests(PythonManagementRequestExecutor, python_management)
+
+
+@shared_task(name='waldur_ansible.release_queued_executions')
+def release_queued_executions():
+    """
+    This task is used by Celery beat in order to release queued executions
+    even if completion of some execution has not been reported.
+    """
+    from waldur_ansible.scheduling_service import SchedulingService
+    SchedulingService.cleanup()
+
 
 @shared_task(name='waldur_ansible.sync_pip_packages')
 def sync_pip_packages():
@@ -38,17 +88,18 @@ def schedule_sync():
     """
     from waldur_ansible.backend_processing import cache_utils
     from waldur_ansible.backend_processing.locking_service import PIP_SYNCING_LOCK, PIP_SYNCING_TIMEOUT
-    if settings.WALDUR_ANSIBLE.get('SYNC_PIP_PACKAGES_TASK_ENABLED') or cache_utils.is_syncing(PIP_SYNCING_LOCK):
+    if settings.WALDUR_ANSIBLE.get('SYNC_PIP_PACKAGES_TASK_ENABLED'):
         return
 
-    cache_utils.renew_task_status(PIP_SYNCING_LOCK, PIP_SYNCING_TIMEOUT)
-    _sync_pip_packages.apply_async(countdown=10)
+    lock_token = cache_utils.acquire_lock(PIP_SYNCING_LOCK, PIP_SYNCING_TIMEOUT)
+    if lock_token:
+        _sync_pip_packages.apply_async(args=[lock_token], countdown=10)
 
 @shared_task()
-def _sync_pip_packages():
+def _sync_pip_packages(lock_token=None):
     """
     This task actually calls backend. It is called asynchronously
     either by signal handler or Celery beat schedule.
     """
     from waldur_ansible.backend_processing.pip_backend import PipPackageListBackend
-    PipPackageListBackend().synchronize_pip_package_list()
+    PipPackageListBackend().synchronize_pip_package_list(lock_token)
@@ -91,3 +91,30 @@ class JobFactory(factory.DjangoModelFactory):
     @classmethod
     def get_list_url(cls):
         return 'http://testserver' + reverse(get_list_view_name(models.Job))
+
+
+class PythonManagementFactory(factory.DjangoModelFactory):
+    class Meta(object):
+        model = models.PythonManagement
+
+    user = factory.SubFactory(structure_factories.UserFactory)
+    instance = factory.SubFactory(openstack_factories.InstanceFactory)
+    service_project_link = factory.SelfAttribute('instance.service_project_link')
+    virtual_envs_dir_path = factory.Sequence(lambda n: 'virtual_envs%s' % n)
+
+
+class VirtualEnvironmentFactory(factory.DjangoModelFactory):
+    class Meta(object):
+        model = models.VirtualEnvironment
+
+    python_management = factory.SubFactory(PythonManagementFactory)
+    name = factory.Sequence(lambda n: 'virtual_env%s' % n)
+
+
+class InstalledLibraryFactory(factory.DjangoModelFactory):
+    class Meta(object):
+        model = models.InstalledLibrary
+
+    virtual_environment = factory.SubFactory(VirtualEnvironmentFactory)
+    name = factory.Sequence(lambda n: 'library%s' % n)
+    version = '1.0.0'
@@ -5,6 +5,7 @@ import mock
 from rest_framework.test import APITransactionTestCase
 from rest_framework import status
 
+from waldur_ansible.output_storage_service import OutputStorageService
 from waldur_core.structure.tests import factories as structure_factories
 from waldur_openstack.openstack_tenant import models as openstack_models
 from waldur_openstack.openstack_tenant.tests import factories as openstack_factories
@@ -147,13 +148,98 @@ class CountersTest(JobBaseTest):
 
 
 class JobBackendTest(JobBaseTest):
-    @mock.patch('subprocess.check_output')
+    @mock.patch('waldur_ansible.backend_processing.ansible_playbook_backend.iterate_process_output')
     @mock.patch('os.path.exists')
-    def test_job_id_is_passed_as_extra_argument_to_ansible(self, path_exists, check_output):
+    def test_job_id_is_passed_as_extra_argument_to_ansible(self, path_exists, iterate_process_output):
         path_exists.return_value = True
-        check_output.return_value = 'OK'
+        iterate_process_output.return_value = iter(['OK'])
 
         self.job.get_backend().run_job(self.job)
-        args = check_output.call_args[0][0]
+        args = iterate_process_output.call_args[0][0]
         command = ' '.join(args)
         self.assertTrue(self.job.get_tag() in command)
+
+    @mock.patch('waldur_ansible.backend_processing.ansible_playbook_backend.iterate_process_output')
+    @mock.patch('os.path.exists')
+    def test_job_output_is_streamed_to_database(self, path_exists, iterate_process_output):
+        path_exists.return_value = True
+        iterate_process_output.return_value = iter(['PLAY [localhost]\n', 'TASK [create]\n', 'ok: [localhost]\n'])
+
+        self.job.get_backend().run_job(self.job)
+        self.assertEqual(self.job.output, 'PLAY [localhost]\nTASK [create]\nok: [localhost]\n')
+
+
+@mock.patch('waldur_ansible.backend_processing.ansible_playbook_backend.AnsiblePlaybookBackend.decode_events')
+@mock.patch('waldur_ansible.backend_processing.ansible_playbook_backend.AnsiblePlaybookBackend.run_job')
+class JobPreviewTest(JobBaseTest):
+    def setUp(self):
+        super(JobPreviewTest, self).setUp()
+        self.backend = self.job.get_backend()
+
+    def test_check_mode_run_is_reused_for_the_same_arguments(self, run_job, decode_events):
+        decode_events.return_value = [{'name': 'vm'}]
+
+        self.assertEqual(self.backend.preview_job(self.job), [{'name': 'vm'}])
+        self.assertEqual(self.backend.preview_job(self.job), [{'name': 'vm'}])
+        run_job.assert_called_once_with(self.job, check_mode=True)
+
+    def test_check_mode_run_is_repeated_if_arguments_have_changed(self, run_job, decode_events):
+        decode_events.return_value = []
+
+        self.backend.preview_job(self.job)
+        self.job.arguments = dict(self.job.arguments, flavor='large')
+        self.backend.preview_job(self.job)
+        self.assertEqual(run_job.call_count, 2)
+
+    def test_cached_preview_is_invalidated_when_playbook_is_updated(self, run_job, decode_events):
+        decode_events.return_value = []
+
+        self.backend.preview_job(self.job)
+        self.job.playbook.save()
+        self.backend.preview_job(self.job)
+        self.assertEqual(run_job.call_count, 2)
+
+
+class JobOutputTest(JobBaseTest):
+    def setUp(self):
+        super(JobOutputTest, self).setUp()
+        OutputStorageService.append(self.job, 'line 1\nline 2\n')
+        OutputStorageService.append(self.job, 'line 3\n')
+        self.client.force_authenticate(self.fixture.staff)
+
+    def test_output_is_returned_from_offset(self):
+        response = self.client.get(factories.JobFactory.get_url(self.job, action='output'), {'offset': 7})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['output'], 'line 2\nline 3\n')
+        self.assertEqual(response.data['offset'], 21)
+
+    def test_number_of_returned_lines_is_limited(self):
+        response = self.client.get(factories.JobFactory.get_url(self.job, action='output'), {'offset': 0, 'lines': 1})
+        self.assertEqual(response.data['output'], 'line 1\n')
+        self.assertEqual(response.data['offset'], 7)
+
+    def test_last_lines_are_returned_if_offset_is_not_specified(self):
+        response = self.client.get(factories.JobFactory.get_url(self.job, action='output'), {'lines': 2})
+        self.assertEqual(response.data['output'], 'line 2\nline 3\n')
+        self.assertEqual(response.data['offset'], 21)
+
+    def test_invalid_offset_is_rejected(self):
+        response = self.client.get(factories.JobFactory.get_url(self.job, action='output'), {'offset': -1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_raw_output_range_is_returned(self):
+        response = self.client.get(factories.JobFactory.get_url(self.job, action='raw_output'), HTTP_RANGE='bytes=7-13')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response.content, b'line 2\n')
+        self.assertEqual(response['Content-Range'], 'bytes 7-13/21')
+
+    def test_unsatisfiable_range_is_rejected(self):
+        response = self.client.get(factories.JobFactory.get_url(self.job, action='raw_output'), HTTP_RANGE='bytes=50-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_invalid_range_is_ignored(self):
+        for range_header in ('bytes=13-7', 'bytes=7-13,15-17', 'lines=1-2'):
+            response = self.client.get(
+                factories.JobFactory.get_url(self.job, action='raw_output'), HTTP_RANGE=range_header)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(b''.join(response.streaming_content), b'line 1\nline 2\nline 3\n')
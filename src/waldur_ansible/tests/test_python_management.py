@@ -0,0 +1,164 @@
+from __future__ import unicode_literals
+
+import datetime
+
+import mock
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITransactionTestCase
+
+from waldur_ansible import executors, models
+from waldur_ansible.backend_processing import cache_utils
+from waldur_ansible.backend_processing.locking_service import PythonManagementBackendLockBuilder
+from waldur_ansible.scheduling_service import SchedulingService
+from waldur_core.structure.tests import factories as structure_factories
+
+from . import factories
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+@mock.patch('waldur_ansible.scheduling_service.SchedulingService.dispatch')
+class PythonManagementRequestQueueTest(APITransactionTestCase):
+    def setUp(self):
+        self.python_management = factories.PythonManagementFactory()
+        self.client.force_authenticate(structure_factories.UserFactory(is_staff=True))
+
+    def get_url(self, action, **kwargs):
+        kwargs['uuid'] = self.python_management.uuid.hex
+        return 'http://testserver' + reverse('python_management-%s' % action, kwargs=kwargs)
+
+    def find_virtual_environments(self):
+        return self.client.get(self.get_url('find-virtual-environments'))
+
+    def find_installed_libraries(self):
+        return self.client.get(self.get_url('find-installed-libraries', virtual_env_name='venv'))
+
+    def submit_running_request(self):
+        running_request = models.PythonManagementFindVirtualEnvsRequest.objects.create(
+            python_management=self.python_management)
+        SchedulingService.submit(executors.PythonManagementRequestExecutor, running_request)
+        return running_request
+
+    def test_request_is_scheduled_with_its_queue_position(self, dispatch):
+        response = self.find_virtual_environments()
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['queue_position'], 0)
+        request = models.PythonManagementFindVirtualEnvsRequest.objects.get(uuid=response.data['uuid'])
+        self.assertEqual(request.python_management, self.python_management)
+
+    def test_conflicting_request_waits_in_queue_instead_of_being_refused(self, dispatch):
+        self.submit_running_request()
+
+        response = self.find_installed_libraries()
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['queue_position'], 1)
+
+    def test_queue_position_is_reported_by_request_details(self, dispatch):
+        self.submit_running_request()
+        queued_request_uuid = self.find_installed_libraries().data['uuid']
+
+        response = self.client.get(
+            self.get_url('find-request-with-output-by-uuid', request_uuid=queued_request_uuid))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['queue_position'], 1)
+
+    @override_settings(WALDUR_ANSIBLE={'PYTHON_MANAGEMENT_REQUEST_QUEUE_ENABLED': False})
+    def test_conflicting_request_is_refused_if_queue_is_disabled(self, dispatch):
+        cache_utils.acquire_lock(PythonManagementBackendLockBuilder.build_global_lock(self.python_management), 60)
+
+        response = self.find_installed_libraries()
+
+        self.assertEqual(response.status_code, status.HTTP_423_LOCKED)
+
+    @override_settings(WALDUR_ANSIBLE={'PYTHON_MANAGEMENT_REQUEST_QUEUE_ENABLED': False})
+    def test_requests_are_not_serialized_if_queue_is_disabled(self, dispatch):
+        running_request = self.submit_running_request()
+
+        execution = models.QueuedExecution.objects.get(object_id=running_request.pk)
+        self.assertEqual(execution.serialization_group, '')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   WALDUR_ANSIBLE={'PYTHON_MANAGEMENT_DISCOVERY_RESULT_TTL': 60})
+@mock.patch('waldur_ansible.scheduling_service.SchedulingService.dispatch')
+class DiscoveryResultReuseTest(APITransactionTestCase):
+    def setUp(self):
+        self.python_management = factories.PythonManagementFactory()
+        self.client.force_authenticate(structure_factories.UserFactory(is_staff=True))
+        self.completed_request = models.PythonManagementFindVirtualEnvsRequest.objects.create(
+            python_management=self.python_management, state=models.PythonManagementFindVirtualEnvsRequest.States.OK)
+
+    def find_virtual_environments(self, query=''):
+        url = reverse('python_management-find-virtual-environments', kwargs={'uuid': self.python_management.uuid.hex})
+        return self.client.get('http://testserver' + url + query)
+
+    def assert_new_request_is_scheduled(self, response):
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertNotEqual(response.data['uuid'], self.completed_request.uuid.hex)
+        self.assertEqual(models.PythonManagementFindVirtualEnvsRequest.objects.count(), 2)
+
+    def test_recently_completed_request_is_reused(self, dispatch):
+        response = self.find_virtual_environments()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['uuid'], self.completed_request.uuid.hex)
+        self.assertIsNone(response.data['queue_position'])
+        self.assertEqual(models.PythonManagementFindVirtualEnvsRequest.objects.count(), 1)
+
+    def test_request_completed_before_ttl_window_is_not_reused(self, dispatch):
+        models.PythonManagementFindVirtualEnvsRequest.objects.filter(pk=self.completed_request.pk).update(
+            modified=timezone.now() - datetime.timedelta(seconds=61))
+
+        self.assert_new_request_is_scheduled(self.find_virtual_environments())
+
+    def test_request_is_not_reused_if_modifying_request_has_been_submitted_since(self, dispatch):
+        models.PythonManagementSynchronizeRequest.objects.create(
+            python_management=self.python_management, virtual_env_name='venv')
+
+        self.assert_new_request_is_scheduled(self.find_virtual_environments())
+
+    def test_request_is_not_reused_if_refresh_is_forced(self, dispatch):
+        self.assert_new_request_is_scheduled(self.find_virtual_environments('?refresh=true'))
+
+    @override_settings(WALDUR_ANSIBLE={'PYTHON_MANAGEMENT_DISCOVERY_RESULT_TTL': 0})
+    def test_request_is_not_reused_if_ttl_is_zero(self, dispatch):
+        self.assert_new_request_is_scheduled(self.find_virtual_environments())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   WALDUR_ANSIBLE={'LOCK_BACKEND': 'waldur_ansible.backend_processing.lock_backends.CacheLockBackend'})
+class LocksTest(APITransactionTestCase):
+    def setUp(self):
+        self.python_management = factories.PythonManagementFactory()
+        self.client.force_authenticate(structure_factories.UserFactory(is_staff=True))
+        self.url = 'http://testserver' + reverse('ansible_locks-list')
+
+    def test_python_management_filter_is_required_by_cache_lock_backend(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_locks_of_python_management_are_reported(self):
+        global_lock = PythonManagementBackendLockBuilder.build_global_lock(self.python_management)
+        cache_utils.acquire_lock(global_lock, 60, owner='request-uuid')
+
+        response = self.client.get(self.url, {'python_management_uuid': self.python_management.uuid.hex})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([lock['key'] for lock in response.data['locks']], [global_lock])
+
+    @override_settings(WALDUR_ANSIBLE={
+        'LOCK_BACKEND': 'waldur_ansible.backend_processing.lock_backends.DatabaseLockBackend'})
+    def test_held_locks_are_listed_by_database_lock_backend_without_filter(self):
+        global_lock = PythonManagementBackendLockBuilder.build_global_lock(self.python_management)
+        cache_utils.acquire_lock(global_lock, 60, owner='request-uuid')
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([lock['owner'] for lock in response.data['locks']], ['request-uuid'])
@@ -0,0 +1,98 @@
+import threading
+import time
+import unittest
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from waldur_ansible.backend_processing import cache_utils
+from waldur_ansible.backend_processing.lock_backends import get_lock_backend
+
+
+class LockContentionTestMixin(object):
+    """
+    Behaviour which every lock backend should provide.
+    """
+    lock = 'waldur_test_lock'
+
+    def test_lock_can_be_acquired_only_once(self):
+        self.assertTrue(cache_utils.acquire_lock(self.lock, 60))
+        self.assertIsNone(cache_utils.acquire_lock(self.lock, 60))
+
+    def test_lock_is_released_only_by_its_owner(self):
+        token = cache_utils.acquire_lock(self.lock, 60)
+
+        cache_utils.release_lock(self.lock, 'another-token')
+        self.assertTrue(cache_utils.is_syncing(self.lock))
+
+        cache_utils.release_lock(self.lock, token)
+        self.assertFalse(cache_utils.is_syncing(self.lock))
+
+    def test_lock_is_extended_only_by_its_owner(self):
+        token = cache_utils.acquire_lock(self.lock, 60)
+
+        self.assertFalse(cache_utils.extend_lock(self.lock, 'another-token', 60))
+        self.assertTrue(cache_utils.extend_lock(self.lock, token, 60))
+
+    def test_expired_lock_can_be_acquired_again(self):
+        cache_utils.acquire_lock(self.lock, 1)
+        time.sleep(1.1)
+
+        self.assertFalse(cache_utils.is_syncing(self.lock))
+        self.assertTrue(cache_utils.acquire_lock(self.lock, 60))
+
+    def test_held_locks_are_read_at_once(self):
+        cache_utils.acquire_lock(self.lock, 60)
+        self.assertEqual(cache_utils.get_held_locks([self.lock, 'waldur_free_lock']), {self.lock})
+
+    def test_owner_of_lock_is_reported(self):
+        cache_utils.acquire_lock(self.lock, 60, owner='owner-uuid')
+
+        lock = get_lock_backend().get_locks([self.lock, 'waldur_free_lock'])
+        self.assertEqual(list(lock), [self.lock])
+        self.assertEqual(lock[self.lock]['owner'], 'owner-uuid')
+        self.assertLess(lock[self.lock]['acquired'], lock[self.lock]['expires'])
+
+    def test_heartbeat_keeps_lock_while_operation_is_running(self):
+        token = cache_utils.acquire_lock(self.lock, 1)
+        heartbeat = cache_utils.LockHeartbeat([(self.lock, token)], timeout=1, interval=0.2)
+        heartbeat.start()
+        try:
+            time.sleep(1.5)
+            self.assertTrue(cache_utils.is_syncing(self.lock))
+            self.assertFalse(cache_utils.acquire_lock(self.lock, 60))
+        finally:
+            heartbeat.stop()
+
+    def test_only_one_of_concurrent_processes_acquires_lock(self):
+        tokens = []
+
+        def acquire():
+            try:
+                tokens.append(cache_utils.acquire_lock(self.lock, 60))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=acquire) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len([token for token in tokens if token]), 1)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    WALDUR_ANSIBLE={'LOCK_BACKEND': 'waldur_ansible.backend_processing.lock_backends.CacheLockBackend'})
+class CacheLockBackendTest(LockContentionTestMixin, TestCase):
+    pass
+
+
+@override_settings(WALDUR_ANSIBLE={'LOCK_BACKEND': 'waldur_ansible.backend_processing.lock_backends.DatabaseLockBackend'})
+class DatabaseLockBackendTest(LockContentionTestMixin, TransactionTestCase):
+
+    def test_only_one_of_concurrent_processes_acquires_lock(self):
+        if connection.vendor == 'sqlite':
+            raise unittest.SkipTest('SQLite does not support concurrent writes.')
+        super(DatabaseLockBackendTest, self).test_only_one_of_concurrent_processes_acquires_lock()
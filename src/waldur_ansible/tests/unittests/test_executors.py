@@ -0,0 +1,29 @@
+from django.test import TestCase, override_settings
+from mock import patch
+
+from waldur_ansible import executors, models
+
+
+class PythonManagementRequestRoutingTest(TestCase):
+    routing = {
+        'PYTHON_MANAGEMENT_DISCOVERY_TASK_ROUTING': {'queue': 'ansible_discovery', 'priority': 9},
+        'PYTHON_MANAGEMENT_MODIFICATION_TASK_ROUTING': {'queue': 'ansible_bulk', 'priority': None},
+    }
+
+    @override_settings(WALDUR_ANSIBLE=routing)
+    def test_read_only_requests_are_routed_to_discovery_queue(self):
+        request = models.PythonManagementFindInstalledLibrariesRequest()
+        self.assertEqual(executors.PythonManagementRequestExecutor.get_routing_options(request),
+                         {'queue': 'ansible_discovery', 'priority': 9})
+
+    @override_settings(WALDUR_ANSIBLE=routing)
+    def test_modifying_requests_are_routed_to_bulk_queue(self):
+        request = models.PythonManagementSynchronizeRequest()
+        self.assertEqual(executors.PythonManagementRequestExecutor.get_routing_options(request),
+                         {'queue': 'ansible_bulk'})
+
+    @override_settings(WALDUR_ANSIBLE={})
+    def test_default_queue_is_used_if_routing_is_not_configured(self):
+        with patch('waldur_core.core.executors.CreateExecutor.apply_signature') as apply_signature:
+            executors.RunJobExecutor.apply_signature(models.Job(), async=True)
+        apply_signature.assert_called_once()
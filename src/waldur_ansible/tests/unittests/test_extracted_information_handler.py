@@ -0,0 +1,56 @@
+from django.test import TestCase
+
+from waldur_ansible.backend_processing.extracted_information_handler import \
+    InstalledLibrariesExtractedInformationHandler
+from waldur_ansible.backend_processing.output_lines_post_processors import parse_installed_libraries
+
+from .. import factories
+
+
+class InstalledLibrariesExtractedInformationHandlerTest(TestCase):
+    def setUp(self):
+        self.virtual_environment = factories.VirtualEnvironmentFactory(name='venv')
+        self.python_management = self.virtual_environment.python_management
+        self.handler = InstalledLibrariesExtractedInformationHandler()
+
+    def persist(self, pip_freeze_lines):
+        self.handler.persist_installed_libraries_in_db(
+            self.python_management, 'venv', parse_installed_libraries(pip_freeze_lines))
+
+    def get_installed_libraries(self):
+        return sorted(self.python_management.virtual_environments.get(name='venv')
+                      .installed_libraries.values_list('name', 'version'))
+
+    def test_new_libraries_are_inserted(self):
+        self.persist(['numpy==1.14.0', 'six==1.11.0'])
+
+        self.assertEqual(self.get_installed_libraries(), [('numpy', '1.14.0'), ('six', '1.11.0')])
+
+    def test_versions_of_persisted_libraries_are_updated_in_place(self):
+        numpy = factories.InstalledLibraryFactory(virtual_environment=self.virtual_environment, name='numpy', version='1.13.0')
+        six = factories.InstalledLibraryFactory(virtual_environment=self.virtual_environment, name='six', version='1.10.0')
+
+        self.persist(['numpy==1.14.0', 'six==1.11.0', 'requests==2.18.0'])
+
+        self.assertEqual(self.get_installed_libraries(),
+                         [('numpy', '1.14.0'), ('requests', '2.18.0'), ('six', '1.11.0')])
+        self.assertEqual(self.virtual_environment.installed_libraries.get(name='numpy').pk, numpy.pk)
+        self.assertEqual(self.virtual_environment.installed_libraries.get(name='six').pk, six.pk)
+
+    def test_libraries_which_are_not_installed_anymore_are_deleted(self):
+        factories.InstalledLibraryFactory(virtual_environment=self.virtual_environment, name='numpy', version='1.14.0')
+        factories.InstalledLibraryFactory(virtual_environment=self.virtual_environment, name='six', version='1.11.0')
+
+        self.persist(['six==1.11.0'])
+
+        self.assertEqual(self.get_installed_libraries(), [('six', '1.11.0')])
+
+    def test_pkg_resources_is_not_persisted(self):
+        self.persist(['numpy==1.14.0', 'pkg-resources==0.0.0'])
+
+        self.assertEqual(self.get_installed_libraries(), [('numpy', '1.14.0')])
+
+    def test_virtual_environment_without_libraries_is_deleted(self):
+        self.persist([])
+
+        self.assertFalse(self.python_management.virtual_environments.filter(name='venv').exists())
@@ -0,0 +1,64 @@
+from django.test import TestCase
+
+from waldur_ansible import models
+from waldur_ansible.backend_processing.job_events_recorder import JobEventsRecorder
+from waldur_ansible.backend_processing.process_runner import LineSplitter
+
+from .. import factories
+
+
+class JobEventsRecorderTest(TestCase):
+    def setUp(self):
+        self.job = factories.JobFactory()
+
+    def _get_event(self, **kwargs):
+        event = {
+            'event': 'task_end',
+            'task': 'Create instance',
+            'host': 'localhost',
+            'status': 'changed',
+            'started': 1500000000.0,
+            'finished': 1500000002.5,
+            'duration': 2.5,
+            'payload': {'changed': True},
+        }
+        event.update(kwargs)
+        return event
+
+    def test_events_are_inserted_in_batches(self):
+        recorder = JobEventsRecorder(self.job, batch_size=2, flush_interval=60)
+        recorder.record(self._get_event())
+        self.assertEqual(self.job.events.count(), 0)
+
+        recorder.record(self._get_event())
+        self.assertEqual(self.job.events.count(), 2)
+
+        recorder.record(self._get_event())
+        recorder.close()
+        self.assertEqual(list(self.job.events.values_list('index', flat=True)), [0, 1, 2])
+
+    def test_check_mode_results_are_decoded_from_events(self):
+        recorder = JobEventsRecorder(self.job, batch_size=10, flush_interval=60)
+        recorder.record(self._get_event(payload={'instance': {'name': 'vm', 'WALDUR_CHECK_MODE': True}}))
+        recorder.record(self._get_event(payload={'changed': False}))
+        recorder.close()
+
+        items = self.job.get_backend().decode_events(self.job)
+        self.assertEqual(items, [{'name': 'vm'}])
+
+    def test_failed_events_are_selected(self):
+        recorder = JobEventsRecorder(self.job, batch_size=10, flush_interval=60)
+        recorder.record(self._get_event())
+        recorder.record(self._get_event(status=models.JobEvent.Statuses.FAILED, task='Install packages'))
+        recorder.close()
+
+        failed_tasks = self.job.get_backend().get_failed_events(self.job).values_list('task', flat=True)
+        self.assertEqual(list(failed_tasks), ['Install packages'])
+
+
+class LineSplitterTest(TestCase):
+    def test_incomplete_line_is_kept_until_it_is_completed(self):
+        splitter = LineSplitter()
+        self.assertEqual(splitter.feed('first\nsec'), ['first\n'])
+        self.assertEqual(splitter.feed('ond\nthi'), ['second\n'])
+        self.assertEqual(splitter.finish(), ['thi'])
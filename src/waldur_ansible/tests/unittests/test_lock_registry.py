@@ -0,0 +1,101 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from mock import patch
+
+from waldur_ansible.backend_processing import cache_utils
+from waldur_ansible.backend_processing.lock_registry import LockRegistry, get_lock_class
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    WALDUR_ANSIBLE={'LOCK_BACKEND': 'waldur_ansible.backend_processing.lock_backends.CacheLockBackend'})
+class LockRegistryTest(TestCase):
+    lock = 'waldur_python_management_global_1'
+    lock_class = 'waldur_python_management_global'
+
+    def setUp(self):
+        cache.clear()
+
+    def test_lock_class_is_prefix_of_key(self):
+        self.assertEqual(get_lock_class('waldur_python_management_global_12'), 'waldur_python_management_global')
+        self.assertEqual(get_lock_class('waldur_python_management_12_venv1'), 'waldur_python_management')
+        self.assertEqual(get_lock_class('waldur_syncing_pip_packages'), 'waldur_syncing_pip_packages')
+
+    def test_acquisitions_and_refusals_are_counted_per_lock_class(self):
+        cache_utils.acquire_lock(self.lock, 60)
+        cache_utils.acquire_lock(self.lock, 60)
+        cache_utils.acquire_lock(self.lock, 60)
+
+        metrics = LockRegistry.get_metrics([self.lock_class])[self.lock_class]
+        self.assertEqual(metrics['acquired'], 1)
+        self.assertEqual(metrics['refused'], 2)
+
+    def test_wait_time_is_accumulated(self):
+        LockRegistry.record_wait(self.lock, 1.5)
+        LockRegistry.record_wait(self.lock, 0.5)
+
+        metrics = LockRegistry.get_metrics([self.lock_class])[self.lock_class]
+        self.assertEqual(metrics['waits'], 2)
+        self.assertEqual(metrics['wait_milliseconds'], 2000)
+
+    def test_held_and_recently_refused_locks_are_reported(self):
+        released_lock = 'waldur_python_management_global_2'
+        token = cache_utils.acquire_lock(released_lock, 60)
+        cache_utils.acquire_lock(released_lock, 60)
+        cache_utils.release_lock(released_lock, token)
+        cache_utils.acquire_lock(self.lock, 60, owner='request-uuid')
+
+        locks = LockRegistry.get_locks([released_lock, self.lock, 'waldur_python_management_global_3'])
+
+        self.assertEqual([lock['key'] for lock in locks], [self.lock, released_lock])
+        self.assertEqual(locks[0]['owner'], 'request-uuid')
+        self.assertTrue(locks[0]['held'])
+        self.assertFalse(locks[1]['held'])
+        self.assertEqual(locks[1]['recent_refusals'], 1)
+
+    def test_metrics_are_formatted_for_prometheus(self):
+        cache_utils.acquire_lock(self.lock, 60)
+        metrics = LockRegistry.get_metrics([self.lock_class])
+
+        text = LockRegistry.format_metrics(metrics, LockRegistry.get_locks([self.lock]))
+
+        self.assertIn('waldur_ansible_lock_acquisitions_total{lock_class="%s",result="acquired"} 1' % self.lock_class,
+                      text)
+        self.assertIn('waldur_ansible_locks_held{lock_class="%s"} 1' % self.lock_class, text)
+
+    def test_held_locks_are_not_formatted_if_they_are_not_listed(self):
+        text = LockRegistry.format_metrics(LockRegistry.get_metrics([self.lock_class]))
+
+        self.assertIn('waldur_ansible_request_wait_seconds_count{lock_class="%s"} 0' % self.lock_class, text)
+        self.assertNotIn('waldur_ansible_locks_held', text)
+
+    def test_existing_counter_is_incremented_with_single_cache_request(self):
+        cache_utils.acquire_lock(self.lock, 60)
+
+        with patch('waldur_ansible.backend_processing.lock_registry.cache.add') as add:
+            cache_utils.acquire_lock('waldur_python_management_global_2', 60)
+
+        self.assertFalse(add.called)
+        self.assertEqual(LockRegistry.get_metrics([self.lock_class])[self.lock_class]['acquired'], 2)
+
+    def test_cache_lock_backend_can_not_list_locks(self):
+        self.assertFalse(LockRegistry.can_list_locks())
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    WALDUR_ANSIBLE={'LOCK_BACKEND': 'waldur_ansible.backend_processing.lock_backends.DatabaseLockBackend'})
+class DatabaseLockRegistryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_held_locks_are_listed_from_lock_table(self):
+        cache_utils.acquire_lock('waldur_python_management_global_1', 60, owner='request-uuid')
+        token = cache_utils.acquire_lock('waldur_python_management_global_2', 60)
+        cache_utils.release_lock('waldur_python_management_global_2', token)
+
+        self.assertTrue(LockRegistry.can_list_locks())
+        locks = LockRegistry.list_locks()
+
+        self.assertEqual([lock['key'] for lock in locks], ['waldur_python_management_global_1'])
+        self.assertEqual(locks[0]['owner'], 'request-uuid')
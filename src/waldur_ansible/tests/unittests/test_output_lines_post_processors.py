@@ -0,0 +1,105 @@
+from django.test import TestCase
+
+from waldur_ansible.backend_processing.output_lines_post_processors import \
+    BatchInitializationOutputLinesPostProcessor, InstalledLibrariesOutputLinesPostProcessor, \
+    CombinedDiscoveryOutputLinesPostProcessor, InstalledVirtualEnvironmentsOutputLinesPostProcessor
+
+
+class InstalledLibrariesOutputLinesPostProcessorTest(TestCase):
+    def setUp(self):
+        self.post_processor = InstalledLibrariesOutputLinesPostProcessor()
+
+    def test_libraries_are_read_from_task_result(self):
+        self.post_processor.post_process_event({
+            'event': 'task_end',
+            'task': InstalledLibrariesOutputLinesPostProcessor.INSTALLED_LIBRARIES_AFTER_MODIFICATIONS_TASK,
+            'status': 'ok',
+            'payload': {'stdout_lines': ['numpy==1.14.0', 'pkg-resources==0.0.0']},
+        })
+
+        libraries = self.post_processor.installed_libraries_after_modifications
+        self.assertEqual([(l.name, l.version) for l in libraries], [('numpy', '1.14.0')])
+
+    def test_human_readable_output_is_ignored(self):
+        self.post_processor.post_process_line(
+            'TASK [%s] ***\n' % InstalledLibrariesOutputLinesPostProcessor.INSTALLED_LIBRARIES_AFTER_MODIFICATIONS_TASK)
+        self.post_processor.post_process_line('ok: [host] => {"stdout_lines": ["numpy==1.14.0"]}\n')
+        self.assertEqual(self.post_processor.installed_libraries_after_modifications, [])
+
+    def test_skipped_task_result_is_ignored(self):
+        self.post_processor.post_process_event({
+            'event': 'task_end',
+            'task': InstalledLibrariesOutputLinesPostProcessor.INSTALLED_LIBRARIES_AFTER_MODIFICATIONS_TASK,
+            'status': 'skipped',
+            'payload': {'skipped': True},
+        })
+        self.assertEqual(self.post_processor.installed_libraries_after_modifications, [])
+        self.assertEqual(self.post_processor.get_missing_task_results(),
+                         [InstalledLibrariesOutputLinesPostProcessor.INSTALLED_LIBRARIES_AFTER_MODIFICATIONS_TASK])
+
+    def test_received_task_result_is_not_missing(self):
+        self.post_processor.post_process_event({
+            'event': 'task_end',
+            'task': InstalledLibrariesOutputLinesPostProcessor.INSTALLED_LIBRARIES_AFTER_MODIFICATIONS_TASK,
+            'payload': {'stdout_lines': []},
+        })
+        self.assertEqual(self.post_processor.get_missing_task_results(), [])
+
+
+class InstalledVirtualEnvironmentsOutputLinesPostProcessorTest(TestCase):
+    def test_missing_list_of_virtual_environments_is_reported(self):
+        post_processor = InstalledVirtualEnvironmentsOutputLinesPostProcessor()
+        self.assertEqual(post_processor.get_missing_task_results(),
+                         [InstalledVirtualEnvironmentsOutputLinesPostProcessor.INSTALLED_VIRTUAL_ENVIRONMENTS_TASK])
+
+
+class BatchInitializationOutputLinesPostProcessorTest(TestCase):
+    def setUp(self):
+        self.post_processor = BatchInitializationOutputLinesPostProcessor()
+
+    def test_results_are_demultiplexed_by_virtual_environment(self):
+        self.post_processor.post_process_event({
+            'event': 'task_end',
+            'task': InstalledLibrariesOutputLinesPostProcessor.INSTALLED_LIBRARIES_AFTER_MODIFICATIONS_TASK,
+            'payload': {'results': [
+                {'item': {'name': 'first'}, 'rc': 0, 'stdout_lines': ['numpy==1.14.0', 'pkg-resources==0.0.0']},
+                {'item': {'name': 'second'}, 'failed': True, 'msg': 'No matching distribution found'},
+            ]},
+        })
+
+        libraries = self.post_processor.installed_libraries_by_virtual_environment
+        self.assertEqual([(l.name, l.version) for l in libraries['first']], [('numpy', '1.14.0')])
+        self.assertNotIn('second', libraries)
+        self.assertEqual(self.post_processor.failed_virtual_environments,
+                         {'second': 'No matching distribution found'})
+
+    def test_events_of_other_tasks_are_ignored(self):
+        self.post_processor.post_process_event({
+            'event': 'task_end',
+            'task': 'Create virtual environments',
+            'payload': {'results': [{'item': {'name': 'first'}, 'stdout_lines': []}]},
+        })
+        self.assertEqual(self.post_processor.installed_libraries_by_virtual_environment, {})
+
+
+class CombinedDiscoveryOutputLinesPostProcessorTest(TestCase):
+    def test_virtual_environments_and_their_libraries_are_collected(self):
+        post_processor = CombinedDiscoveryOutputLinesPostProcessor()
+        post_processor.post_process_event({
+            'event': 'task_end',
+            'task': InstalledVirtualEnvironmentsOutputLinesPostProcessor.INSTALLED_VIRTUAL_ENVIRONMENTS_TASK,
+            'payload': {'stdout_lines': ['first', 'second']},
+        })
+        post_processor.post_process_event({
+            'event': 'task_end',
+            'task': InstalledLibrariesOutputLinesPostProcessor.INSTALLED_LIBRARIES_AFTER_MODIFICATIONS_TASK,
+            'payload': {'results': [
+                {'item': 'first', 'rc': 0, 'stdout_lines': ['scipy==1.0.0']},
+                {'item': 'second', 'rc': 0, 'stdout_lines': []},
+            ]},
+        })
+
+        self.assertEqual(post_processor.installed_virtual_environments, ['first', 'second'])
+        libraries = post_processor.installed_libraries_by_virtual_environment
+        self.assertEqual([(l.name, l.version) for l in libraries['first']], [('scipy', '1.0.0')])
+        self.assertEqual(libraries['second'], [])
@@ -0,0 +1,43 @@
+from django.test import TestCase
+from mock import patch
+
+from waldur_ansible.backend_processing.output_sinks import BufferedOutputSink
+
+
+class CollectingOutputSink(BufferedOutputSink):
+    def __init__(self, **kwargs):
+        super(CollectingOutputSink, self).__init__(**kwargs)
+        self.persisted = []
+
+    def persist(self, data):
+        self.persisted.append(data)
+
+
+class BufferedOutputSinkTest(TestCase):
+    def test_output_is_not_persisted_until_size_limit_is_reached(self):
+        sink = CollectingOutputSink(flush_size=10, flush_interval=60)
+        sink.write('12345')
+        self.assertEqual(sink.persisted, [])
+
+        sink.write('67890')
+        self.assertEqual(sink.persisted, ['1234567890'])
+
+    @patch('waldur_ansible.backend_processing.output_sinks.time')
+    def test_output_is_persisted_when_flush_interval_has_passed(self, mocked_time):
+        mocked_time.time.return_value = 100
+        sink = CollectingOutputSink(flush_size=1024, flush_interval=5)
+        sink.write('line 1\n')
+        self.assertEqual(sink.persisted, [])
+
+        mocked_time.time.return_value = 106
+        sink.write('line 2\n')
+        self.assertEqual(sink.persisted, ['line 1\nline 2\n'])
+
+    def test_remaining_output_is_persisted_on_close(self):
+        sink = CollectingOutputSink(flush_size=1024, flush_interval=60)
+        sink.write('tail')
+        sink.close()
+        self.assertEqual(sink.persisted, ['tail'])
+
+        sink.close()
+        self.assertEqual(sink.persisted, ['tail'])
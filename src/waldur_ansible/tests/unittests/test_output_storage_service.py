@@ -0,0 +1,47 @@
+from django.test import TestCase
+
+from waldur_ansible import models
+from waldur_ansible.output_storage_service import OutputStorageService
+
+from .. import factories
+
+
+class OutputStorageServiceTest(TestCase):
+    def setUp(self):
+        self.job = factories.JobFactory()
+
+    def test_output_is_appended_as_separate_chunks(self):
+        OutputStorageService.append(self.job, 'first line\n')
+        OutputStorageService.append(self.job, 'second line\n')
+
+        self.assertEqual(self.job.output, 'first line\nsecond line\n')
+        self.assertEqual(OutputStorageService.get_chunks(self.job).count(), 2)
+
+    def test_output_length_and_line_count_are_kept_on_parent_row(self):
+        OutputStorageService.append(self.job, 'first line\n')
+        OutputStorageService.append(self.job, 'second line\n')
+
+        job = models.Job.objects.get(pk=self.job.pk)
+        self.assertEqual(job.output_length, len('first line\nsecond line\n'))
+        self.assertEqual(job.output_lines, 2)
+
+    def test_output_can_be_read_from_offset_across_chunks(self):
+        OutputStorageService.append(self.job, 'abcdef')
+        OutputStorageService.append(self.job, 'ghijkl')
+
+        self.assertEqual(OutputStorageService.read(self.job, offset=4, limit=4), b'efgh')
+        self.assertEqual(OutputStorageService.read(self.job, offset=9), b'jkl')
+        self.assertEqual(OutputStorageService.read(self.job, offset=12), b'')
+
+    def test_output_is_cleared(self):
+        OutputStorageService.append(self.job, 'output')
+        OutputStorageService.clear(self.job)
+
+        self.assertEqual(self.job.output, '')
+        self.assertEqual(models.Job.objects.get(pk=self.job.pk).output_length, 0)
+
+    def test_chunks_are_deleted_with_job(self):
+        OutputStorageService.append(self.job, 'output')
+        self.job.delete()
+
+        self.assertFalse(models.OutputChunk.objects.exists())
@@ -0,0 +1,83 @@
+import os
+import shutil
+import subprocess  # nosec
+import tempfile
+import time
+
+from django.test import TestCase
+
+from waldur_ansible.backend_processing.exceptions import ProcessTimeoutError
+from waldur_ansible.backend_processing.process_runner import iterate_process_output, \
+    get_events_callback_environment
+
+
+class IterateProcessOutputTest(TestCase):
+    def run_command(self, script, **kwargs):
+        lines = []
+        try:
+            for line in iterate_process_output(['sh', '-c', script], dict(os.environ), **kwargs):
+                lines.append(line)
+        finally:
+            self.lines = lines
+        return lines
+
+    def test_output_is_yielded_line_by_line(self):
+        self.assertEqual(self.run_command('echo first; echo second', timeout=10), ['first\n', 'second\n'])
+
+    def test_error_is_raised_if_command_fails(self):
+        self.assertRaises(subprocess.CalledProcessError, self.run_command, 'echo fail; exit 2')
+
+    def test_command_is_terminated_if_it_is_idle_for_too_long(self):
+        with self.assertRaisesRegexp(ProcessTimeoutError, 'any output'):
+            self.run_command('echo started; sleep 30', idle_timeout=1)
+        self.assertEqual(self.lines, ['started\n'])
+
+    def test_command_is_terminated_if_it_runs_for_too_long(self):
+        with self.assertRaisesRegexp(ProcessTimeoutError, 'not finished'):
+            self.run_command('while true; do echo tick; sleep 0.2; done', timeout=1, idle_timeout=5)
+
+    def test_command_which_writes_output_continuously_is_terminated_if_it_runs_for_too_long(self):
+        started = time.time()
+        with self.assertRaisesRegexp(ProcessTimeoutError, 'not finished'):
+            self.run_command('yes', timeout=1)
+        self.assertLess(time.time() - started, 5)
+
+    def test_descriptors_of_worker_are_not_inherited_with_events_pipe(self):
+        worker_fd = os.open(os.devnull, os.O_RDONLY)
+        self.addCleanup(os.close, worker_fd)
+        events = []
+
+        lines = self.run_command('ls /proc/$$/fd; echo \'{"event": "task_end"}\' >&$WALDUR_ANSIBLE_EVENTS_FD',
+                                 events_handler=events.append)
+
+        self.assertNotIn('%s\n' % worker_fd, lines)
+        self.assertEqual(events, [{'event': 'task_end'}])
+
+
+class EventsCallbackEnvironmentTest(TestCase):
+    def setUp(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.config_dir)
+        self.config_path = os.path.join(self.config_dir, 'ansible.cfg')
+
+    def test_callbacks_configured_in_environment_are_kept(self):
+        env = get_events_callback_environment({
+            'ANSIBLE_CALLBACK_PLUGINS': '/opt/callbacks', 'ANSIBLE_CALLBACK_WHITELIST': 'profile_tasks'})
+
+        self.assertTrue(env['ANSIBLE_CALLBACK_PLUGINS'].startswith('/opt/callbacks' + os.pathsep))
+        self.assertEqual(env['ANSIBLE_CALLBACK_WHITELIST'], 'profile_tasks,waldur_events')
+        self.assertEqual(env['ANSIBLE_CALLBACKS_ENABLED'], 'profile_tasks,waldur_events')
+
+    def test_callbacks_configured_in_ansible_cfg_are_kept(self):
+        with open(self.config_path, 'w') as config_file:
+            config_file.write('[defaults]\ncallback_plugins = /opt/callbacks\ncallbacks_enabled = timer, profile_tasks\n')
+
+        env = get_events_callback_environment({'ANSIBLE_CONFIG': self.config_path})
+
+        self.assertTrue(env['ANSIBLE_CALLBACK_PLUGINS'].startswith('/opt/callbacks' + os.pathsep))
+        self.assertEqual(env['ANSIBLE_CALLBACKS_ENABLED'], 'timer,profile_tasks,waldur_events')
+
+    def test_environment_is_not_changed_if_plugin_is_already_enabled(self):
+        env = get_events_callback_environment({'ANSIBLE_CONFIG': self.config_path})
+
+        self.assertEqual(get_events_callback_environment(env), env)
@@ -0,0 +1,95 @@
+from django.test import TestCase, override_settings
+from mock import patch
+
+from waldur_ansible import models
+from waldur_ansible.backend_processing.exceptions import AnsibleBackendError
+from waldur_ansible.backend_processing.python_management_backend import PythonManagementBackendHelper
+
+from .. import factories
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    WALDUR_ANSIBLE={'ANSIBLE_LIBRARY': '/ansible/library', 'OUTPUT_FLUSH_SIZE': 1024 * 1024})
+@patch('waldur_ansible.backend_processing.python_management_backend.SshMultiplexingService')
+@patch('waldur_ansible.backend_processing.python_management_backend.PythonManagementBackendHelper.build_command',
+       return_value=['ansible-playbook', 'playbook.yml'])
+class ProcessRequestTest(TestCase):
+    def setUp(self):
+        self.python_management = factories.PythonManagementFactory()
+
+    def process(self, request, output_lines):
+        with patch('waldur_ansible.backend_processing.python_management_backend.PythonManagementBackendHelper'
+                   '.process_output_iterator', return_value=iter(output_lines)):
+            PythonManagementBackendHelper.process_request(request)
+
+    def test_output_is_persisted_before_python_management_is_deleted(self, build_command, ssh_multiplexing_service):
+        ssh_multiplexing_service.get_environment.return_value = {}
+        request = models.PythonManagementDeleteRequest.objects.create(python_management=self.python_management)
+
+        self.process(request, ['PLAY [Delete environment]\n'])
+
+        self.assertFalse(models.PythonManagement.objects.filter(pk=self.python_management.pk).exists())
+        self.assertTrue(ssh_multiplexing_service.close_connections.called)
+
+    def test_output_is_persisted_when_request_succeeds(self, build_command, ssh_multiplexing_service):
+        ssh_multiplexing_service.get_environment.return_value = {}
+        request = models.PythonManagementDeleteVirtualEnvRequest.objects.create(
+            python_management=self.python_management, virtual_env_name='venv')
+
+        self.process(request, ['PLAY [Delete virtual environment]\n'])
+
+        request.refresh_from_db()
+        self.assertEqual(request.output, 'PLAY [Delete virtual environment]\n')
+
+    def test_synchronization_is_skipped_if_desired_state_is_reached_meanwhile(self, build_command,
+                                                                               ssh_multiplexing_service):
+        ssh_multiplexing_service.get_environment.return_value = {}
+        factories.VirtualEnvironmentFactory(python_management=self.python_management, name='venv')
+        request = models.PythonManagementSynchronizeRequest.objects.create(
+            python_management=self.python_management, virtual_env_name='venv', recompute_libraries=True,
+            desired_libraries=[], libraries_to_install=[{'name': 'six', 'version': '1.0'}])
+
+        self.process(request, [])
+
+        self.assertFalse(build_command.called)
+        request.refresh_from_db()
+        self.assertIn('already contains desired libraries', request.output)
+
+    def test_error_of_deferred_dispatch_does_not_replace_error_of_request(self, build_command,
+                                                                          ssh_multiplexing_service):
+        ssh_multiplexing_service.get_environment.return_value = {}
+        request = models.PythonManagementDeleteVirtualEnvRequest.objects.create(
+            python_management=self.python_management, virtual_env_name='venv')
+        build_command.side_effect = ValueError('Playbook error')
+
+        with patch('waldur_ansible.backend_processing.python_management_backend.PythonManagementService'
+                   '.dispatch_deferred_requests', side_effect=RuntimeError('Dispatch error')):
+            with self.assertRaisesRegexp(ValueError, 'Playbook error'):
+                self.process(request, [])
+
+    def test_virtual_environment_is_kept_if_installed_libraries_are_not_reported(self, build_command,
+                                                                                 ssh_multiplexing_service):
+        ssh_multiplexing_service.get_environment.return_value = {}
+        virtual_environment = factories.VirtualEnvironmentFactory(python_management=self.python_management, name='venv')
+        factories.InstalledLibraryFactory(virtual_environment=virtual_environment)
+        request = models.PythonManagementFindInstalledLibrariesRequest.objects.create(
+            python_management=self.python_management, virtual_env_name='venv')
+
+        with self.assertRaisesRegexp(AnsibleBackendError, 'have not been reported'):
+            self.process(request, ['PLAY [Find installed libraries]\n'])
+
+        self.assertEqual(virtual_environment.installed_libraries.count(), 1)
+        request.refresh_from_db()
+        self.assertIn('waldur_events callback plugin', request.output)
+
+
+class PlaybookArgumentsTest(TestCase):
+    @override_settings(WALDUR_ANSIBLE={'PLAYBOOK_ARGUMENTS': ['--verbose', '-vvv', '--forks', '10']})
+    def test_job_arguments_without_verbosity_flags_are_used_by_default(self):
+        self.assertEqual(PythonManagementBackendHelper.get_playbook_arguments(), ['--forks', '10'])
+
+    @override_settings(WALDUR_ANSIBLE={'PLAYBOOK_ARGUMENTS': ['--forks', '10'],
+                                       'PYTHON_MANAGEMENT_PLAYBOOK_ARGUMENTS': []})
+    def test_python_management_arguments_override_job_arguments(self):
+        self.assertEqual(PythonManagementBackendHelper.get_playbook_arguments(), [])
@@ -0,0 +1,140 @@
+from django.test import TestCase, override_settings
+from mock import Mock
+
+from waldur_ansible import models
+from waldur_ansible.backend_processing import cache_utils
+from waldur_ansible.backend_processing.locking_service import PythonManagementBackendLockBuilder
+from waldur_ansible.python_management_service import PythonManagementService
+
+from .. import factories
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DeferredSynchronizationTest(TestCase):
+    def setUp(self):
+        self.virtual_environment = factories.VirtualEnvironmentFactory(name='venv')
+        self.python_management = self.virtual_environment.python_management
+        factories.InstalledLibraryFactory(virtual_environment=self.virtual_environment, name='requests', version='1.0')
+        self.executor = Mock()
+
+    def defer(self, desired_libraries):
+        return PythonManagementService.defer_synchronization(self.python_management, 'venv', desired_libraries)
+
+    def dispatch(self):
+        PythonManagementService.dispatch_deferred_requests(self.executor, self.python_management)
+
+    def test_there_is_at_most_one_deferred_request_with_the_latest_desired_state(self):
+        self.defer([{'name': 'six', 'version': '1.0'}])
+        self.defer([{'name': 'six', 'version': '2.0'}])
+
+        deferred_requests = models.PythonManagementSynchronizeRequest.objects.filter(deferred=True)
+        self.assertEqual(deferred_requests.count(), 1)
+        self.assertEqual(deferred_requests.get().desired_libraries, [{'name': 'six', 'version': '2.0'}])
+
+    def test_deferred_request_is_dispatched_with_delta_if_virtual_environment_is_not_locked(self):
+        deferred_request = self.defer([{'name': 'six', 'version': '1.0'}])
+
+        self.dispatch()
+
+        deferred_request.refresh_from_db()
+        self.assertFalse(deferred_request.deferred)
+        self.assertEqual(deferred_request.libraries_to_install, [{'name': 'six', 'version': '1.0'}])
+        self.assertEqual(deferred_request.libraries_to_remove, [{'name': 'requests', 'version': '1.0'}])
+        self.executor.execute.assert_called_once_with(deferred_request, async=True)
+
+    def test_deferred_request_waits_while_virtual_environment_is_locked(self):
+        self.defer([{'name': 'six', 'version': '1.0'}])
+        cache_utils.acquire_lock(
+            PythonManagementBackendLockBuilder.build_related_to_virt_env_lock(self.python_management, 'venv'), 60)
+
+        self.dispatch()
+
+        self.assertTrue(models.PythonManagementSynchronizeRequest.objects.get().deferred)
+        self.assertFalse(self.executor.execute.called)
+
+    def test_deferred_request_is_dropped_if_desired_state_is_reached(self):
+        self.defer([{'name': 'requests', 'version': '1.0'}])
+
+        self.dispatch()
+
+        self.assertFalse(models.PythonManagementSynchronizeRequest.objects.exists())
+        self.assertFalse(self.executor.execute.called)
+
+    def test_delta_is_computed_again_against_current_state(self):
+        deferred_request = self.defer([{'name': 'six', 'version': '1.0'}])
+        self.dispatch()
+        factories.InstalledLibraryFactory(virtual_environment=self.virtual_environment, name='six', version='1.0')
+
+        self.assertTrue(PythonManagementService.refresh_libraries_delta(deferred_request))
+
+        deferred_request.refresh_from_db()
+        self.assertEqual(deferred_request.libraries_to_install, [])
+        self.assertEqual(deferred_request.libraries_to_remove, [{'name': 'requests', 'version': '1.0'}])
+
+    def test_delta_of_reached_desired_state_is_empty(self):
+        deferred_request = self.defer([{'name': 'requests', 'version': '1.0'}])
+        self.assertFalse(PythonManagementService.refresh_libraries_delta(deferred_request))
+
+
+class LibrariesDiffTest(TestCase):
+    def setUp(self):
+        self.virtual_environment = factories.VirtualEnvironmentFactory(name='venv')
+        self.python_management = self.virtual_environment.python_management
+        factories.InstalledLibraryFactory(virtual_environment=self.virtual_environment, name='requests', version='1.0')
+        factories.InstalledLibraryFactory(virtual_environment=self.virtual_environment, name='six', version='1.0')
+
+    def identify(self, transient_virtual_environments):
+        return PythonManagementService.identify_changed_created_removed_envs(
+            transient_virtual_environments, self.python_management.virtual_environments.all())
+
+    def test_version_change_is_reported_as_upgrade_and_not_as_removal(self):
+        _, virtual_environments_to_change, _ = self.identify([{'name': 'venv', 'installed_libraries': [
+            {'name': 'requests', 'version': '2.0'}, {'name': 'six', 'version': '1.0'}]}])
+
+        changed_virtual_environment = virtual_environments_to_change[0]
+        self.assertEqual(changed_virtual_environment['libraries_to_install'], [{'name': 'requests', 'version': '2.0'}])
+        self.assertEqual(changed_virtual_environment['libraries_to_remove'], [])
+        self.assertEqual(changed_virtual_environment['libraries_to_upgrade'],
+                         [{'name': 'requests', 'version': '2.0', 'previous_version': '1.0'}])
+
+    def test_libraries_missing_from_desired_state_are_removed(self):
+        _, virtual_environments_to_change, _ = self.identify([{'name': 'venv', 'installed_libraries': [
+            {'name': 'six', 'version': '1.0'}, {'name': 'pyyaml', 'version': '3.0'}]}])
+
+        changed_virtual_environment = virtual_environments_to_change[0]
+        self.assertEqual(changed_virtual_environment['libraries_to_install'], [{'name': 'pyyaml', 'version': '3.0'}])
+        self.assertEqual(changed_virtual_environment['libraries_to_remove'], [{'name': 'requests', 'version': '1.0'}])
+        self.assertEqual(changed_virtual_environment['libraries_to_upgrade'], [])
+
+    def test_virtual_environments_are_classified_as_created_changed_and_removed(self):
+        factories.VirtualEnvironmentFactory(python_management=self.python_management, name='obsolete')
+
+        virtual_environments_to_create, virtual_environments_to_change, removed_virtual_environments = self.identify([
+            {'name': 'venv', 'installed_libraries': [{'name': 'requests', 'version': '1.0'}, {'name': 'six', 'version': '1.0'}]},
+            {'name': 'fresh', 'installed_libraries': [{'name': 'six', 'version': '1.0'}]}])
+
+        self.assertEqual([venv['name'] for venv in virtual_environments_to_create], ['fresh'])
+        self.assertEqual(virtual_environments_to_change, [])
+        self.assertEqual([venv.name for venv in removed_virtual_environments], ['obsolete'])
+
+    def test_libraries_of_all_virtual_environments_are_fetched_at_once(self):
+        other_virtual_environment = factories.VirtualEnvironmentFactory(python_management=self.python_management, name='other')
+        factories.InstalledLibraryFactory(virtual_environment=other_virtual_environment, name='six', version='1.0')
+        transient_virtual_environments = [
+            {'name': 'venv', 'installed_libraries': [{'name': 'six', 'version': '2.0'}]},
+            {'name': 'other', 'installed_libraries': [{'name': 'six', 'version': '2.0'}]}]
+
+        # one query for virtual environments and one for libraries of all of them
+        with self.assertNumQueries(2):
+            self.identify(transient_virtual_environments)
+
+    def test_upgraded_libraries_are_stored_in_synchronization_request(self):
+        sync_request = models.PythonManagementSynchronizeRequest.objects.create(
+            python_management=self.python_management, virtual_env_name='venv',
+            desired_libraries=[{'name': 'requests', 'version': '2.0'}, {'name': 'six', 'version': '1.0'}])
+
+        self.assertTrue(PythonManagementService.refresh_libraries_delta(sync_request))
+
+        sync_request.refresh_from_db()
+        self.assertEqual(sync_request.libraries_to_upgrade,
+                         [{'name': 'requests', 'version': '2.0', 'previous_version': '1.0'}])
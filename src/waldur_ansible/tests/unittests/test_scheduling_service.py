@@ -0,0 +1,191 @@
+import datetime
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from mock import Mock, patch
+
+from waldur_ansible import executors, models
+from waldur_ansible.models import QueuedExecution
+from waldur_ansible.scheduling_service import ExecutionLimits, SchedulingService
+
+from .. import factories
+
+
+def make_execution(pk, project_id, service_project_link_id=None, state=QueuedExecution.States.QUEUED,
+                   serialization_group='', serialization_key=''):
+    service_project_link_id = service_project_link_id or project_id
+    return Mock(
+        pk=pk,
+        state=state,
+        created=datetime.datetime(2018, 1, 1) + datetime.timedelta(seconds=pk),
+        service_project_link_id=service_project_link_id,
+        service_project_link=Mock(project_id=project_id),
+        serialization_group=serialization_group,
+        serialization_key=serialization_key,
+    )
+
+
+def make_limits(total=None, per_project=None, per_service_project_link=None):
+    limits = Mock(spec=ExecutionLimits)
+    limits.total = total
+    limits.per_project = per_project
+    limits.per_service_project_link = per_service_project_link
+    return limits
+
+
+class SelectExecutionsToReleaseTest(TestCase):
+    def select(self, executions, **limits):
+        released = SchedulingService.select_executions_to_release(executions, make_limits(**limits))
+        return [execution.pk for execution in released]
+
+    def test_all_executions_are_released_if_there_are_no_limits(self):
+        executions = [make_execution(1, project_id=1), make_execution(2, project_id=2)]
+        self.assertEqual(self.select(executions), [1, 2])
+
+    def test_per_project_limit_takes_running_executions_into_account(self):
+        executions = [
+            make_execution(1, project_id=1, state=QueuedExecution.States.RUNNING),
+            make_execution(2, project_id=1),
+            make_execution(3, project_id=1),
+        ]
+        self.assertEqual(self.select(executions, per_project=2), [2])
+
+    def test_burst_of_one_project_does_not_starve_other_projects(self):
+        executions = [make_execution(pk, project_id=1) for pk in range(1, 6)]
+        executions.append(make_execution(6, project_id=2))
+        self.assertEqual(self.select(executions, total=3), [1, 6, 2])
+
+    def test_project_with_fewer_running_executions_goes_first(self):
+        executions = [
+            make_execution(1, project_id=1, state=QueuedExecution.States.RUNNING),
+            make_execution(2, project_id=1),
+            make_execution(3, project_id=2),
+        ]
+        self.assertEqual(self.select(executions, total=2), [3])
+
+    def test_execution_of_other_service_project_link_is_released_if_one_link_is_saturated(self):
+        executions = [
+            make_execution(1, project_id=1, service_project_link_id=1, state=QueuedExecution.States.RUNNING),
+            make_execution(2, project_id=1, service_project_link_id=1),
+            make_execution(3, project_id=1, service_project_link_id=2),
+        ]
+        self.assertEqual(self.select(executions, per_service_project_link=1), [3])
+
+    def test_requests_of_the_same_virtual_environment_are_executed_one_by_one(self):
+        executions = [
+            make_execution(1, project_id=1, serialization_group='pm', serialization_key='first'),
+            make_execution(2, project_id=1, serialization_group='pm', serialization_key='first'),
+            make_execution(3, project_id=1, serialization_group='pm', serialization_key='second'),
+        ]
+        self.assertEqual(self.select(executions), [1, 3])
+
+    def test_request_waits_for_running_request_of_the_same_virtual_environment(self):
+        executions = [
+            make_execution(1, project_id=1, serialization_group='pm', serialization_key='first'),
+            make_execution(2, project_id=1, serialization_group='pm', serialization_key='first',
+                           state=QueuedExecution.States.RUNNING),
+        ]
+        self.assertEqual(self.select(executions), [])
+
+    def test_global_request_is_executed_exclusively(self):
+        executions = [
+            make_execution(1, project_id=1, serialization_group='pm', serialization_key='first'),
+            make_execution(2, project_id=1, serialization_group='pm', serialization_key=''),
+            make_execution(3, project_id=1, serialization_group='pm', serialization_key='second'),
+            make_execution(4, project_id=1, serialization_group='other', serialization_key=''),
+        ]
+        self.assertEqual(self.select(executions), [1, 4])
+
+
+@override_settings(WALDUR_ANSIBLE={'MAX_CONCURRENT_EXECUTIONS': 1})
+class SchedulingServiceTest(TestCase):
+    def setUp(self):
+        self.first_job = factories.JobFactory(state=models.Job.States.CREATION_SCHEDULED)
+        self.second_job = factories.JobFactory(state=models.Job.States.CREATION_SCHEDULED)
+
+    def get_execution(self, job):
+        return QueuedExecution.objects.get(object_id=job.pk)
+
+    def test_submitted_execution_is_running_if_limits_allow_it(self):
+        SchedulingService.submit(executors.RunJobExecutor, self.first_job)
+        SchedulingService.submit(executors.RunJobExecutor, self.second_job)
+
+        self.assertEqual(self.get_execution(self.first_job).state, QueuedExecution.States.RUNNING)
+        self.assertIsNotNone(self.get_execution(self.first_job).heartbeat)
+        self.assertEqual(self.get_execution(self.second_job).state, QueuedExecution.States.QUEUED)
+        self.assertEqual(SchedulingService.get_queue_position(self.first_job), 0)
+        self.assertEqual(SchedulingService.get_queue_position(self.second_job), 1)
+
+    def test_next_execution_is_released_when_running_job_is_finished(self):
+        SchedulingService.submit(executors.RunJobExecutor, self.first_job)
+        SchedulingService.submit(executors.RunJobExecutor, self.second_job)
+
+        self.first_job.begin_creating()
+        self.first_job.set_ok()
+        self.first_job.save()
+
+        self.assertFalse(QueuedExecution.objects.filter(object_id=self.first_job.pk).exists())
+        self.assertEqual(self.get_execution(self.second_job).state, QueuedExecution.States.RUNNING)
+
+    def test_execution_is_dispatched_by_its_executor(self):
+        SchedulingService.submit(executors.RunJobExecutor, self.first_job)
+
+        with patch.object(executors.RunJobExecutor, 'dispatch') as dispatch:
+            SchedulingService.dispatch([self.get_execution(self.first_job)])
+
+        dispatch.assert_called_once_with(self.first_job)
+
+    def test_executor_arguments_are_passed_on_dispatch(self):
+        with patch.object(SchedulingService, 'dispatch'):
+            executors.RunJobExecutor.execute(self.first_job, countdown=2, is_heavy_task=True)
+
+        with patch.object(executors.RunJobExecutor, 'dispatch') as dispatch:
+            SchedulingService.dispatch([self.get_execution(self.first_job)])
+
+        dispatch.assert_called_once_with(self.first_job, countdown=2, is_heavy_task=True)
+
+    def test_execution_of_removed_object_is_forgotten_on_dispatch(self):
+        SchedulingService.submit(executors.RunJobExecutor, self.first_job)
+        execution = self.get_execution(self.first_job)
+        models.Job.objects.filter(pk=self.first_job.pk).delete()
+
+        with patch.object(executors.RunJobExecutor, 'dispatch') as dispatch:
+            SchedulingService.dispatch([execution])
+
+        self.assertFalse(dispatch.called)
+        self.assertFalse(QueuedExecution.objects.filter(pk=execution.pk).exists())
+
+    def test_heartbeat_of_running_execution_is_updated(self):
+        SchedulingService.submit(executors.RunJobExecutor, self.first_job)
+        QueuedExecution.objects.update(heartbeat=timezone.now() - datetime.timedelta(hours=1))
+
+        SchedulingService.beat(self.first_job)
+
+        self.assertGreater(self.get_execution(self.first_job).heartbeat,
+                           timezone.now() - datetime.timedelta(minutes=1))
+
+    def test_lost_execution_is_failed_and_its_slot_is_released(self):
+        SchedulingService.submit(executors.RunJobExecutor, self.first_job)
+        SchedulingService.submit(executors.RunJobExecutor, self.second_job)
+        self.first_job.begin_creating()
+        self.first_job.save()
+        QueuedExecution.objects.filter(object_id=self.first_job.pk) \
+            .update(heartbeat=timezone.now() - datetime.timedelta(hours=1))
+
+        SchedulingService.cleanup()
+
+        self.first_job.refresh_from_db()
+        self.assertEqual(self.first_job.state, models.Job.States.ERRED)
+        self.assertIn('lost', self.first_job.error_message)
+        self.assertEqual(self.get_execution(self.second_job).state, QueuedExecution.States.RUNNING)
+
+    def test_alive_execution_is_kept_on_cleanup(self):
+        SchedulingService.submit(executors.RunJobExecutor, self.first_job)
+        self.first_job.begin_creating()
+        self.first_job.save()
+
+        SchedulingService.cleanup()
+
+        self.first_job.refresh_from_db()
+        self.assertEqual(self.first_job.state, models.Job.States.CREATING)
+        self.assertEqual(self.get_execution(self.first_job).state, QueuedExecution.States.RUNNING)
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from mock import patch
+
+from waldur_ansible.backend_processing.ssh_multiplexing_service import SshMultiplexingService
+
+
+class SshMultiplexingServiceTest(TestCase):
+    def setUp(self):
+        self.control_path_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.control_path_dir)
+
+    def get_ssh_common_args(self, key=None, **settings):
+        settings.setdefault('SSH_CONTROL_PATH_DIR', self.control_path_dir)
+        with override_settings(WALDUR_ANSIBLE=settings):
+            return SshMultiplexingService.get_ssh_common_args(key)
+
+    def test_control_path_is_different_for_different_instances(self):
+        first_args = self.get_ssh_common_args('first-instance')
+        second_args = self.get_ssh_common_args('second-instance')
+
+        self.assertIn('ControlPath=%s/' % self.control_path_dir, first_args)
+        self.assertNotEqual(first_args, second_args)
+        self.assertEqual(first_args, self.get_ssh_common_args('first-instance'))
+
+    def test_control_path_is_not_used_if_multiplexing_is_disabled(self):
+        args = self.get_ssh_common_args('instance', SSH_MULTIPLEXING_ENABLED=False)
+        self.assertEqual(args, '-o UserKnownHostsFile=/dev/null')
+
+    @override_settings(WALDUR_ANSIBLE={'SSH_CONTROL_PERSIST': 60})
+    @patch('waldur_ansible.backend_processing.ssh_multiplexing_service.get_ansible_config_value', return_value=None)
+    def test_control_persist_is_passed_via_ssh_args(self, get_ansible_config_value):
+        self.assertEqual(SshMultiplexingService.get_environment({}),
+                         {'ANSIBLE_SSH_ARGS': '-C -o ControlMaster=auto -o ControlPersist=60s'})
+
+    @override_settings(WALDUR_ANSIBLE={'SSH_CONTROL_PERSIST': 60})
+    def test_ssh_args_configured_in_environment_are_kept(self):
+        env = SshMultiplexingService.get_environment({'ANSIBLE_SSH_ARGS': '-o ProxyCommand="ssh -W %h:%p jump"'})
+        self.assertEqual(env['ANSIBLE_SSH_ARGS'],
+                         '-o ProxyCommand="ssh -W %h:%p jump" -o ControlMaster=auto -o ControlPersist=60s')
+
+    @override_settings(WALDUR_ANSIBLE={'SSH_CONTROL_PERSIST': 60})
+    def test_ssh_args_configured_in_ansible_cfg_are_kept(self):
+        config_path = os.path.join(self.control_path_dir, 'ansible.cfg')
+        with open(config_path, 'w') as config_file:
+            config_file.write('[ssh_connection]\nssh_args = -o Ciphers=aes256-ctr -o ControlPersist=10m\n')
+
+        env = SshMultiplexingService.get_environment({'ANSIBLE_CONFIG': config_path})
+
+        self.assertEqual(env['ANSIBLE_SSH_ARGS'], '-o Ciphers=aes256-ctr -o ControlPersist=10m -o ControlMaster=auto')
@@ -0,0 +1,105 @@
+import os
+import shutil
+import signal
+import subprocess  # nosec
+import tempfile
+import time
+
+from django.test import TestCase
+from mock import patch
+
+from waldur_ansible.backend_processing.exceptions import ProcessTimeoutError
+from waldur_ansible.backend_processing.warm_runner import get_unsupported_reason, open_warm_runner, \
+    WarmRunnerServer, WarmRunnerUnavailable
+
+
+class WarmRunnerRequestTest(TestCase):
+    def test_playbook_command_is_supported(self):
+        self.assertIsNone(get_unsupported_reason(['/usr/bin/ansible-playbook', 'main.yml'], {}))
+
+    def test_other_commands_are_not_supported(self):
+        self.assertIsNotNone(get_unsupported_reason(['ansible', 'all', '-m', 'ping'], {}))
+
+    @patch.dict('os.environ', {'ANSIBLE_LIBRARY': '/usr/share/ansible'})
+    def test_request_is_not_supported_if_ansible_configuration_differs(self):
+        command = ['ansible-playbook', 'main.yml']
+        self.assertIsNone(get_unsupported_reason(command, {'ANSIBLE_LIBRARY': '/usr/share/ansible', 'HOME': '/'}))
+        self.assertIsNotNone(get_unsupported_reason(command, {'ANSIBLE_LIBRARY': '/opt/ansible'}))
+
+
+def print_lines_and_fail(command):
+    os.write(1, b'first\nsecond\n')
+    return 3
+
+
+def print_lines(command):
+    os.write(1, b'first\n')
+    os.write(2, b'second\n')
+    return 0
+
+
+def print_forever(command):
+    while True:
+        os.write(1, b'tick\n')
+
+
+class WarmRunnerServerTest(TestCase):
+    """
+    Runs the server in a forked process and talks to it over a real unix socket.
+    Playbooks are replaced by functions, which are inherited by processes forked by the server.
+    """
+    command = ['ansible-playbook', 'main.yml']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, 'runner.sock')
+        self.server_pid = None
+
+    def tearDown(self):
+        if self.server_pid:
+            os.kill(self.server_pid, signal.SIGKILL)
+            os.waitpid(self.server_pid, 0)
+        shutil.rmtree(self.directory)
+
+    def start_server(self, playbook):
+        with patch('waldur_ansible.backend_processing.warm_runner.run_playbook', new=playbook), \
+                patch('waldur_ansible.backend_processing.warm_runner.WarmRunnerServer.preload_ansible'):
+            self.server_pid = os.fork()
+            if self.server_pid == 0:
+                try:
+                    WarmRunnerServer(self.socket_path).serve_forever()
+                finally:
+                    os._exit(1)
+
+        deadline = time.time() + 5
+        while not os.path.exists(self.socket_path) and time.time() < deadline:
+            time.sleep(0.05)
+
+    def run_command(self, command=None, **kwargs):
+        return list(open_warm_runner(self.socket_path, command or self.command, dict(os.environ), **kwargs))
+
+    def test_output_of_playbook_is_relayed(self):
+        self.start_server(print_lines)
+        self.assertEqual(self.run_command(timeout=10), ['first\n', 'second\n'])
+
+    def test_error_is_raised_if_playbook_fails(self):
+        self.start_server(print_lines_and_fail)
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            self.run_command(timeout=10)
+        self.assertEqual(context.exception.returncode, 3)
+
+    def test_playbook_which_writes_output_continuously_is_terminated_if_it_runs_for_too_long(self):
+        self.start_server(print_forever)
+        started = time.time()
+        with self.assertRaisesRegexp(ProcessTimeoutError, 'not finished'):
+            self.run_command(timeout=1)
+        self.assertLess(time.time() - started, 5)
+
+    def test_other_commands_are_refused_by_server(self):
+        self.start_server(print_lines)
+        with self.assertRaises(WarmRunnerUnavailable):
+            self.run_command(['ansible', 'all', '-m', 'ping'])
+
+    def test_runner_is_unavailable_if_server_is_not_started(self):
+        with self.assertRaises(WarmRunnerUnavailable):
+            self.run_command()
@@ -0,0 +1,128 @@
+import os
+import shutil
+import subprocess  # nosec
+import tempfile
+import time
+from zipfile import ZipFile
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from mock import patch
+
+from waldur_ansible.wheelhouse_service import WheelhouseService
+
+
+def build_wheel(directory, name, version, tag='py2.py3-none-any'):
+    """
+    Builds minimal pure python wheel, which is enough for pip to download and install it.
+    """
+    dist_info = '%s-%s.dist-info' % (name, version)
+    wheel_path = os.path.join(directory, '%s-%s-%s.whl' % (name, version, tag))
+    with ZipFile(wheel_path, 'w') as wheel:
+        wheel.writestr('%s.py' % name, '')
+        wheel.writestr(dist_info + '/METADATA', 'Metadata-Version: 2.1\nName: %s\nVersion: %s\n' % (name, version))
+        wheel.writestr(dist_info + '/WHEEL', 'Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: %s\n' % tag)
+        wheel.writestr(dist_info + '/RECORD', '')
+    return wheel_path
+
+
+class WheelhouseServiceTest(TestCase):
+    def setUp(self):
+        self.wheelhouse = tempfile.mkdtemp()
+        self.package_source = tempfile.mkdtemp()
+        self.settings_override = override_settings(WALDUR_ANSIBLE={
+            'WHEELHOUSE_DIRECTORY': self.wheelhouse,
+            'WHEELHOUSE_URL': 'http://localhost/wheelhouse',
+            'WHEELHOUSE_PACKAGE_SOURCE': self.package_source,
+            'WHEELHOUSE_PYTHON_VERSION': '3.5',
+            'WHEELHOUSE_PLATFORM': 'manylinux1_x86_64',
+            'WHEELHOUSE_MAX_SIZE': 1024 * 1024,
+        })
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.wheelhouse)
+        shutil.rmtree(self.package_source)
+
+    def test_wheel_is_downloaded_from_package_source_on_first_demand(self):
+        build_wheel(self.package_source, 'sample_library', '1.0.0')
+
+        find_links = WheelhouseService.prepare([{'name': 'sample-library', 'version': '1.0.0'}])
+
+        self.assertEqual(find_links, 'http://localhost/wheelhouse/cp35-manylinux1_x86_64/')
+        self.assertEqual(os.listdir(os.path.join(self.wheelhouse, 'cp35-manylinux1_x86_64')),
+                         ['sample_library-1.0.0-py2.py3-none-any.whl'])
+
+    def test_cached_wheel_is_not_downloaded_again(self):
+        platform_path = WheelhouseService.get_platform_path()
+        os.makedirs(platform_path)
+        build_wheel(platform_path, 'sample_library', '1.0.0')
+
+        with patch('waldur_ansible.wheelhouse_service.WheelhouseService.download') as download:
+            WheelhouseService.prepare([{'name': 'sample_library', 'version': '1.0.0'}])
+
+        self.assertFalse(download.called)
+
+    def test_library_without_version_is_skipped(self):
+        with patch('waldur_ansible.wheelhouse_service.WheelhouseService.download') as download:
+            WheelhouseService.prepare([{'name': 'sample_library'}])
+
+        self.assertFalse(download.called)
+
+    def test_least_recently_used_wheels_are_evicted(self):
+        platform_path = WheelhouseService.get_platform_path()
+        os.makedirs(platform_path)
+        old_wheel = build_wheel(platform_path, 'old_library', '1.0.0')
+        new_wheel = build_wheel(platform_path, 'new_library', '1.0.0')
+        os.utime(old_wheel, (time.time() - 60, time.time() - 60))
+
+        with self.settings(WALDUR_ANSIBLE={'WHEELHOUSE_DIRECTORY': self.wheelhouse,
+                                           'WHEELHOUSE_MAX_SIZE': os.path.getsize(new_wheel)}):
+            WheelhouseService.evict()
+
+        self.assertFalse(os.path.exists(old_wheel))
+        self.assertTrue(os.path.exists(new_wheel))
+
+    def test_wheelhouse_is_disabled_by_default(self):
+        with self.settings(WALDUR_ANSIBLE={}):
+            self.assertIsNone(WheelhouseService.prepare([{'name': 'sample_library', 'version': '1.0.0'}]))
+
+    def test_only_wheels_compatible_with_instances_are_found(self):
+        platform_path = WheelhouseService.get_platform_path()
+        os.makedirs(platform_path)
+        build_wheel(platform_path, 'sample_library', '1.0.0', tag='cp27-cp27mu-linux_x86_64')
+        compatible_wheel = build_wheel(platform_path, 'sample_library', '1.0.0', tag='cp35-cp35m-manylinux1_x86_64')
+
+        self.assertEqual(WheelhouseService.find_wheels(platform_path, 'sample_library', '1.0.0'), [compatible_wheel])
+
+    def test_built_wheels_which_are_not_compatible_with_instances_are_discarded(self):
+        def build_wheels(arguments, timeout, python=None):
+            if arguments[0] == 'download':
+                raise subprocess.CalledProcessError(1, 'pip')
+            wheel_dir = arguments[arguments.index('--wheel-dir') + 1]
+            build_wheel(wheel_dir, 'sample_library', '1.0.0', tag='cp27-cp27mu-linux_x86_64')
+            build_wheel(wheel_dir, 'dependency', '1.0.0', tag='py3-none-any')
+
+        with self.settings(WALDUR_ANSIBLE=dict(settings.WALDUR_ANSIBLE, WHEELHOUSE_BUILD_PYTHON='python3.5')), \
+                patch('waldur_ansible.wheelhouse_service.WheelhouseService.run_pip', side_effect=build_wheels) as run_pip:
+            WheelhouseService.prepare([{'name': 'sample_library', 'version': '1.0.0'}])
+
+        self.assertEqual(run_pip.call_args[1], {'python': 'python3.5'})
+        self.assertEqual(os.listdir(WheelhouseService.get_platform_path()), ['dependency-1.0.0-py3-none-any.whl'])
+
+    def test_wheels_are_not_built_without_build_interpreter(self):
+        with patch('waldur_ansible.wheelhouse_service.WheelhouseService.run_pip',
+                   side_effect=subprocess.CalledProcessError(1, 'pip')) as run_pip:
+            WheelhouseService.prepare([{'name': 'sample_library', 'version': '1.0.0'}])
+
+        self.assertEqual(run_pip.call_count, 1)
+        self.assertEqual(run_pip.call_args[0][0][0], 'download')
+
+    def test_downloads_share_prepare_timeout(self):
+        with self.settings(WALDUR_ANSIBLE=dict(settings.WALDUR_ANSIBLE, WHEELHOUSE_PREPARE_TIMEOUT=0)), \
+                patch('waldur_ansible.wheelhouse_service.WheelhouseService.download') as download:
+            find_links = WheelhouseService.prepare([{'name': 'sample_library', 'version': '1.0.0'}])
+
+        self.assertFalse(download.called)
+        self.assertEqual(find_links, 'http://localhost/wheelhouse/cp35-manylinux1_x86_64/')
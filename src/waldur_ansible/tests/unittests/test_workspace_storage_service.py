@@ -0,0 +1,81 @@
+import os
+import shutil
+import stat
+import tempfile
+from zipfile import ZipFile
+
+from django.test import TestCase, override_settings
+from mock import patch
+
+from waldur_ansible.workspace_storage_service import WorkspaceStorageService
+
+
+class WorkspaceStorageServiceTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def extract(self, files, workspace_name):
+        archive_path = os.path.join(self.media_root, 'archive.zip')
+        with ZipFile(archive_path, 'w') as zip_file:
+            for name, content in files.items():
+                zip_file.writestr(name, content)
+        workspace = os.path.join(self.media_root, workspace_name)
+        with ZipFile(archive_path) as zip_file:
+            manifest = WorkspaceStorageService.extract(zip_file, workspace)
+        return workspace, manifest
+
+    def test_files_are_extracted_to_workspace(self):
+        workspace, manifest = self.extract({'main.yml': 'hosts: all', 'roles/vm/tasks.yml': 'tasks'}, 'first')
+
+        self.assertEqual(sorted(manifest.keys()), ['main.yml', 'roles/vm/tasks.yml'])
+        with open(os.path.join(workspace, 'roles/vm/tasks.yml')) as workspace_file:
+            self.assertEqual(workspace_file.read(), 'tasks')
+
+    def test_identical_files_share_the_same_blob(self):
+        first_workspace, first_manifest = self.extract({'main.yml': 'hosts: all'}, 'first')
+        second_workspace, second_manifest = self.extract({'site.yml': 'hosts: all'}, 'second')
+
+        self.assertEqual(first_manifest['main.yml'], second_manifest['site.yml'])
+        first_stat = os.stat(os.path.join(first_workspace, 'main.yml'))
+        second_stat = os.stat(os.path.join(second_workspace, 'site.yml'))
+        self.assertEqual(first_stat.st_ino, second_stat.st_ino)
+        self.assertEqual(first_stat.st_nlink, 3)
+
+    def test_workspace_files_are_read_only(self):
+        workspace, _ = self.extract({'main.yml': 'hosts: all'}, 'first')
+
+        mode = os.stat(os.path.join(workspace, 'main.yml')).st_mode
+        self.assertFalse(mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+    def test_content_which_is_already_stored_is_not_written_again(self):
+        self.extract({'main.yml': 'hosts: all'}, 'first')
+
+        with patch('waldur_ansible.workspace_storage_service.WorkspaceStorageService.store_blob') as store_blob:
+            _, manifest = self.extract({'site.yml': 'hosts: all'}, 'second')
+
+        self.assertFalse(store_blob.called)
+        self.assertEqual(manifest.keys(), ['site.yml'])
+
+    def test_members_pointing_outside_of_workspace_are_skipped(self):
+        workspace, manifest = self.extract({'../evil.yml': 'evil', 'main.yml': 'hosts: all'}, 'first')
+
+        self.assertEqual(manifest.keys(), ['main.yml'])
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'evil.yml')))
+
+    @patch('waldur_ansible.workspace_storage_service.BLOB_GARBAGE_COLLECTION_DELAY', -60)
+    def test_blobs_of_deleted_workspace_are_collected(self):
+        workspace, manifest = self.extract({'main.yml': 'hosts: all'}, 'first')
+        blob_path = WorkspaceStorageService.get_blob_path(manifest['main.yml'])
+
+        WorkspaceStorageService.collect_garbage()
+        self.assertTrue(os.path.exists(blob_path))
+
+        shutil.rmtree(workspace)
+        WorkspaceStorageService.collect_garbage()
+        self.assertFalse(os.path.exists(blob_path))
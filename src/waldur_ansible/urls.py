@@ -7,4 +7,5 @@ def register_in(router):
     router.register(r'python-management', views.PythonManagementViewSet, base_name='python_management')
     router.register(r'pip-packages', views.PipPackagesViewSet, base_name='pip_packages')
     router.register(r'applications', views.ApplicationsSummaryViewSet, base_name='applications')
+    router.register(r'ansible-locks', views.LocksViewSet, base_name='ansible_locks')
     router.register(r'waldur_ssh_keys', views.WaldurSshKeysViewSet, base_name='waldur_ssh_keys')
\ No newline at end of file
@@ -1,18 +1,27 @@
+import re
+from uuid import UUID
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.encoding import force_text
 from django.utils.translation import ugettext_lazy as _
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import decorators, response, status, mixins
+from rest_framework import decorators, response, status, mixins, permissions
+from rest_framework import exceptions as rf_exceptions
 from rest_framework.mixins import ListModelMixin
 from rest_framework.viewsets import GenericViewSet
 from waldur_ansible.backend_processing import cache_utils
+from waldur_ansible.backend_processing.lock_registry import LockRegistry
 from waldur_ansible.backend_processing.locking_service import PythonManagementBackendLockingService, \
     PythonManagementBackendLockBuilder, \
-    PYTHON_MANAGEMENT_ENTRY_POINT_LOCK_TIMEOUT, PYTHON_MANAGEMENT_TIMEOUT
+    PYTHON_MANAGEMENT_ENTRY_POINT_LOCK_TIMEOUT, PYTHON_MANAGEMENT_TIMEOUT, LOCK_CLASSES
 from waldur_ansible.models import PythonManagementInitializeRequest, PythonManagementSynchronizeRequest, \
     PythonManagementFindVirtualEnvsRequest, \
     PythonManagementFindInstalledLibrariesRequest, PythonManagement, Job, PythonManagementDeleteVirtualEnvRequest, \
     PythonManagementDeleteRequest
+from waldur_ansible.output_storage_service import OutputStorageService
 from waldur_ansible.pip_service import PipService
 from waldur_ansible.python_management_service import PythonManagementService
+from waldur_ansible.scheduling_service import SchedulingService
 from waldur_core.core import exceptions as core_exceptions
 from waldur_core.core import mixins as core_mixins
 from waldur_core.core import validators as core_validators
@@ -47,6 +56,86 @@ def get_project_jobs_count(project):
 structure_views.ProjectCountersView.register_counter('ansible', get_project_jobs_count)
 
 
+DEFAULT_OUTPUT_TAIL_MAX_SIZE = 1024 * 1024
+RANGE_HEADER_REGEX = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def get_non_negative_integer_param(request, name):
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise rf_exceptions.ValidationError({name: _('Value should be a non-negative integer.')})
+    return value
+
+
+def build_output_tail_response(request, scope):
+    """
+    Returns output starting from ?offset= byte, so that polling client receives only new output.
+    If ?lines= is specified, at most that many lines are returned; without offset these are the last lines.
+    """
+    offset = get_non_negative_integer_param(request, 'offset')
+    lines = get_non_negative_integer_param(request, 'lines')
+    if offset is None:
+        offset = OutputStorageService.find_last_lines_offset(scope, lines) if lines is not None else 0
+
+    max_size = settings.WALDUR_ANSIBLE.get('OUTPUT_TAIL_MAX_SIZE', DEFAULT_OUTPUT_TAIL_MAX_SIZE)
+    data = OutputStorageService.read(scope, offset=offset, limit=max_size)
+    if len(data) == max_size and b'\n' in data:
+        data = data[:data.rindex(b'\n') + 1]
+    if lines is not None:
+        data = b''.join(data.splitlines(True)[:lines])
+
+    return response.Response({
+        'output': force_text(data, errors='replace'),
+        'offset': offset + len(data),
+        'output_length': scope.output_length,
+        'output_lines': scope.output_lines,
+        'is_finished': scope.state in (models.Job.States.OK, models.Job.States.ERRED),
+    })
+
+
+def build_raw_output_response(request, scope, filename):
+    """
+    Returns output as plain text. Single byte range specified in Range header is supported.
+    Syntactically invalid Range header is ignored and the whole output is returned, as required by RFC 7233.
+    """
+    total_length = scope.output_length
+    match = RANGE_HEADER_REGEX.match(request.META.get('HTTP_RANGE', '').strip())
+    if match and match.group(1) and match.group(2) and int(match.group(1)) > int(match.group(2)):
+        # Last byte position preceding the first one makes the range invalid
+        match = None
+    if not match or match.groups() == ('', ''):
+        raw_response = StreamingHttpResponse(
+            OutputStorageService.iterate(scope), content_type='text/plain; charset=utf-8')
+        raw_response['Content-Length'] = total_length
+    else:
+        start, end = match.groups()
+        if not start:
+            start, end = max(total_length - int(end), 0), total_length - 1
+        else:
+            start, end = int(start), min(int(end), total_length - 1) if end else total_length - 1
+
+        if start >= total_length or start > end:
+            raw_response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            raw_response['Content-Range'] = 'bytes */%s' % total_length
+            return raw_response
+
+        raw_response = HttpResponse(
+            OutputStorageService.read(scope, offset=start, limit=end - start + 1),
+            content_type='text/plain; charset=utf-8',
+            status=status.HTTP_206_PARTIAL_CONTENT)
+        raw_response['Content-Range'] = 'bytes %s-%s/%s' % (start, end, total_length)
+
+    raw_response['Accept-Ranges'] = 'bytes'
+    raw_response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return raw_response
+
+
 class ApplicationsSummaryViewSet(ListModelMixin, GenericViewSet):
     serializer_class = serializers.SummaryApplicationSerializer
 
@@ -88,6 +177,28 @@ class JobViewSet(core_mixins.CreateExecutorMixin, core_views.ActionsViewSet):
     ]
     delete_executor = executors.DeleteJobExecutor
 
+    @decorators.detail_route(methods=['get'])
+    def events(self, request, uuid=None):
+        job = self.get_object()
+        events = job.events.all().order_by('index')
+        if request.query_params.get('event'):
+            events = events.filter(event=request.query_params['event'])
+        if request.query_params.get('status'):
+            events = events.filter(status=request.query_params['status'])
+
+        page = self.paginate_queryset(events)
+        serializer = serializers.JobEventSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @decorators.detail_route(methods=['get'])
+    def output(self, request, uuid=None):
+        return build_output_tail_response(request, self.get_object())
+
+    @decorators.detail_route(methods=['get'])
+    def raw_output(self, request, uuid=None):
+        job = self.get_object()
+        return build_raw_output_response(request, job, 'job-%s.log' % job.uuid.hex)
+
 
 class PythonManagementViewSet(core_mixins.AsyncExecutor, core_views.ActionsViewSet):
     lookup_field = 'uuid'
@@ -131,20 +242,21 @@ class PythonManagementViewSet(core_mixins.AsyncExecutor, core_views.ActionsViewS
     @ensure_atomic_transaction
     def perform_destroy(self, persisted_python_management):
         entry_point_lock = PythonManagementBackendLockBuilder.build_entry_point_lock(persisted_python_management)
-        if cache_utils.is_syncing(entry_point_lock):
+        entry_point_lock_token = cache_utils.acquire_lock(
+            entry_point_lock, PYTHON_MANAGEMENT_ENTRY_POINT_LOCK_TIMEOUT, owner=self.request.user.uuid.hex)
+        if not entry_point_lock_token:
             return self.build_python_management_locked_response()
-        cache_utils.renew_task_status(entry_point_lock, PYTHON_MANAGEMENT_ENTRY_POINT_LOCK_TIMEOUT)
 
         try:
             delete_request = PythonManagementDeleteRequest(python_management=persisted_python_management)
 
-            if not PythonManagementBackendLockingService.is_processing_allowed(delete_request):
+            if not self.is_processing_allowed_or_queued(delete_request):
                 return self.build_python_management_locked_response()
 
             delete_request.save()
             self.python_management_request_executor.execute(delete_request, async=self.async_executor)
         finally:
-            cache_utils.release_task_status(entry_point_lock)
+            cache_utils.release_lock(entry_point_lock, entry_point_lock_token)
 
     @ensure_atomic_transaction
     def perform_update(self, serializer):
@@ -154,9 +266,10 @@ class PythonManagementViewSet(core_mixins.AsyncExecutor, core_views.ActionsViewS
 
         entry_point_lock = PythonManagementBackendLockBuilder.build_entry_point_lock(persisted_python_management)
 
-        if cache_utils.is_syncing(entry_point_lock):
+        entry_point_lock_token = cache_utils.acquire_lock(
+            entry_point_lock, PYTHON_MANAGEMENT_ENTRY_POINT_LOCK_TIMEOUT, owner=self.request.user.uuid.hex)
+        if not entry_point_lock_token:
             return self.build_python_management_locked_response()
-        cache_utils.renew_task_status(entry_point_lock, PYTHON_MANAGEMENT_ENTRY_POINT_LOCK_TIMEOUT)
 
         try:
             all_transient_virtual_environments = serializer.validated_data.get('virtual_environments')
@@ -165,18 +278,39 @@ class PythonManagementViewSet(core_mixins.AsyncExecutor, core_views.ActionsViewS
                 PythonManagementService.identify_changed_created_removed_envs(
                     all_transient_virtual_environments, persisted_virtual_environments)
 
-            if cache_utils.is_syncing(
-                    PythonManagementBackendLockBuilder.build_global_lock(persisted_python_management)):
+            locks_state = PythonManagementService.read_locks_state(
+                persisted_python_management, removed_virtual_environments,
+                virtual_environments_to_change, virtual_environments_to_create)
+            if locks_state.is_global_locked and not (
+                    PythonManagementService.is_request_queue_enabled() and self.async_executor):
                 return self.build_python_management_locked_response()
 
             locked_virtual_envs = PythonManagementService.create_or_refuse_requests(
                 self.python_management_request_executor, persisted_python_management, removed_virtual_environments,
-                virtual_environments_to_change, virtual_environments_to_create)
+                virtual_environments_to_change, virtual_environments_to_create, locks_state=locks_state)
 
             if locked_virtual_envs:
                 return self.build_python_management_locked_response(locked_virtual_envs=locked_virtual_envs)
         finally:
-            cache_utils.release_task_status(entry_point_lock)
+            cache_utils.release_lock(entry_point_lock, entry_point_lock_token)
+
+    def is_processing_allowed_or_queued(self, python_management_request):
+        """
+        Conflicting request waits in the queue of python management instead of being refused,
+        unless the queue is disabled or request is executed synchronously.
+        """
+        if PythonManagementService.is_request_queue_enabled() and self.async_executor:
+            return True
+        return PythonManagementBackendLockingService.is_processing_allowed(python_management_request)
+
+    def build_scheduled_response(self, message, python_management_request):
+        return response.Response(
+            {
+                'status': message,
+                'uuid': python_management_request.uuid.hex,
+                'queue_position': SchedulingService.get_queue_position(python_management_request),
+            },
+            status=status.HTTP_202_ACCEPTED)
 
     def build_python_management_locked_response(self, locked_virtual_envs=None):
         if not locked_virtual_envs:
@@ -193,52 +327,84 @@ class PythonManagementViewSet(core_mixins.AsyncExecutor, core_views.ActionsViewS
     @ensure_atomic_transaction
     def find_virtual_environments(self, request, uuid=None):
         persisted_python_management = self.get_object()
+        find_virtual_envs_request = PythonManagementFindVirtualEnvsRequest(
+            python_management=persisted_python_management)
+        fresh_request = self.find_fresh_discovery_request(request, find_virtual_envs_request)
+        if fresh_request:
+            return self.build_fresh_discovery_response(request, fresh_request)
 
         entry_point_lock = PythonManagementBackendLockBuilder.build_entry_point_lock(persisted_python_management)
-        if cache_utils.is_syncing(entry_point_lock):
+        entry_point_lock_token = cache_utils.acquire_lock(
+            entry_point_lock, PYTHON_MANAGEMENT_TIMEOUT, owner=self.request.user.uuid.hex)
+        if not entry_point_lock_token:
             return self.build_python_management_locked_response()
-        cache_utils.renew_task_status(entry_point_lock, PYTHON_MANAGEMENT_TIMEOUT)
 
         try:
-            find_virtual_envs_request = PythonManagementFindVirtualEnvsRequest(
-                python_management=persisted_python_management)
 
-            if not PythonManagementBackendLockingService.is_processing_allowed(find_virtual_envs_request):
+            if not self.is_processing_allowed_or_queued(find_virtual_envs_request):
                 return self.build_python_management_locked_response()
 
             find_virtual_envs_request.save()
             self.python_management_request_executor.execute(find_virtual_envs_request, async=self.async_executor)
-            return response.Response({'status': _('Find installed virtual environments process has been scheduled.')},
-                                     status=status.HTTP_202_ACCEPTED)
+            return self.build_scheduled_response(
+                _('Find installed virtual environments process has been scheduled.'), find_virtual_envs_request)
         finally:
-            cache_utils.release_task_status(entry_point_lock)
+            cache_utils.release_lock(entry_point_lock, entry_point_lock_token)
 
     @decorators.detail_route(url_path="find_installed_libraries/(?P<virtual_env_name>.+)", methods=['get'])
     @ensure_atomic_transaction
     def find_installed_libraries(self, request, virtual_env_name=None, uuid=None):
         persisted_python_management = self.get_object()
+        find_installed_libraries_request = PythonManagementFindInstalledLibrariesRequest(
+            python_management=persisted_python_management, virtual_env_name=virtual_env_name)
+        fresh_request = self.find_fresh_discovery_request(request, find_installed_libraries_request)
+        if fresh_request:
+            return self.build_fresh_discovery_response(request, fresh_request)
 
         entry_point_lock = PythonManagementBackendLockBuilder.build_entry_point_lock(persisted_python_management)
-        if cache_utils.is_syncing(entry_point_lock):
+        entry_point_lock_token = cache_utils.acquire_lock(
+            entry_point_lock, PYTHON_MANAGEMENT_TIMEOUT, owner=self.request.user.uuid.hex)
+        if not entry_point_lock_token:
             return self.build_python_management_locked_response()
-        cache_utils.renew_task_status(entry_point_lock, PYTHON_MANAGEMENT_TIMEOUT)
 
         try:
-            find_installed_libraries_request = PythonManagementFindInstalledLibrariesRequest(
-                python_management=persisted_python_management, virtual_env_name=virtual_env_name)
 
-            if not PythonManagementBackendLockingService.is_processing_allowed(find_installed_libraries_request):
+            if not self.is_processing_allowed_or_queued(find_installed_libraries_request):
                 return self.build_python_management_locked_response()
 
             find_installed_libraries_request.save()
             self.python_management_request_executor.execute(find_installed_libraries_request, async=self.async_executor)
-            return response.Response(
-                {'status': _('Find installed libraries in virtual environment process has been scheduled.')},
-                status=status.HTTP_202_ACCEPTED)
+            return self.build_scheduled_response(
+                _('Find installed libraries in virtual environment process has been scheduled.'),
+                find_installed_libraries_request)
         finally:
-            cache_utils.release_task_status(entry_point_lock)
+            cache_utils.release_lock(entry_point_lock, entry_point_lock_token)
+
+    def find_fresh_discovery_request(self, request, discovery_request):
+        """
+        Result of recently completed identical request is returned instead of running the playbook again,
+        unless ?refresh=true is specified.
+        """
+        if request.query_params.get('refresh') in ('true', 'True', '1'):
+            return None
+        return PythonManagementService.find_fresh_discovery_request(discovery_request)
+
+    def build_fresh_discovery_response(self, request, fresh_request):
+        """
+        Payload has the same keys as the one of scheduled request, so that clients poll the request by uuid
+        in both cases. Status is 200 and queue position is None because nothing has been scheduled.
+        """
+        serializer = serializers.SummaryPythonManagementRequestsSerializer(fresh_request, context={'request': request})
+        return response.Response(
+            {
+                'status': _('Result of recently completed request is up to date.'),
+                'uuid': fresh_request.uuid.hex,
+                'queue_position': None,
+                'request': serializer.data,
+            },
+            status=status.HTTP_200_OK)
 
-    @decorators.detail_route(url_path="requests/(?P<request_uuid>.+)", methods=['get'])
+    @decorators.detail_route(url_path="requests/(?P<request_uuid>[^/]+)", methods=['get'])
     def find_request_with_output_by_uuid(self, request, uuid=None, request_uuid=None):
         requests = SummaryQuerySet(python_management_requests_models).filter(python_management=self.get_object(),
                                                                              uuid=request_uuid)
@@ -246,6 +412,24 @@ class PythonManagementViewSet(core_mixins.AsyncExecutor, core_views.ActionsViewS
             requests, many=True, context={'select_output': True})
         return response.Response(serializer.data)
 
+    @decorators.detail_route(url_path="requests/(?P<request_uuid>[^/]+)/output", methods=['get'])
+    def request_output(self, request, uuid=None, request_uuid=None):
+        return build_output_tail_response(request, self.get_python_management_request(request_uuid))
+
+    @decorators.detail_route(url_path="requests/(?P<request_uuid>[^/]+)/raw_output", methods=['get'])
+    def request_raw_output(self, request, uuid=None, request_uuid=None):
+        python_management_request = self.get_python_management_request(request_uuid)
+        return build_raw_output_response(
+            request, python_management_request, 'python-management-request-%s.log' % python_management_request.uuid.hex)
+
+    def get_python_management_request(self, request_uuid):
+        requests = SummaryQuerySet(python_management_requests_models).filter(python_management=self.get_object(),
+                                                                             uuid=request_uuid)
+        try:
+            return requests[0]
+        except (IndexError, ValueError):
+            raise rf_exceptions.NotFound()
+
 
 class PipPackagesViewSet(GenericViewSet):
 
@@ -262,6 +446,44 @@ class PipPackagesViewSet(GenericViewSet):
         return response.Response({'libraries': matching_libraries})
 
 
+class LocksViewSet(GenericViewSet):
+    """
+    Staff-only view of python management locks: held locks with their owners, locks refused within
+    the last day and counters of lock acquisitions per lock class. Filter by ?python_management_uuid=<uuid>,
+    which is required by cache lock backend, because held locks can not be listed from cache.
+    Without the filter, database lock backend lists held locks from the lock table.
+    """
+    permission_classes = (permissions.IsAuthenticated, permissions.IsAdminUser)
+
+    def list(self, request, *args, **kwargs):
+        return response.Response({
+            'locks': self.get_locks(),
+            'metrics': LockRegistry.get_metrics(LOCK_CLASSES),
+        })
+
+    @decorators.list_route(methods=['get'])
+    def metrics(self, request):
+        """
+        Metrics in Prometheus text exposition format.
+        """
+        locks = LockRegistry.list_locks() if LockRegistry.can_list_locks() else None
+        metrics = LockRegistry.format_metrics(LockRegistry.get_metrics(LOCK_CLASSES), locks)
+        return HttpResponse(metrics, content_type='text/plain; version=0.0.4')
+
+    def get_locks(self):
+        python_management_uuid = self.request.query_params.get('python_management_uuid')
+        if not python_management_uuid:
+            if LockRegistry.can_list_locks():
+                return LockRegistry.list_locks()
+            raise rf_exceptions.ValidationError(
+                {'python_management_uuid': _('This filter is required by cache lock backend.')})
+        try:
+            python_managements = models.PythonManagement.objects.filter(uuid=UUID(python_management_uuid))
+        except ValueError:
+            raise rf_exceptions.ValidationError({'python_management_uuid': _('Invalid UUID.')})
+        return LockRegistry.get_locks(PythonManagementService.find_lock_keys(python_managements))
+
+
 class WaldurSshKeysViewSet(mixins.ListModelMixin, GenericViewSet):
 
     def list(self, request, *args, **kwargs):
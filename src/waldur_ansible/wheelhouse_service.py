@@ -0,0 +1,245 @@
+import logging
+import os
+import re
+import shutil
+import subprocess  # nosec
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from waldur_ansible.backend_processing.exceptions import AnsibleBackendError
+from waldur_ansible.backend_processing.process_runner import iterate_process_output
+from waldur_ansible.workspace_storage_service import ensure_directory_exists
+
+logger = logging.getLogger(__name__)
+
+WHEEL_EXTENSION = '.whl'
+TEMPORARY_DIR_NAME = '.tmp'
+DEFAULT_WHEELHOUSE_MAX_SIZE = 10 * 1024 * 1024 * 1024
+DEFAULT_WHEELHOUSE_DOWNLOAD_TIMEOUT = 30 * 60
+DEFAULT_WHEELHOUSE_PREPARE_TIMEOUT = 5 * 60
+
+
+class WheelhouseService(object):
+    """
+    Optional cache of wheels of libraries installed to virtual environments.
+    Wheels are downloaded to the Waldur node when a library is requested for the first time and
+    are served to instances from WHEELHOUSE_URL, so the same library is not downloaded and built
+    by every instance. Wheels are grouped by platform tag of instances and file modification time
+    is used as the time of the last use, least recently used wheels are removed when
+    the wheelhouse exceeds its size limit.
+    """
+
+    @staticmethod
+    def is_enabled():
+        return bool(settings.WALDUR_ANSIBLE.get('WHEELHOUSE_DIRECTORY')
+                    and settings.WALDUR_ANSIBLE.get('WHEELHOUSE_URL'))
+
+    @staticmethod
+    def prepare(libraries):
+        """
+        Makes sure that wheels of libraries are present in the wheelhouse and returns URL
+        which should be passed to pip as --find-links, or None if wheelhouse is disabled.
+        Failure to download a library is not fatal, instance downloads it from the index itself.
+        It is called while virtual environment is locked, so all downloads share
+        WHEELHOUSE_PREPARE_TIMEOUT and libraries left when it is exceeded are not added to the wheelhouse.
+        """
+        if not WheelhouseService.is_enabled():
+            return None
+
+        platform_path = WheelhouseService.get_platform_path()
+        ensure_directory_exists(platform_path)
+        deadline = time.time() + settings.WALDUR_ANSIBLE.get(
+            'WHEELHOUSE_PREPARE_TIMEOUT', DEFAULT_WHEELHOUSE_PREPARE_TIMEOUT)
+        for library in libraries:
+            name, version = library.get('name'), library.get('version')
+            # Only pinned versions can be looked up in the wheelhouse
+            if not name or not version:
+                continue
+
+            wheel_paths = WheelhouseService.find_wheels(platform_path, name, version)
+            if wheel_paths:
+                for wheel_path in wheel_paths:
+                    touch(wheel_path)
+                continue
+
+            remaining_time = deadline - time.time()
+            if remaining_time <= 0:
+                logger.warning('Wheelhouse preparation has timed out, library %s==%s is not added to it.',
+                               name, version)
+                continue
+
+            try:
+                WheelhouseService.download(name, version, platform_path, remaining_time)
+            except (AnsibleBackendError, subprocess.CalledProcessError, OSError) as e:
+                logger.warning('Unable to add library %s==%s to the wheelhouse: %s', name, version, e)
+
+        WheelhouseService.evict()
+        return settings.WALDUR_ANSIBLE['WHEELHOUSE_URL'].rstrip('/') + '/' \
+            + WheelhouseService.get_platform_tag() + '/'
+
+    @staticmethod
+    def download(name, version, platform_path, timeout):
+        """
+        Binary wheels for the platform of instances are downloaded if they exist, otherwise wheels are
+        built by WHEELHOUSE_BUILD_PYTHON interpreter, if it is configured. Only wheels which are
+        compatible with python version and platform of instances are added to the wheelhouse.
+        """
+        requirement = '%s==%s' % (name, version)
+        temporary_base_path = os.path.join(WheelhouseService.get_base_path(), TEMPORARY_DIR_NAME)
+        ensure_directory_exists(temporary_base_path)
+        temporary_path = tempfile.mkdtemp(dir=temporary_base_path)
+        try:
+            try:
+                WheelhouseService.run_pip([
+                    'download', '--dest', temporary_path, '--only-binary', ':all:',
+                    '--platform', settings.WALDUR_ANSIBLE.get('WHEELHOUSE_PLATFORM', 'manylinux1_x86_64'),
+                    '--python-version', settings.WALDUR_ANSIBLE.get('WHEELHOUSE_PYTHON_VERSION', '3.5'),
+                    '--implementation', 'cp',
+                    requirement], timeout)
+            except subprocess.CalledProcessError:
+                build_python = settings.WALDUR_ANSIBLE.get('WHEELHOUSE_BUILD_PYTHON')
+                if not build_python:
+                    raise
+                logger.info('Binary wheels of %s are not available, building them.', requirement)
+                WheelhouseService.run_pip(
+                    ['wheel', '--wheel-dir', temporary_path, requirement], timeout, python=build_python)
+
+            # Wheels are moved in order to make them visible to concurrent readers only when complete
+            for filename in os.listdir(temporary_path):
+                if not filename.endswith(WHEEL_EXTENSION):
+                    continue
+                if not WheelhouseService.is_compatible_wheel(filename):
+                    logger.warning('Wheel %s is not compatible with instances, it is not added to the wheelhouse.',
+                                   filename)
+                    continue
+                os.rename(os.path.join(temporary_path, filename), os.path.join(platform_path, filename))
+        finally:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+
+    @staticmethod
+    def run_pip(arguments, timeout, python=sys.executable):
+        command = [python, '-m', 'pip'] + arguments + WheelhouseService.get_package_source_arguments()
+        timeout = min(timeout, settings.WALDUR_ANSIBLE.get(
+            'WHEELHOUSE_DOWNLOAD_TIMEOUT', DEFAULT_WHEELHOUSE_DOWNLOAD_TIMEOUT))
+        for line in iterate_process_output(command, dict(os.environ), timeout=timeout):
+            logger.debug(line.rstrip())
+
+    @staticmethod
+    def get_package_source_arguments():
+        package_source = settings.WALDUR_ANSIBLE.get('WHEELHOUSE_PACKAGE_SOURCE')
+        if not package_source:
+            return []
+        if os.path.isdir(package_source):
+            return ['--no-index', '--find-links', package_source]
+        return ['--index-url', package_source]
+
+    @staticmethod
+    def find_wheels(platform_path, name, version):
+        normalized_name = normalize_name(name)
+        wheel_paths = []
+        for filename in os.listdir(platform_path):
+            if not filename.endswith(WHEEL_EXTENSION):
+                continue
+            parts = split_wheel_filename(filename)
+            if parts and normalize_name(parts[0]) == normalized_name and parts[1] == version \
+                    and WheelhouseService.is_compatible_wheel(filename):
+                wheel_paths.append(os.path.join(platform_path, filename))
+        return wheel_paths
+
+    @staticmethod
+    def is_compatible_wheel(filename):
+        """
+        Wheel is compatible if any of its python, abi and platform tags is supported by instances.
+        """
+        parts = split_wheel_filename(filename)
+        if not parts:
+            return False
+        python_tags, abi_tags, platform_tags = [set(tag.split('.')) for tag in parts[-3:]]
+        supported_python_tags, supported_abi_tags, supported_platform_tags = WheelhouseService.get_supported_tags()
+        return bool(python_tags & supported_python_tags and abi_tags & supported_abi_tags
+                    and platform_tags & supported_platform_tags)
+
+    @staticmethod
+    def get_supported_tags():
+        major, minor = settings.WALDUR_ANSIBLE.get('WHEELHOUSE_PYTHON_VERSION', '3.5').split('.')[:2]
+        platform = settings.WALDUR_ANSIBLE.get('WHEELHOUSE_PLATFORM', 'manylinux1_x86_64')
+        interpreter_tag = 'cp%s%s' % (major, minor)
+        python_tags = {'py' + major, 'py%s%s' % (major, minor), interpreter_tag}
+        # Wheels built for stable ABI of earlier python versions are supported as well
+        python_tags.update('cp%s%s' % (major, earlier_minor) for earlier_minor in range(int(minor)))
+        abi_tags = {'none', 'abi3', interpreter_tag, interpreter_tag + 'm'}
+        platform_tags = {'any', platform}
+        if platform.startswith('manylinux'):
+            platform_tags.add('linux_' + platform.split('_', 1)[1])
+        return python_tags, abi_tags, platform_tags
+
+    @staticmethod
+    def evict():
+        max_size = settings.WALDUR_ANSIBLE.get('WHEELHOUSE_MAX_SIZE', DEFAULT_WHEELHOUSE_MAX_SIZE)
+        wheels = []
+        total_size = 0
+        for wheel_path in WheelhouseService.list_wheels():
+            try:
+                stat = os.stat(wheel_path)
+            except OSError:
+                continue
+            wheels.append((stat.st_mtime, stat.st_size, wheel_path))
+            total_size += stat.st_size
+
+        for _, size, wheel_path in sorted(wheels):
+            if total_size <= max_size:
+                break
+            try:
+                os.remove(wheel_path)
+            except OSError:
+                continue
+            total_size -= size
+
+    @staticmethod
+    def list_wheels():
+        base_path = WheelhouseService.get_base_path()
+        if not os.path.isdir(base_path):
+            return
+        for platform_tag in os.listdir(base_path):
+            platform_path = os.path.join(base_path, platform_tag)
+            if platform_tag == TEMPORARY_DIR_NAME or not os.path.isdir(platform_path):
+                continue
+            for filename in os.listdir(platform_path):
+                if filename.endswith(WHEEL_EXTENSION):
+                    yield os.path.join(platform_path, filename)
+
+    @staticmethod
+    def get_platform_tag():
+        python_version = settings.WALDUR_ANSIBLE.get('WHEELHOUSE_PYTHON_VERSION', '3.5')
+        platform = settings.WALDUR_ANSIBLE.get('WHEELHOUSE_PLATFORM', 'manylinux1_x86_64')
+        return 'cp%s-%s' % (python_version.replace('.', ''), platform)
+
+    @staticmethod
+    def get_platform_path():
+        return os.path.join(WheelhouseService.get_base_path(), WheelhouseService.get_platform_tag())
+
+    @staticmethod
+    def get_base_path():
+        return settings.WALDUR_ANSIBLE['WHEELHOUSE_DIRECTORY']
+
+
+def split_wheel_filename(filename):
+    """
+    Wheel file name is {distribution}-{version}(-{build})?-{python}-{abi}-{platform}.whl
+    """
+    parts = filename[:-len(WHEEL_EXTENSION)].split('-')
+    return parts if len(parts) in (5, 6) else None
+
+
+def normalize_name(name):
+    return re.sub(r'[-_.]+', '_', name).lower()
+
+
+def touch(path):
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
@@ -0,0 +1,159 @@
+import errno
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+BLOBS_DIR_NAME = '.blobs'
+# Unreferenced blobs are kept for a while, because upload which is going to link them may be in progress
+BLOB_GARBAGE_COLLECTION_DELAY = 60 * 60
+# Blobs are shared by workspaces through hard links, so writing to a workspace file must not alter the others
+BLOB_MODE = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+class WorkspaceStorageService(object):
+    """
+    Playbook workspaces are stored content-addressed. Every file of uploaded archive is
+    saved once as a read-only blob named after SHA-256 of its content and workspace consists of
+    hard links to blobs, so identical files of different playbooks occupy disk space only once.
+    Member is hashed before it is written, so only content which is not stored yet is written to disk.
+    Manifest maps relative paths of workspace files to hashes of their content.
+    """
+
+    @staticmethod
+    def extract(zip_file, workspace):
+        manifest = {}
+        blobs_path = WorkspaceStorageService.get_blobs_path()
+        for member in zip_file.infolist():
+            relative_path = WorkspaceStorageService.get_safe_relative_path(member.filename)
+            if not relative_path or member.filename.endswith('/'):
+                continue
+
+            target_path = os.path.join(workspace, relative_path)
+            ensure_directory_exists(os.path.dirname(target_path))
+            ensure_directory_exists(blobs_path)
+
+            with zip_file.open(member) as member_file:
+                content_hash = WorkspaceStorageService.get_content_hash(member_file)
+            if not WorkspaceStorageService.link_blob(content_hash, target_path):
+                with zip_file.open(member) as member_file:
+                    WorkspaceStorageService.store_blob(member_file, content_hash, blobs_path)
+                os.link(WorkspaceStorageService.get_blob_path(content_hash), target_path)
+            manifest[relative_path] = content_hash
+
+        return manifest
+
+    @staticmethod
+    def get_content_hash(source_file):
+        digest = hashlib.sha256()
+        for data in iter(lambda: source_file.read(READ_SIZE), b''):
+            digest.update(data)
+        return digest.hexdigest()
+
+    @staticmethod
+    def link_blob(content_hash, target_path):
+        """
+        Links existing blob to the workspace, returns False if blob is not stored yet.
+        """
+        try:
+            os.link(WorkspaceStorageService.get_blob_path(content_hash), target_path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        return True
+
+    @staticmethod
+    def store_blob(source_file, content_hash, blobs_path):
+        """
+        Blob is written to a temporary file and renamed, so that it is visible only when complete.
+        """
+        descriptor, temporary_path = tempfile.mkstemp(dir=blobs_path, prefix='.upload-')
+        try:
+            with os.fdopen(descriptor, 'wb') as temporary_file:
+                for data in iter(lambda: source_file.read(READ_SIZE), b''):
+                    temporary_file.write(data)
+            os.chmod(temporary_path, BLOB_MODE)
+            blob_path = WorkspaceStorageService.get_blob_path(content_hash)
+            ensure_directory_exists(os.path.dirname(blob_path))
+            os.rename(temporary_path, blob_path)
+        except Exception:
+            os.remove(temporary_path)
+            raise
+
+    @staticmethod
+    def collect_garbage(content_hashes=None):
+        """
+        Removes blobs which are not linked to any workspace anymore.
+        All blobs are checked if content_hashes is not given.
+        """
+        if content_hashes is None:
+            content_hashes = WorkspaceStorageService.list_blobs()
+        expiration_time = time.time() - BLOB_GARBAGE_COLLECTION_DELAY
+        for content_hash in set(content_hashes):
+            blob_path = WorkspaceStorageService.get_blob_path(content_hash)
+            try:
+                stat = os.stat(blob_path)
+                if stat.st_nlink == 1 and stat.st_mtime < expiration_time:
+                    os.remove(blob_path)
+                    logger.debug('Blob %s has been deleted.', content_hash)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    @staticmethod
+    def list_blobs():
+        blobs_path = WorkspaceStorageService.get_blobs_path()
+        if not os.path.isdir(blobs_path):
+            return
+        for prefix in os.listdir(blobs_path):
+            prefix_path = os.path.join(blobs_path, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_path):
+                continue
+            for content_hash in os.listdir(prefix_path):
+                yield content_hash
+
+    @staticmethod
+    def get_manifest_hash(manifest):
+        return hashlib.sha256(json.dumps(manifest, sort_keys=True)).hexdigest()
+
+    @staticmethod
+    def get_safe_relative_path(filename):
+        """
+        Returns normalized path of archive member, or None if it points outside of the workspace.
+        """
+        path = os.path.normpath(filename.replace('\\', '/')).lstrip('/')
+        if path in ('', '.') or path == '..' or path.startswith('../'):
+            return None
+        return path
+
+    @staticmethod
+    def get_blobs_path():
+        return os.path.join(get_workspaces_base_path(), BLOBS_DIR_NAME)
+
+    @staticmethod
+    def get_blob_path(content_hash):
+        return os.path.join(WorkspaceStorageService.get_blobs_path(), content_hash[:2], content_hash)
+
+
+def get_workspaces_base_path():
+    return os.path.join(
+        settings.MEDIA_ROOT,
+        settings.WALDUR_ANSIBLE.get('PLAYBOOKS_DIR_NAME', 'ansible_playbooks'),
+    )
+
+
+def ensure_directory_exists(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise